@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio 版 DeepSeek 客戶端
+
+以單一 aiohttp.ClientSession 共用連線池，並以 semaphore 限制同時進行的請求數，
+讓協調程式可在同一個執行緒內 await asyncio.gather(...) 大量章節或分塊請求，
+不必為每個請求開一個 OS 執行緒。回應的 JSON 後處理與同步版 DeepseekClient 相同。
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from retry_policy import deepseek_retry
+from chat_completion import post_chat_completion_async, DEEPSEEK_STREAM, DEEPSEEK_CHAT_URL
+
+try:
+    import aiohttp
+except ImportError:  # 未安裝 aiohttp 時只能使用同步客戶端
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+DEEPSEEK_API_URL = DEEPSEEK_CHAT_URL  # 以環境變數 DEEPSEEK_BASE_URL 調整
+# 同時進行的 API 請求上限
+DEEPSEEK_MAX_CONCURRENCY = int(os.getenv("DEEPSEEK_MAX_CONCURRENCY", "8"))
+# 單次請求的逾時秒數
+DEEPSEEK_REQUEST_TIMEOUT = float(os.getenv("DEEPSEEK_REQUEST_TIMEOUT", "300"))
+
+def extract_json_content(content):
+    """若回應含 ```json 區塊且可解析，回傳正規化的 JSON 字串，否則回傳原始內容"""
+    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content)
+    if json_match:
+        json_str = json_match.group(1).strip()
+        try:
+            # 驗證 JSON 是否有效
+            parsed_json = json.loads(json_str)
+            return json.dumps(parsed_json, ensure_ascii=False)
+        except json.JSONDecodeError:
+            logger.warning("無法解析返回的 JSON 格式，返回原始內容")
+            return content
+    logger.warning("回應中找不到 JSON 格式，返回原始內容")
+    return content
+
+class AsyncDeepseekClient:
+    """
+    非同步 DeepSeek API 客戶端
+
+    用法：
+        async with AsyncDeepseekClient(api_key) as client:
+            results = await asyncio.gather(*(client.extract_content(p) for p in prompts))
+    """
+
+    def __init__(self, api_key, max_concurrency=DEEPSEEK_MAX_CONCURRENCY, timeout=DEEPSEEK_REQUEST_TIMEOUT,
+                 api_url=DEEPSEEK_API_URL, stream=DEEPSEEK_STREAM):
+        if aiohttp is None:
+            raise ImportError("AsyncDeepseekClient 需要安裝 aiohttp（pip install aiohttp）")
+        self.api_key = api_key
+        self.api_url = api_url
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.stream = stream
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        self._semaphore = None
+        self._semaphore_loop = None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self):
+        """延遲建立共用的 ClientSession（連線池大小與並行上限一致）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self._session
+
+    def _get_semaphore(self):
+        """在執行中的事件迴圈內延遲建立 semaphore（換了事件迴圈時重新建立）"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def chat(self, prompt, temperature=0.3, max_tokens=8192, model="deepseek-chat", timeout=None,
+                   stream=None, on_text=None):
+        """送出單一請求並回傳回應文字；串流模式下 on_text 即時收到新增的文字。重試用盡後拋出例外"""
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        if stream is None:
+            stream = self.stream
+
+        async def send():
+            async with self._get_semaphore():
+                start_time = time.time()
+                result = await post_chat_completion_async(self._get_session(), self.api_url, payload,
+                                                          timeout or self.timeout, stream, on_text)
+                logger.info(f"成功從 DeepSeek API 獲取回應，耗時 {time.time() - start_time:.1f} 秒")
+            return result
+
+        # 與同步客戶端共用重試策略與斷路器；重試等待期間不佔用並行名額
+        result = await deepseek_retry.call_async(send, "DeepSeek API")
+        return result["choices"][0]["message"]["content"]
+
+    async def extract_content(self, prompt, **kwargs):
+        """與 DeepseekClient.extract_content 相同：回傳 JSON 字串或原始內容，錯誤時回傳含 error 的 JSON"""
+        try:
+            content = await self.chat(prompt, **kwargs)
+            return extract_json_content(content)
+        except asyncio.TimeoutError as e:
+            # 串流模式下多半是資料間隔超過 STREAM_IDLE_TIMEOUT
+            error_msg = f"DeepSeek API 請求逾時（{str(e) or kwargs.get('timeout') or self.timeout}）"
+        except Exception as e:
+            error_msg = f"呼叫 DeepSeek API 時發生錯誤: {str(e)}"
+        logger.error(error_msg)
+        return json.dumps({"error": error_msg}, ensure_ascii=False)
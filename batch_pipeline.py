@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批次處理管線
+
+目錄模式下將每本書的處理拆成兩個階段，讓 CPU 與網路同時忙碌：
+1. 提取階段：ProcessPoolExecutor 平行解析 PDF（每本書在單一工作行程內提取）
+2. API 階段：固定數量的執行緒從有界佇列取出文本，呼叫 DeepSeek API 完成分析
+
+提取中的書與佇列都有上限，佇列滿時提取階段會暫停（背壓），
+因此即使目錄中有上萬本書，同時存在記憶體中的文本數量也是固定的。
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pdf_extractor import resolve_workers
+from token_estimator import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# 已提取、等待 API 階段處理的書籍數上限
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "8"))
+
+# 每個提取行程最多同時排入的書籍數
+EXTRACT_JOBS_PER_WORKER = 2
+
+def list_pdf_files(input_dir, max_files=0):
+    """列出目錄中的 PDF 檔案（依檔名排序），max_files 大於 0 時只取前幾個"""
+    pdf_files = sorted(
+        entry.path for entry in os.scandir(input_dir)
+        if entry.is_file() and entry.name.lower().endswith('.pdf')
+    )
+    if max_files > 0:
+        pdf_files = pdf_files[:max_files]
+    return pdf_files
+
+def _as_result(path, value, payload=None):
+    """將分析函式的回傳值正規化為結果字典"""
+    if isinstance(value, dict):
+        result = dict(value)
+    else:
+        result = {"success": bool(value)}
+    result.setdefault("filename", os.path.basename(path))
+    result.setdefault("success", False)
+    if "input_tokens" not in result and isinstance(payload, str):
+        result["input_tokens"] = count_tokens(payload)
+    return result
+
+def run_pipeline(paths, extract_func, analyze_func, extract_workers=None, api_workers=4,
+                 queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    以「提取 → 有界佇列 → API」兩階段管線處理所有檔案，回傳依輸入順序排列的結果列表
+
+    extract_func(path) 在工作行程中執行，必須是可 pickle 的模組層級函式（或其 partial）；
+    analyze_func(path, payload) 在 API 執行緒中執行，回傳結果字典或代表成功與否的值。
+    提取失敗（拋出例外或回傳空值）的書直接記為失敗，不進入 API 階段。
+    """
+    paths = list(paths)
+    extract_workers = resolve_workers(extract_workers)
+    api_workers = max(1, api_workers)
+    work_queue = queue.Queue(maxsize=max(1, queue_size))
+    results = {}
+    results_lock = threading.Lock()
+
+    def record(index, result):
+        with results_lock:
+            results[index] = result
+            done = len(results)
+        logger.info(f"已完成 {done}/{len(paths)}: {result['filename']}（{'成功' if result['success'] else '失敗'}）")
+
+    handed_over = set()
+
+    def hand_over(index, path, get_payload):
+        """取得提取結果並放入佇列；佇列已滿時在此阻塞，形成背壓"""
+        try:
+            payload = get_payload()
+        except BrokenProcessPool:
+            raise
+        except Exception as e:
+            handed_over.add(index)
+            record(index, {"filename": os.path.basename(path), "success": False, "error": f"文本提取失敗: {e}"})
+            return
+        handed_over.add(index)
+        if not payload:
+            # 提取函式已記錄原因並回傳空值；不交給 API 階段，以免分析函式改在 API 執行緒中重新提取
+            record(index, {"filename": os.path.basename(path), "success": False, "error": "文本提取失敗：無法從PDF提取文本"})
+            return
+        work_queue.put((index, path, payload))
+
+    def producer():
+        try:
+            with ProcessPoolExecutor(max_workers=extract_workers) as executor:
+                pending = deque()
+                for index, path in enumerate(paths):
+                    pending.append((index, path, executor.submit(extract_func, path).result))
+                    if len(pending) >= extract_workers * EXTRACT_JOBS_PER_WORKER:
+                        hand_over(*pending.popleft())
+                while pending:
+                    hand_over(*pending.popleft())
+        except (OSError, RuntimeError) as e:
+            # 例如受限環境無法建立子行程或行程池異常終止：尚未交出的書改在目前執行緒依序提取
+            logger.warning(f"平行提取失敗，改為單一行程提取: {e}")
+            for index, path in enumerate(paths):
+                if index not in handed_over:
+                    hand_over(index, path, lambda: extract_func(path))
+        finally:
+            for _ in range(api_workers):
+                work_queue.put(None)
+
+    def consumer():
+        while True:
+            item = work_queue.get()
+            if item is None:
+                break
+            index, path, payload = item
+            try:
+                result = _as_result(path, analyze_func(path, payload), payload)
+            except Exception as e:
+                logger.error(f"分析 {os.path.basename(path)} 時發生錯誤: {e}")
+                result = {"filename": os.path.basename(path), "success": False, "error": str(e)}
+            del payload, item
+            record(index, result)
+
+    logger.info(f"批次管線：{len(paths)} 個檔案，{extract_workers} 個提取行程，"
+                f"{api_workers} 個 API 執行緒，佇列上限 {queue_size}")
+    threads = [threading.Thread(target=producer, name="extract")]
+    threads += [threading.Thread(target=consumer, name=f"api-{i + 1}") for i in range(api_workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return [results[i] for i in sorted(results)]
+
+def log_batch_summary(results, elapsed, api_workers):
+    """輸出批次處理的成功／失敗統計與吞吐量"""
+    success_count = sum(1 for r in results if r["success"])
+    total_tokens = sum(r.get("input_tokens", 0) for r in results)
+    logger.info("\n===== 處理結果統計 =====")
+    logger.info(f"總檔案數: {len(results)}")
+    logger.info(f"成功處理: {success_count}")
+    logger.info(f"失敗檔案: {len(results) - success_count}")
+    if elapsed > 0:
+        logger.info(f"總耗時: {elapsed:.2f} 秒（{api_workers} 個 API 執行緒）")
+        logger.info(f"吞吐量: {success_count / elapsed * 3600:.1f} 本/小時，{total_tokens / elapsed:.1f} tokens/秒")
+
+    if len(results) - success_count > 0:
+        logger.info("\n失敗檔案清單:")
+        for r in results:
+            if not r["success"]:
+                logger.info(f"- {r['filename']}: {r.get('error', '未知錯誤')}")
+    return success_count
+
+def run_batch(input_dir, extract_func, analyze_func, extract_workers=None, api_workers=4, max_files=0):
+    """處理目錄中所有 PDF 並輸出統計，回傳結果列表"""
+    pdf_files = list_pdf_files(input_dir, max_files)
+    if not pdf_files:
+        logger.warning(f"沒有找到PDF檔案於目錄: {input_dir}")
+        return []
+    start_time = time.time()
+    results = run_pipeline(pdf_files, extract_func, analyze_func, extract_workers, api_workers)
+    log_batch_summary(results, time.time() - start_time, api_workers)
+    return results
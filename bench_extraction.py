@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF 文本提取效能測試
+
+比較不同工作行程數下 pdf_extractor.extract_pages 的每秒處理頁數，
+用法：python bench_extraction.py [--pdf book.pdf] [--pages 600]
+"""
+
+import os
+import time
+import argparse
+import tempfile
+from fpdf import FPDF
+from pdf_extractor import extract_pages, count_pages
+
+def create_sample_pdf(path, num_pages):
+    """產生指定頁數的測試用 PDF（每頁約 40 行英文文字）"""
+    pdf = FPDF(orientation='P', unit='mm', format='A4')
+    pdf.set_font("Helvetica", "", 10)
+    for page_num in range(num_pages):
+        pdf.add_page()
+        for line in range(40):
+            pdf.cell(0, 6, f"Page {page_num + 1} line {line + 1}: deep learning, neural networks and language models.", new_x="LMARGIN", new_y="NEXT")
+    pdf.output(path)
+
+def worker_counts(max_workers):
+    """1, 2, 4, ... 直到 CPU 核心數"""
+    counts = []
+    n = 1
+    while n < max_workers:
+        counts.append(n)
+        n *= 2
+    counts.append(max_workers)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description='PDF 文本提取效能測試')
+    parser.add_argument('--pdf', help='測試用 PDF 路徑（未提供時自動產生）')
+    parser.add_argument('--pages', type=int, default=600, help='自動產生的 PDF 頁數')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1, help='測試的最大行程數')
+    parser.add_argument('--repeat', type=int, default=3, help='每種設定重複次數（取最佳值）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = args.pdf
+        if not pdf_path:
+            pdf_path = os.path.join(tmp_dir, "bench_book.pdf")
+            print(f"產生 {args.pages} 頁測試 PDF...")
+            create_sample_pdf(pdf_path, args.pages)
+
+        num_pages = count_pages(pdf_path)
+        print(f"PDF 頁數: {num_pages}，CPU 核心數: {os.cpu_count()}")
+        print(f"{'行程數':>6} {'耗時(秒)':>10} {'頁/秒':>10} {'加速比':>8}")
+
+        baseline = None
+        for workers in worker_counts(args.max_workers):
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                pages = extract_pages(pdf_path, workers=workers, use_cache=False)
+                best = min(best, time.perf_counter() - start)
+            assert len(pages) == num_pages
+            if baseline is None:
+                baseline = best
+            print(f"{workers:>6} {best:>10.2f} {num_pages / best:>10.1f} {baseline / best:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+完整流程效能測試（以卡帶重播 API 回應）
+
+先以 --record 對正式 API 跑一次並錄製卡帶，之後的重播不連網、結果固定，
+可專心比較提取、分塊與報告生成等 CPU 端修改前後的耗時：
+    python bench_pipeline.py --pdf book.pdf --target deepseek_processor --record
+    python bench_pipeline.py --pdf book.pdf --target deepseek_processor --repeat 5
+    python bench_pipeline.py --pdf book.pdf --target large_pdf --latency-scale 1   # 含錄製時的 API 延遲
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+import statistics
+import importlib.util
+
+# 各測試目標：(腳本檔名, 說明)
+TARGETS = {
+    "deepseek_processor": ("deepseek_processor.py", "process_single_file：提取、分析、翻譯與輸出報告"),
+    "large_pdf": ("deepseek_processor.py", "process_large_pdf：大型文本的多階段分析"),
+    "pdf-book-main": ("pdf-book-main.py", "process_book：七部分報告"),
+    "book_analyzer": ("book_analyzer.py", "process_book：分塊分析"),
+    "multi_section_analyzer": ("multi_section_analyzer.py", "process_book：三部分報告"),
+    "deep_book_analyzer": ("deep_book_analyzer.py", "process_book：單次分析"),
+}
+
+def load_script(file_name):
+    """載入腳本模組（檔名可含連字號）"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), file_name)
+    spec = importlib.util.spec_from_file_location(os.path.splitext(file_name)[0].replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def build_runner(target, pdf_path, use_text_cache, output_dir):
+    """回傳執行一次完整流程的函式"""
+    module = load_script(TARGETS[target][0])
+    if target == "deepseek_processor":
+        return lambda: module.process_single_file(pdf_path, output_dir, use_text_cache=use_text_cache)
+    if target == "large_pdf":
+        def run():
+            text = module.extract_pdf_text(pdf_path, use_text_cache=use_text_cache)
+            result = module.process_large_pdf(text)
+            if result is None:
+                print("警告：文本未超過分段處理門檻，process_large_pdf 未執行分析")
+            return result
+        return run
+    return lambda: module.process_book(pdf_path, use_text_cache=use_text_cache)
+
+def main():
+    parser = argparse.ArgumentParser(description='完整流程效能測試（卡帶重播）')
+    parser.add_argument('--pdf', required=True, help='測試用 PDF 路徑')
+    parser.add_argument('--target', choices=sorted(TARGETS), default='deepseek_processor', help='測試的流程')
+    parser.add_argument('--cassette', default='api_cassette.jsonl.gz', help='卡帶檔案路徑')
+    parser.add_argument('--record', action='store_true', help='呼叫正式 API 並錄製卡帶（只執行一次）')
+    parser.add_argument('--repeat', type=int, default=3, help='重播次數')
+    parser.add_argument('--latency-scale', type=float, default=0.0, help='重播時等待錄製耗時的倍數（0 代表立即回應）')
+    parser.add_argument('--text-cache', action='store_true', help='使用提取文本快取（預設略過，以計入提取耗時）')
+    args = parser.parse_args()
+
+    # 各模組在載入時讀取設定，必須先設定環境變數
+    os.environ["CASSETTE_MODE"] = "record" if args.record else "replay"
+    os.environ["CASSETTE_PATH"] = args.cassette
+    os.environ["CASSETTE_LATENCY_SCALE"] = str(args.latency_scale)
+    if not args.record:
+        os.environ["USAGE_LEDGER"] = "0"  # 重播不計費，不寫入用量帳本
+        os.environ.setdefault("DEEPSEEK_API_KEY", "replay")
+        if not os.path.exists(args.cassette):
+            parser.error(f"找不到卡帶 {args.cassette}，請先以 --record 錄製")
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        run = build_runner(args.target, args.pdf, args.text_cache, output_dir)
+        from cassette import api_cassette
+
+        print(f"測試目標: {args.target}（{TARGETS[args.target][1]}）")
+        timings = []
+        for i in range(1 if args.record else args.repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+            print(f"第 {i + 1} 次: {timings[-1]:.2f} 秒")
+
+        if args.record:
+            print(f"已錄製 {api_cassette.recorded} 筆呼叫至 {args.cassette}")
+        else:
+            print(f"最佳 {min(timings):.2f} 秒，中位數 {statistics.median(timings):.2f} 秒，"
+                  f"共重播 {api_cassette.replayed} 筆呼叫")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+token 估算效能測試
+
+比較原本的純 Python 估算、NumPy 向量化估算與批次估算的速度，
+用法：python bench_tokens.py [--mb 4] [--chunks 5000]
+"""
+
+import time
+import random
+import argparse
+from token_estimator import estimate_tokens, estimate_tokens_python, estimate_tokens_batch
+from token_index import TokenIndex
+
+SAMPLE_PARAGRAPHS = [
+    "深度學習是機器學習的一個分支，透過多層神經網路學習資料的表示方式。",
+    "Transformer models use self-attention to capture long-range dependencies in text.",
+    "本書第三章討論了 GPT-4 與 BERT 在 2023 年的應用案例，並比較其效能差異。",
+    "The author argues that interpretability matters as much as raw accuracy.",
+]
+
+def make_text(target_chars, seed=0):
+    """以混合中英文段落組出約 target_chars 字元的文本"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < target_chars:
+        paragraph = " ".join(rng.choice(SAMPLE_PARAGRAPHS) for _ in range(rng.randint(3, 8)))
+        parts.append(paragraph)
+        length += len(paragraph) + 2
+    return "\n\n".join(parts)
+
+def best_of(func, repeat):
+    """重複執行取最短耗時"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='token 估算效能測試')
+    parser.add_argument('--mb', type=float, default=4, help='長文本大小（百萬字元）')
+    parser.add_argument('--chunks', type=int, default=5000, help='批次估算的文本塊數')
+    parser.add_argument('--repeat', type=int, default=3, help='每項測試重複次數（取最佳值）')
+    args = parser.parse_args()
+
+    text = make_text(int(args.mb * 1_000_000))
+    print(f"長文本: {len(text):,} 字元")
+    python_time, python_tokens = best_of(lambda: estimate_tokens_python(text), args.repeat)
+    numpy_time, numpy_tokens = best_of(lambda: estimate_tokens(text), args.repeat)
+    assert python_tokens == numpy_tokens
+    print(f"{'純 Python':<14} {python_time:>8.3f} 秒")
+    print(f"{'向量化':<14} {numpy_time:>8.3f} 秒  ({python_time / numpy_time:.1f}x)")
+
+    chunks = [make_text(random.randint(200, 2000), seed=i) for i in range(args.chunks)]
+    print(f"\n批次: {len(chunks):,} 個文本塊")
+    loop_time, loop_counts = best_of(lambda: [estimate_tokens_python(chunk) for chunk in chunks], args.repeat)
+    batch_time, batch_counts = best_of(lambda: estimate_tokens_batch(chunks), args.repeat)
+    assert loop_counts == batch_counts
+    print(f"{'逐塊 Python':<14} {loop_time:>8.3f} 秒")
+    print(f"{'批次向量化':<14} {batch_time:>8.3f} 秒  ({loop_time / batch_time:.1f}x)")
+
+    print(f"\nTokenIndex 建立（{len(text):,} 字元）")
+    loop_time, _ = best_of(lambda: TokenIndex(text, estimate_tokens_python), args.repeat)
+    batch_time, _ = best_of(lambda: TokenIndex(text), args.repeat)
+    print(f"{'逐段 Python':<14} {loop_time:>8.3f} 秒")
+    print(f"{'批次向量化':<14} {batch_time:>8.3f} 秒  ({loop_time / batch_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -8,17 +8,23 @@ PDF 書籍分析工具
 """
 
 import os
-import sys
 import json
 import time
 import logging
 import argparse
-import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-import PyPDF2
+from pdf_extractor import iter_pages
+from http_session import log_session_metrics  # 共用連線池
+from retry_policy import APIRequestError, deepseek_retry
+from response_cache import log_cache_stats
+from usage_ledger import set_call_context, call_context, labeled  # 用量帳本依書籍與階段標示每次呼叫
+from chat_completion import post_chat_completion, json_field_watcher, log_prompt_cache_stats, DEEPSEEK_CHAT_URL
+from token_index import TokenIndex
+from chunk_planner import plan_chunks
+from batch_pipeline import run_batch
 import re
-import math
 from dotenv import load_dotenv
 import opencc
 
@@ -30,13 +36,16 @@ load_dotenv()
 # ==========================
 # 設定API密鑰
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "your_deepseek_api_key_here")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = DEEPSEEK_CHAT_URL  # 以環境變數 DEEPSEEK_BASE_URL 調整
 
 # 建立桌面上的輸出資料夾
 DESKTOP_PATH = str(Path.home() / "Desktop")
 OUTPUT_FOLDER = os.path.join(DESKTOP_PATH, "書籍分析結果")
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# 大型書籍分段分析時同時送出的 API 請求數
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", "4"))
+
 # 初始化 OpenCC（簡體轉繁體）
 cc = opencc.OpenCC('s2tw')  # 針對台灣繁體中文進行最佳化
 
@@ -54,58 +63,10 @@ logger = logging.getLogger(__name__)
 # ==========================
 # 輔助函數
 # ==========================
-def estimate_tokens(text):
-    """估算文字的 token 數量"""
-    # 一個中文字約為1.5個token，一個英文單詞約為1個token
-    chinese_char_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-    total_char_count = len(text)
-    english_word_count = len(re.findall(r'\b[a-zA-Z]+\b', text))
-    
-    # 估算總token數
-    estimated_tokens = chinese_char_count * 1.5 + english_word_count + (total_char_count - chinese_char_count - english_word_count) * 0.5
-    return int(estimated_tokens)
-
-def split_text_into_chunks(text, max_tokens=8000):
+def split_text_into_chunks(text, max_tokens=8000, token_index=None):
     """將文本分割成較小的塊，以符合 API 限制"""
-    estimated_total_tokens = estimate_tokens(text)
-    
-    if estimated_total_tokens <= max_tokens:
-        return [text]
-    
-    # 計算需要的塊數
-    num_chunks = math.ceil(estimated_total_tokens / max_tokens)
-    chunk_size = len(text) // num_chunks
-    
-    # 確保在完整段落處分割
-    chunks = []
-    start = 0
-    
-    for i in range(1, num_chunks):
-        # 尋找最接近的段落結尾
-        end = min(start + chunk_size, len(text))
-        
-        # 嘗試在段落結束處分割
-        paragraph_end = text.rfind('\n\n', start, end)
-        if paragraph_end != -1 and paragraph_end > start + chunk_size // 2:
-            end = paragraph_end + 2  # 包含兩個換行符
-        else:
-            # 如果找不到段落結束，嘗試在句子結束處分割
-            sentence_end = max(
-                text.rfind('. ', start, end),
-                text.rfind('。', start, end),
-                text.rfind('！', start, end),
-                text.rfind('？', start, end)
-            )
-            if sentence_end != -1 and sentence_end > start + chunk_size // 2:
-                end = sentence_end + 1
-        
-        chunks.append(text[start:end])
-        start = end
-    
-    # 添加最後一個塊
-    chunks.append(text[start:])
-    
-    return chunks
+    # 依章節對齊規劃分塊，切點以前綴和索引二分搜尋，全文只需估算一次 token
+    return [span.text() for span in plan_chunks(text, max_tokens, token_index)]
 
 def ensure_json_format(text):
     """確保回傳的文本是有效的 JSON 格式"""
@@ -153,77 +114,52 @@ class DeepseekClient:
         }
     
     def extract_content(self, prompt, max_retries=3, model="deepseek-chat"):
-        """使用 Deepseek API 提取內容"""
-        retry_count = 0
-        
-        while retry_count < max_retries:
-            try:
-                logger.info(f"呼叫 Deepseek API (嘗試 {retry_count + 1}/{max_retries})")
-                
-                payload = {
-                    "model": model,
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ],
-                    "temperature": 0.5,
-                    "max_tokens": 4000,
-                }
-                
-                response = requests.post(
-                    self.api_url, 
-                    headers=self.headers, 
-                    json=payload,
-                    timeout=120
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-                    
-                    if content:
-                        # 轉換為繁體中文
-                        content = cc.convert(content)
-                        return ensure_json_format(content)
-                    else:
-                        logger.error(f"API 返回空內容")
-                else:
-                    logger.error(f"API 請求失敗: {response.status_code} - {response.text}")
-                
-                retry_count += 1
-                time.sleep(5)  # 在重試前等待
-                
-            except Exception as e:
-                logger.error(f"API 調用錯誤: {str(e)}")
-                retry_count += 1
-                time.sleep(5)  # 在重試前等待
-        
-        return {"error": "達到最大重試次數後仍無法獲取內容"}
+        """使用 Deepseek API 提取內容（429／5xx／逾時與空回應依共用重試策略重試）"""
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.5,
+            "max_tokens": 4000,
+        }
+        
+        def send():
+            logger.info("呼叫 Deepseek API")
+            # 串流接收時，JSON 欄位一完成就寫入日誌，停滯的串流會提前中止
+            result = post_chat_completion(self.api_url, self.headers, payload, timeout=120,
+                                          on_text=json_field_watcher())
+            content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+            if not content:
+                raise APIRequestError("API 返回空內容")
+            return content
+        
+        try:
+            content = deepseek_retry.call(send, "Deepseek API", max_attempts=max_retries)
+        except Exception as e:
+            logger.error(f"API 調用錯誤: {str(e)}")
+            return {"error": "達到最大重試次數後仍無法獲取內容"}
+        
+        # 轉換為繁體中文
+        content = cc.convert(content)
+        return ensure_json_format(content)
 
 # ==========================
 # PDF 處理函數
 # ==========================
-def extract_pdf_text(pdf_file):
-    """從 PDF 提取文本"""
+def extract_pdf_text(pdf_file, extract_workers=None, use_text_cache=True):
+    """從 PDF 提取文本（優先讀取以檔案內容雜湊為鍵的文本快取）"""
     try:
         logger.info(f"開始提取 PDF 文本: {pdf_file}")
-        text = ""
         
-        with open(pdf_file, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            num_pages = len(reader.pages)
-            
-            logger.info(f"PDF 共有 {num_pages} 頁")
-            
-            for page_num in range(num_pages):
-                page = reader.pages[page_num]
-                page_text = page.extract_text()
-                
-                if page_text:
-                    text += page_text + "\n\n"
-                
-                # 每10頁記錄一次進度
-                if (page_num + 1) % 10 == 0 or page_num == num_pages - 1:
-                    logger.info(f"已處理 {page_num + 1}/{num_pages} 頁")
+        # 逐頁串流讀取（頁面分片由多個行程平行提取，依頁碼順序交出）
+        parts = []
+        num_pages = 0
+        for num_pages, page_text in iter_pages(pdf_file, workers=extract_workers, use_cache=use_text_cache):
+            if page_text:
+                parts.append(page_text + "\n\n")
+        logger.info(f"PDF 共有 {num_pages} 頁")
+        text = "".join(parts)
         
         if not text.strip():
             logger.warning("提取的 PDF 文本為空")
@@ -233,11 +169,13 @@ def extract_pdf_text(pdf_file):
         logger.error(f"提取 PDF 文本時發生錯誤: {str(e)}")
         raise
 
-def analyze_book_content(text):
+def analyze_book_content(text, chunk_workers=CHUNK_WORKERS):
     """使用 Deepseek API 分析書籍內容"""
     try:
         start_time = time.time()
-        estimated_tokens = estimate_tokens(text)
+        # 建立一次前綴和索引，分段處理時直接沿用
+        token_index = TokenIndex(text)
+        estimated_tokens = token_index.total_tokens
         logger.info(f"估計書籍文本約含有 {estimated_tokens} tokens")
         
         # 建立提示詞
@@ -293,98 +231,98 @@ def analyze_book_content(text):
         {{
             "title": "書名",
             "author": "作者",
-            "module_1": {
+            "module_1": {{
                 "author_background": "作者簡介與背景影響（500-800字）",
                 "writing_motivation": "寫作動機與核心主題（500-800字）",
                 "book_positioning": "書籍定位與影響力（500-800字）"
-            },
-            "module_2": {
+            }},
+            "module_2": {{
                 "core_summary": "全書主要內容摘要（800-1200字）",
                 "key_theories": [
-                    {
+                    {{
                         "theory_name": "理論或策略名稱",
                         "explanation": "理論或策略解釋（300-500字）",
                         "application": "應用場景與價值（200-300字）"
-                    }
+                    }}
                 ],
                 "key_quotes": [
-                    {
+                    {{
                         "quote": "金句或核心段落",
                         "interpretation": "詮釋或應用說明（100-200字）"
-                    }
+                    }}
                 ]
-            },
-            "module_3": {
+            }},
+            "module_3": {{
                 "chapter_analysis": [
-                    {
+                    {{
                         "chapter_number": "章節編號（如有）",
                         "chapter_title": "章節標題",
                         "content_analysis": "論述內容與邏輯層次分析（500-800字）",
                         "core_concepts": [
-                            {
+                            {{
                                 "concept_name": "概念名稱",
                                 "explanation": "概念解釋與內部邏輯（200-300字）"
-                            }
+                            }}
                         ],
                         "connection_analysis": "與其他章節的邏輯銜接（200-300字）",
                         "key_cases": [
-                            {
+                            {{
                                 "case_description": "案例或引述描述", 
                                 "significance": "代表性與深層意涵（200-300字）"
-                            }
+                            }}
                         ]
-                    }
+                    }}
                 ]
-            },
-            "module_4": {
+            }},
+            "module_4": {{
                 "underlying_logic": "本書隱含的世界觀與預設立場（600-800字）",
                 "concept_system": "作者概念體系的內在邏輯關聯（800-1000字）",
                 "theoretical_assessment": "理論體系的一致性、預測性與延展性分析（600-800字）",
                 "limitations": [
-                    {
+                    {{
                         "limitation_type": "矛盾或限制類型",
                         "explanation": "詳細解釋（200-300字）"
-                    }
+                    }}
                 ]
-            },
-            "module_5": {
+            }},
+            "module_5": {{
                 "interdisciplinary_applications": [
-                    {
+                    {{
                         "field": "領域名稱",
                         "application": "核心觀點在此領域的應用（300-500字）"
-                    }
+                    }}
                 ],
                 "systemic_implications": "系統的變化性評估（500-700字）",
                 "comparative_dialogue": [
-                    {
+                    {{
                         "referenced_work": "相關經典著作",
                         "dialogue": "觀點對話與整合見解（300-400字）"
-                    }
+                    }}
                 ]
-            },
-            "module_6": {
+            }},
+            "module_6": {{
                 "critical_review": "批判性審視（700-900字）",
                 "philosophical_questions": [
-                    {
+                    {{
                         "question": "理性辯證提問",
                         "rationale": "提問背後的思考邏輯（200-300字）"
-                    }
+                    }}
                 ],
                 "contemporary_gaps": "當代環境下的理論遺漏與侷限（500-700字）"
-            },
-            "module_7": {
+            }},
+            "module_7": {{
                 "mind_map_description": "思維導圖結構文字描述（500-700字）",
                 "key_terms": [
-                    {
+                    {{
                         "term": "關鍵詞彙",
                         "definition": "簡要定義與語境說明（100-150字）"
-                    }
+                    }}
                 ],
                 "recommended_reading": [
-                    {
+                    {{
                         "book_title": "推薦書籍",
                         "relevance": "與本書的關聯性與互補性（100-200字）"
-                    }
+                    }}
                 ]
             }}
         }}
@@ -398,16 +336,15 @@ def analyze_book_content(text):
         5. 回應採用繁體中文，語句專業、嚴謹、具邏輯性
         """
         
-        """
-        
         # 分割長文本處理
         if estimated_tokens > 8000:
             logger.info("文本過長，將分段處理")
-            return process_large_book(text)
+            return process_large_book(text, token_index, chunk_workers)
         else:
             # 呼叫 Deepseek API
             client = DeepseekClient(DEEPSEEK_API_KEY)
-            response = client.extract_content(prompt)
+            with call_context(section="analysis"):
+                response = client.extract_content(prompt)
             
             # 記錄處理時間
             elapsed_time = time.time() - start_time
@@ -430,17 +367,64 @@ def analyze_book_content(text):
         traceback.print_exc()
         return {"error": error_message}
 
-def process_large_book(text):
+def analyze_chunk(client, title, index, total, span):
+    """map 階段：分析單一文本塊，失敗時回傳 None"""
+    logger.info(f"處理第 {index + 1}/{total} 部分（約 {span.tokens} tokens）...")
+    chunk = span.text()
+    
+    # 為每個部分構建提示詞
+    chunk_prompt = f"""
+    這是一本名為「{title}」的書籍的第 {index + 1}/{total} 部分。
+    請分析這部分內容，提取章節信息和重點內容。這是完整書籍的一部分，請專注於這部分文本內容的分析。
+
+    文本內容：
+    ```
+    {chunk}
+    ```
+
+    請以有效的 JSON 格式回傳以下信息：
+    ```json
+    {{
+        "identified_chapters": [
+            {{
+                "chapter_number": "章節編號（如有）",
+                "chapter_title": "章節標題",
+                "summary": "章節摘要（300-500字）",
+                "key_points": ["關鍵點1", "關鍵點2", "關鍵點3", "關鍵點4", "關鍵點5"],
+                "key_concepts": [
+                    {{
+                        "concept": "概念名稱",
+                        "explanation": "概念解釋"
+                    }}
+                ],
+                "practical_value": "實用價值分析"
+            }}
+        ],
+        "partial_overview": "基於此部分的書籍概述",
+        "partial_evaluation": "基於此部分的評價"
+    }}
+    ```
+    """
+    
+    # 呼叫 API
+    chunk_result = client.extract_content(chunk_prompt)
+    
+    if "error" in chunk_result:
+        logger.warning(f"處理第 {index + 1} 部分時出錯，略過此部分")
+        return None
+    return chunk_result
+
+def process_large_book(text, token_index=None, chunk_workers=CHUNK_WORKERS):
     """處理大型書籍文本，分段送入API處理後合併結果"""
     start_time = time.time()
     logger.info("開始處理大型書籍文本...")
     
-    # 分割文本
-    chunks = split_text_into_chunks(text)
+    # 規劃分塊（章節對齊，僅記錄區段位置）
+    chunks = plan_chunks(text, 8000, token_index)
     logger.info(f"文本已分割為 {len(chunks)} 個片段")
     
     # 先處理第一部分，獲取基本結構
-    first_chunk = chunks[0]
+    first_chunk = chunks[0].text()
     client = DeepseekClient(DEEPSEEK_API_KEY)
     
     # 為第一部分構建提示詞
@@ -476,7 +460,8 @@ def process_large_book(text):
     """
     
     logger.info("分析第一部分，獲取書籍基本結構...")
-    base_structure = client.extract_content(first_prompt)
+    with call_context(section="structure"):
+        base_structure = client.extract_content(first_prompt)
     
     if "error" in base_structure:
         logger.error("無法獲取書籍基本結構，終止處理")
@@ -493,50 +478,17 @@ def process_large_book(text):
         "evaluation": ""
     }
     
-    # 對每個文本塊進行處理
-    logger.info("開始處理各部分內容...")
-    for i, chunk in enumerate(chunks):
-        logger.info(f"處理第 {i+1}/{len(chunks)} 部分...")
-        
-        # 為每個部分構建提示詞
-        chunk_prompt = f"""
-        這是一本名為「{final_result['title']}」的書籍的第 {i+1}/{len(chunks)} 部分。
-        請分析這部分內容，提取章節信息和重點內容。這是完整書籍的一部分，請專注於這部分文本內容的分析。
-
-        文本內容：
-        ```
-        {chunk}
-        ```
-
-        請以有效的 JSON 格式回傳以下信息：
-        ```json
-        {{
-            "identified_chapters": [
-                {{
-                    "chapter_number": "章節編號（如有）",
-                    "chapter_title": "章節標題",
-                    "summary": "章節摘要（300-500字）",
-                    "key_points": ["關鍵點1", "關鍵點2", "關鍵點3", "關鍵點4", "關鍵點5"],
-                    "key_concepts": [
-                        {
-                            "concept": "概念名稱",
-                            "explanation": "概念解釋"
-                        }
-                    ],
-                    "practical_value": "實用價值分析"
-                }
-            ],
-            "partial_overview": "基於此部分的書籍概述",
-            "partial_evaluation": "基於此部分的評價"
-        }}
-        ```
-        """
-        
-        # 呼叫 API
-        chunk_result = client.extract_content(chunk_prompt)
-        
-        if "error" in chunk_result:
-            logger.warning(f"處理第 {i+1} 部分時出錯，繼續處理下一部分")
+    # map 階段：各文本塊的提示詞只依賴第一次呼叫取得的書名，可並行送出
+    logger.info(f"開始處理各部分內容（最多同時 {chunk_workers} 個請求）...")
+    with ThreadPoolExecutor(max_workers=max(1, chunk_workers)) as executor:
+        chunk_results = list(executor.map(
+            labeled(lambda item: analyze_chunk(client, final_result["title"], item[0], len(chunks), item[1]), section="chunk"),
+            enumerate(chunks)
+        ))
+    
+    # reduce 階段：依原始順序合併各塊結果
+    for i, chunk_result in enumerate(chunk_results):
+        if chunk_result is None:
             continue
         
         # 合併結果
@@ -576,7 +528,8 @@ def process_large_book(text):
     """
     
     logger.info("進行最終整合分析...")
-    final_integration = client.extract_content(final_prompt)
+    with call_context(section="integration"):
+        final_integration = client.extract_content(final_prompt)
     
     if "error" not in final_integration:
         final_result["overview"] = final_integration.get("comprehensive_overview", final_result["overview"])
@@ -685,12 +638,13 @@ def generate_markdown(data, output_file):
 # ==========================
 # 主要處理函數
 # ==========================
-def process_book(input_file):
-    """處理單一 PDF 書籍檔案的完整流程"""
+def process_book(input_file, extract_workers=None, use_text_cache=True, chunk_workers=CHUNK_WORKERS, pdf_text=None):
+    """處理單一 PDF 書籍檔案的完整流程（批次模式下由管線傳入已提取的 pdf_text）"""
     try:
         start_time = time.time()
         file_name = os.path.basename(input_file)
         book_name = os.path.splitext(file_name)[0]
+        set_call_context(book=book_name)
         
         logger.info(f"開始處理書籍：{book_name}")
         
@@ -699,8 +653,9 @@ def process_book(input_file):
         os.makedirs(book_folder, exist_ok=True)
         
         # 提取 PDF 文本內容
-        logger.info("正在提取 PDF 文本...")
-        pdf_text = extract_pdf_text(input_file)
+        if pdf_text is None:
+            logger.info("正在提取 PDF 文本...")
+            pdf_text = extract_pdf_text(input_file, extract_workers, use_text_cache)
         
         if not pdf_text:
             logger.error("PDF 文本提取失敗或內容為空")
@@ -714,7 +669,7 @@ def process_book(input_file):
         
         # 分析書籍內容
         logger.info("正在使用 Deepseek API 分析書籍內容...")
-        analysis_result = analyze_book_content(pdf_text)
+        analysis_result = analyze_book_content(pdf_text, chunk_workers)
         
         if "error" in analysis_result:
             logger.error(f"分析失敗：{analysis_result['error']}")
@@ -739,6 +694,9 @@ def process_book(input_file):
         elapsed_time = time.time() - start_time
         minutes, seconds = divmod(elapsed_time, 60)
         logger.info(f"書籍處理完成，總耗時: {int(minutes)}分{seconds:.2f}秒")
+        log_session_metrics()
+        log_cache_stats()
+        log_prompt_cache_stats()
         logger.info(f"所有檔案已保存在：{book_folder}")
         
         return True
@@ -756,6 +714,17 @@ def main():
     """主程式入口點"""
     parser = argparse.ArgumentParser(description='PDF 書籍分析工具')
     parser.add_argument('input_file', nargs='?', help='要處理的 PDF 檔案路徑')
+    parser.add_argument('--extract-workers', type=int, default=0,
+                        help='PDF 文本提取的並行行程數（0=依 CPU 核心數）')
+    parser.add_argument('--no-text-cache', action='store_true',
+                        help='不使用 PDF 提取文本快取，強制重新解析 PDF')
+    parser.add_argument('--chunk-workers', type=int, default=CHUNK_WORKERS,
+                        help='大型書籍分段分析時同時送出的 API 請求數')
+    parser.add_argument('--input-dir', help='批次模式：處理目錄中所有 PDF 檔案')
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help='批次模式下同時呼叫 API 分析的書籍數')
+    parser.add_argument('--max-files', type=int, default=0,
+                        help='批次模式下最多處理的檔案數（0=不限制）')
     args = parser.parse_args()
     
     print("=" * 80)
@@ -764,6 +733,22 @@ def main():
     print(f"結果將存放於桌面的「{os.path.basename(OUTPUT_FOLDER)}」資料夾中")
     print("=" * 80)
     
+    # 批次模式：提取與 API 分析以管線重疊進行
+    if args.input_dir:
+        if not os.path.isdir(args.input_dir):
+            print(f"錯誤：找不到目錄 '{args.input_dir}'")
+            return
+        results = run_batch(
+            args.input_dir,
+            partial(extract_pdf_text, extract_workers=1, use_text_cache=not args.no_text_cache),
+            lambda pdf_file, pdf_text: process_book(pdf_file, chunk_workers=args.chunk_workers, pdf_text=pdf_text),
+            extract_workers=args.extract_workers,
+            api_workers=args.max_workers,
+            max_files=args.max_files,
+        )
+        print(f"批次處理完成：{sum(1 for r in results if r['success'])}/{len(results)} 本成功，結果保存在：{OUTPUT_FOLDER}")
+        return
+    
     # 如果沒有提供檔案路徑，則請求使用者輸入
     input_file = args.input_file
     if not input_file:
@@ -779,7 +764,7 @@ def main():
         return
     
     # 處理書籍
-    success = process_book(input_file)
+    success = process_book(input_file, args.extract_workers, not args.no_text_cache, args.chunk_workers)
     
     if success:
         print(f"處理完成！結果保存在：{OUTPUT_FOLDER}")
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文本邊界索引
+
+以單一正規表示式線性掃描一次文本，將章節標題、頁面標記、段落（\n\n）與句子（。！？. ）
+的位置記錄在精簡的 array('I') 中。TokenIndex 保存建立時取得的索引供分塊規劃沿用，
+split_large_text 等其他查詢則經由以文本雜湊為鍵的小型快取共用，不再各自以 rfind 或 re.split 重複掃描。
+快取只保存索引陣列而不保存文本本身；逐頁截斷這類一次性的短文本不進入快取。
+"""
+
+import re
+import hashlib
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+# 同時保留索引的文件數量
+BOUNDARY_CACHE_SIZE = 8
+
+# 章節標題沿用 split_large_text 的格式，但限定出現在行首，避免內文提及「第三章」時誤判
+CHAPTER_HEADING = r'^[ \t]*(?:第[一二三四五六七八九十百零0-9１２３４５６７８９０]+[章節课]|Chapter\s+\d+|CHAPTER\s+\d+)'
+
+# 各種邊界合併為一個樣式，單次 finditer 即可完成掃描
+BOUNDARY_PATTERN = re.compile(
+    r'(?P<page>--- 第 (?P<page_no>\d+) 頁 ---)'
+    r'|(?P<chapter>' + CHAPTER_HEADING + r')'
+    r'|(?P<paragraph>\n\n)'
+    r'|(?P<sentence>[。！？]|\. )',
+    re.MULTILINE
+)
+
+# split_by_length 由粗到細嘗試的切點層級
+SPLIT_LEVELS = ("chapters", "paragraphs", "sentences")
+
+class BoundaryIndex:
+    """
+    一份文本的所有邊界位置
+
+    chapters 與 pages 記錄標題／標記的起點，paragraphs 與 sentences 記錄邊界之後的位置；
+    page_numbers 與 pages 一一對應。
+    """
+
+    def __init__(self, text):
+        self.length = len(text)
+        self.chapters = array('I')
+        self.pages = array('I')
+        self.page_numbers = array('I')
+        self.paragraphs = array('I')
+        self.sentences = array('I')
+
+        for match in BOUNDARY_PATTERN.finditer(text):
+            kind = match.lastgroup
+            if kind == "page":
+                self.pages.append(match.start())
+                self.page_numbers.append(int(match.group("page_no")))
+            elif kind == "chapter":
+                self.chapters.append(match.start())
+            elif kind == "paragraph":
+                self.paragraphs.append(match.end())
+            else:
+                self.sentences.append(match.start() + 1)
+
+    def between(self, kind, start, end):
+        """start < 位置 < end 的某類邊界（回傳 array 切片）"""
+        offsets = getattr(self, kind)
+        return offsets[bisect_right(offsets, start):bisect_left(offsets, end)]
+
+    def split_by_length(self, max_chars, start=0, end=None, levels=SPLIT_LEVELS):
+        """
+        將 [start, end) 切成不超過 max_chars 個字元的 (start, end) 區段
+
+        先以章節為單位合併，單一章節過長時改用段落，再不行用句子，最後才按字元數硬切。
+        """
+        if end is None:
+            end = self.length
+        if end - start <= max_chars:
+            return [(start, end)]
+        if not levels:
+            return [(i, min(i + max_chars, end)) for i in range(start, end, max_chars)]
+
+        cuts = self.between(levels[0], start, end)
+        if not cuts:
+            return self.split_by_length(max_chars, start, end, levels[1:])
+
+        spans = []
+        current = start
+        previous = start
+        for cut in list(cuts) + [end]:
+            if cut - current > max_chars and previous > current:
+                spans.append((current, previous))
+                current = previous
+            if cut - current > max_chars:
+                spans.extend(self.split_by_length(max_chars, current, cut, levels[1:]))
+                current = cut
+            previous = cut
+        if current < end:
+            spans.append((current, end))
+        return spans
+
+_cache = OrderedDict()  # (長度, 文本雜湊) -> BoundaryIndex
+_cache_lock = threading.Lock()
+
+def text_digest(text):
+    """文本的快取鍵：長度加上 BLAKE2b 雜湊（不保留文本本身）"""
+    return len(text), hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+def get_boundary_index(text, cache=True):
+    """取得文本的邊界索引；cache=True 時同一份文本只掃描一次"""
+    if not cache:
+        return BoundaryIndex(text)
+    key = text_digest(text)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is not None:
+            _cache.move_to_end(key)
+            return index
+    index = BoundaryIndex(text)
+    with _cache_lock:
+        _cache[key] = index
+        while len(_cache) > BOUNDARY_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return index
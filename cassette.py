@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 錄製與重播（cassette）
+
+CASSETTE_MODE=record 時，每次成功的 DeepSeek 與 DeepL 呼叫會連同耗時追加到 gzip 壓縮的
+JSONL 卡帶檔；CASSETTE_MODE=replay 時改由卡帶回應，不連網、不計費，整個流程（提取、分塊、
+報告生成）因此成為可重現的離線效能測試。
+
+重播預設立即回應；CASSETTE_LATENCY_SCALE=1 依錄製時的耗時等待（0.5 則減半），
+可模擬實際 API 的延遲。同一請求錄到多次時依錄製順序回應，用完後重複最後一筆。
+卡帶中找不到的請求直接失敗，不會改送到正式端點。
+
+分塊與截斷依 token 估算決定，而估算會隨 API 回報的用量自我校正；卡帶第一行保存錄製時的
+校正資料，錄製與重播期間都固定使用它，重播才會送出與錄製時完全相同的請求。
+"""
+
+import os
+import json
+import gzip
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import defaultdict
+from response_cache import KEY_FIELDS
+from retry_policy import APIRequestError
+from token_calibration import token_calibration
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# record：錄製；replay：重播；未設定時停用
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "")
+CASSETTE_PATH = os.getenv("CASSETTE_PATH", "api_cassette.jsonl.gz")
+# 重播時等待錄製耗時的倍數（0 代表立即回應）
+CASSETTE_LATENCY_SCALE = float(os.getenv("CASSETTE_LATENCY_SCALE", "0"))
+
+def request_key(service, request):
+    """請求的鍵：DeepSeek 只取影響回應的欄位，DeepL 去除金鑰"""
+    if service == "deepseek":
+        request = {name: request.get(name) for name in KEY_FIELDS}
+    else:
+        request = {name: value for name, value in request.items() if name != "auth_key"}
+    encoded = json.dumps([service, request], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class Cassette:
+    """gzip JSONL 卡帶：第一行為 {calibration}，之後每筆為 {key, service, latency, response}"""
+
+    def __init__(self, path=CASSETTE_PATH, mode=CASSETTE_MODE, latency_scale=CASSETTE_LATENCY_SCALE):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"無效的 CASSETTE_MODE: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._entries = None  # 鍵 -> 錄製的回應列表
+        self._served = defaultdict(int)
+        self.recorded = 0
+        self.replayed = 0
+        self._pin_calibration()
+
+    @property
+    def replaying(self):
+        return self.mode == "replay"
+
+    def _read_header(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+        return header.get("calibration")
+
+    def _pin_calibration(self):
+        """沿用卡帶中的校正資料（新卡帶則寫入目前的校正資料），並在執行期間固定不變"""
+        if os.path.exists(self.path):
+            try:
+                token_calibration.freeze(self._read_header())
+                return
+            except (OSError, EOFError, ValueError) as e:
+                if self.replaying:
+                    raise
+                logger.warning(f"無法讀取卡帶 {self.path} 的校正資料，改用目前的校正資料: {e}")
+        token_calibration.freeze()
+        if self.mode == "record":
+            self._append({"calibration": token_calibration.snapshot()})
+
+    def _append(self, entry):
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with gzip.open(self.path, "at", encoding="utf-8") as f:
+                f.write(line)
+
+    def record(self, service, request, response, latency):
+        """錄製一次成功的呼叫（每筆寫成獨立的 gzip 區段，程式中斷也不會遺失已錄製的呼叫）"""
+        if self.mode != "record":
+            return
+        self._append({"key": request_key(service, request), "service": service,
+                      "latency": round(latency, 3), "response": response})
+        with self._lock:
+            self.recorded += 1
+
+    def _load(self):
+        entries = defaultdict(list)
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if "key" in entry:
+                    entries[entry["key"]].append(entry)
+        logger.info(f"已載入卡帶 {self.path}：{sum(len(v) for v in entries.values())} 筆呼叫")
+        return entries
+
+    def _next(self, service, request):
+        """取出下一筆錄製的呼叫；找不到時拋出不可重試的 APIRequestError"""
+        key = request_key(service, request)
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            recorded = self._entries.get(key)
+            if not recorded:
+                raise APIRequestError(f"卡帶 {self.path} 中沒有此 {service} 請求", retryable=False)
+            entry = recorded[min(self._served[key], len(recorded) - 1)]
+            self._served[key] += 1
+            self.replayed += 1
+        return entry
+
+    def replay(self, service, request):
+        """同步重播，依 latency_scale 等待後回傳錄製的回應"""
+        entry = self._next(service, request)
+        if self.latency_scale > 0:
+            time.sleep(entry["latency"] * self.latency_scale)
+        return entry["response"]
+
+    async def replay_async(self, service, request):
+        """非同步重播；第一次呼叫時在執行緒中載入卡帶，不阻塞事件迴圈"""
+        entry = await asyncio.to_thread(self._next, service, request)
+        if self.latency_scale > 0:
+            await asyncio.sleep(entry["latency"] * self.latency_scale)
+        return entry["response"]
+
+# 所有 API 呼叫共用的卡帶（停用時為 None）
+api_cassette = Cassette() if CASSETTE_MODE else None
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DeepSeek chat completion 傳輸層
+
+post_chat_completion 是所有同步 DeepSeek 呼叫共用的送出函式，可選擇：
+1. 一般模式（預設）：等整個回應完成後一次取得
+2. 串流模式（stream=True 或 DEEPSEEK_STREAM=1）：以 SSE 逐段接收，on_text 即時收到新增的文字；
+   串流中超過 STREAM_IDLE_TIMEOUT 秒沒有任何資料即視為連線停滯並提前中止，
+   不必等滿整個請求逾時
+
+兩種模式都回傳與非串流 API 相同格式的結果字典（choices[0].message.content 與 usage），
+呼叫端不需要區分。送出前先查回應快取並預扣速率配額，收到回應後校正 token 估算並寫入快取。
+IncrementalJSONParser 可在 JSON 回應仍在產生時取出已完成的頂層欄位（json_field_watcher），
+markdown_progress 則在 Markdown 報告每完成一個標題時記錄進度。
+usage 中的 prompt_cache_hit_tokens 會累計為 DeepSeek 伺服器端前綴快取的命中統計；
+每次嘗試（含失敗與快取命中）都會寫入用量帳本。設定 CASSETTE_MODE 時錄製成功的回應，
+或改由卡帶重播（不查回應快取、不佔用速率配額）。
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import requests
+from http_session import get_session
+from retry_policy import APIRequestError, check_response, error_for_status
+from rate_limiter import deepseek_limiter, request_cost, settle_usage
+from response_cache import response_cache, cache_key
+from token_estimator import record_prompt_usage
+from usage_ledger import record_call
+from cassette import api_cassette
+
+try:
+    import aiohttp
+except ImportError:  # 只有非同步客戶端需要 aiohttp
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# API 位址；可指向本機模擬伺服器（mock_api_server.py）離線測試
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com").rstrip("/")
+DEEPSEEK_CHAT_URL = f"{DEEPSEEK_BASE_URL}/v1/chat/completions"
+# 是否以串流模式呼叫 DeepSeek API（設為 1 啟用）
+DEEPSEEK_STREAM = os.getenv("DEEPSEEK_STREAM", "0") == "1"
+# 串流中兩段資料之間允許的最長間隔（秒）
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "60"))
+# 建立連線的逾時秒數
+CONNECT_TIMEOUT = 10
+
+# 串流結束標記
+SSE_DONE = "[DONE]"
+
+def sse_data(line):
+    """取出 SSE 一行中的 data 內容；註解（: keep-alive）與空行回傳 None"""
+    if not line or not line.startswith("data:"):
+        return None
+    return line[5:].strip()
+
+class StreamAccumulator:
+    """累積 SSE 區塊，組合成與非串流回應相同的結果字典"""
+
+    def __init__(self, on_text=None):
+        self.on_text = on_text
+        self.parts = []
+        self.usage = None
+        self.finish_reason = None
+        self.model = None
+        self.first_token_time = None
+        self.done = False
+
+    def add(self, data):
+        """處理一個 data 欄位；收到 [DONE] 後回傳 False"""
+        if data == SSE_DONE:
+            self.done = True
+            return False
+        chunk = json.loads(data)
+        if "error" in chunk:
+            raise APIRequestError(f"DeepSeek API 串流錯誤: {chunk['error']}")
+        self.model = chunk.get("model", self.model)
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+        for choice in chunk.get("choices") or []:
+            text = (choice.get("delta") or {}).get("content")
+            if text:
+                if self.first_token_time is None:
+                    self.first_token_time = time.monotonic()
+                self.parts.append(text)
+                if self.on_text:
+                    self.on_text(text)
+            if choice.get("finish_reason"):
+                self.finish_reason = choice["finish_reason"]
+        return True
+
+    def result(self):
+        return {
+            "model": self.model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(self.parts)},
+                "finish_reason": self.finish_reason,
+            }],
+            "usage": self.usage,
+        }
+
+def _stream_payload(payload):
+    """加上串流參數；include_usage 讓最後一個區塊帶回 token 用量"""
+    return dict(payload, stream=True, stream_options={"include_usage": True})
+
+def stream_chat_completion(url, headers, payload, idle_timeout=STREAM_IDLE_TIMEOUT, on_text=None):
+    """以 SSE 串流送出請求，回傳結果字典；兩段資料間隔超過 idle_timeout 秒即中止"""
+    start_time = time.monotonic()
+    accumulator = StreamAccumulator(on_text)
+    # requests 的讀取逾時作用於每一次 socket 讀取，正好就是資料間的閒置間隔
+    with get_session().post(url, headers=headers, json=_stream_payload(payload), stream=True,
+                            timeout=(CONNECT_TIMEOUT, idle_timeout)) as response:
+        check_response(response, "DeepSeek API")
+        response.encoding = "utf-8"  # text/event-stream 未標示編碼時 requests 會誤判為 latin-1
+        last_data = time.monotonic()
+        try:
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                last_data = time.monotonic()
+                data = sse_data(line)
+                if data is not None and not accumulator.add(data):
+                    break
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if time.monotonic() - last_data >= idle_timeout:
+                raise requests.exceptions.ReadTimeout(f"串流超過 {idle_timeout:g} 秒未收到資料，提前中止") from e
+            raise
+    if not accumulator.done and accumulator.finish_reason is None:
+        raise APIRequestError("DeepSeek API 串流在完成前中斷")
+    if accumulator.first_token_time is not None:
+        logger.info(f"串流完成：首段文字 {accumulator.first_token_time - start_time:.1f} 秒，"
+                    f"總耗時 {time.monotonic() - start_time:.1f} 秒")
+    return accumulator.result()
+
+def prompt_text(payload):
+    """請求中所有訊息的文字（供 token 預扣與估算校正使用）"""
+    return "\n".join(message.get("content") or "" for message in payload["messages"])
+
+def _cached(url, payload):
+    """查詢回應快取，回傳 (快取鍵, 命中的結果或 None)"""
+    if response_cache is None or api_cassette is not None:  # 錄製時每次都要真正呼叫 API
+        return None, None
+    key = cache_key(payload, url)
+    result = response_cache.get(key)
+    if result is not None:
+        logger.info("使用快取的 DeepSeek 回應")
+        record_call(payload, result.get("usage"), cached=True)
+    return key, result
+
+class PromptCacheStats:
+    """累計 DeepSeek 伺服器端前綴快取（context caching）命中與未命中的 prompt token 數"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hit_tokens = 0
+        self.miss_tokens = 0
+
+    def add(self, usage):
+        if not usage or "prompt_cache_hit_tokens" not in usage:
+            return
+        hit = usage.get("prompt_cache_hit_tokens") or 0
+        miss = usage.get("prompt_cache_miss_tokens")
+        if miss is None:
+            miss = max(0, (usage.get("prompt_tokens") or 0) - hit)
+        with self._lock:
+            self.requests += 1
+            self.hit_tokens += hit
+            self.miss_tokens += miss
+        logger.info(f"伺服器端前綴快取命中 {hit} / {hit + miss} 個 prompt tokens")
+
+    def stats(self):
+        with self._lock:
+            total = self.hit_tokens + self.miss_tokens
+            return {
+                "requests": self.requests,
+                "hit_tokens": self.hit_tokens,
+                "miss_tokens": self.miss_tokens,
+                "hit_ratio": self.hit_tokens / total if total else 0.0,
+            }
+
+prompt_cache_stats = PromptCacheStats()
+
+def log_prompt_cache_stats():
+    """將伺服器端前綴快取的命中統計寫入日誌"""
+    stats = prompt_cache_stats.stats()
+    if stats["requests"]:
+        logger.info(f"伺服器端前綴快取：{stats['requests']} 次請求共命中 {stats['hit_tokens']} 個 prompt tokens，"
+                    f"未命中 {stats['miss_tokens']} 個，命中率 {stats['hit_ratio']:.0%}")
+    return stats
+
+def _replayed(result, on_text):
+    """卡帶重播或回應快取命中的結果：串流回呼一次收到完整內容"""
+    if on_text:
+        on_text(result["choices"][0]["message"]["content"])
+    return result
+
+def _record(key, payload, result, cost, latency):
+    """新取得的回應：退回多預扣的 token、校正估算、累計前綴快取命中、記入帳本並寫入快取"""
+    usage = result.get("usage")
+    settle_usage(cost, usage)
+    prompt_cache_stats.add(usage)
+    record_call(dict(payload, model=result.get("model") or payload.get("model")), usage, latency, status=200)
+    if api_cassette is not None:
+        api_cassette.record("deepseek", payload, result, latency)
+    record_prompt_usage(prompt_text(payload), usage, len(payload["messages"]))  # 以實際 token 數校正估算
+    content = result.get("choices", [{}])[0].get("message", {}).get("content")
+    if key is not None and content:
+        response_cache.put(key, result, payload.get("model"))
+
+def post_chat_completion(url, headers, payload, timeout=300, stream=DEEPSEEK_STREAM, on_text=None):
+    """
+    送出 chat completion 請求並回傳結果字典；非 200 回應拋出 APIRequestError
+
+    相同請求先查回應快取，命中時不呼叫 API 也不佔用速率配額。
+    """
+    if api_cassette is not None and api_cassette.replaying:
+        return _replayed(api_cassette.replay("deepseek", payload), on_text)
+    key, result = _cached(url, payload)
+    if result is not None:
+        return _replayed(result, on_text)
+
+    cost = deepseek_limiter.acquire(request_cost(prompt_text(payload), payload["max_tokens"]))  # 依 RPM／TPM 配額平均送出
+    start_time = time.monotonic()
+    try:
+        if stream:
+            result = stream_chat_completion(url, headers, payload, on_text=on_text)
+        else:
+            response = get_session().post(url, headers=headers, json=payload, timeout=timeout)
+            result = check_response(response, "DeepSeek API").json()
+    except Exception as e:
+        deepseek_limiter.refund(cost)  # 失敗的嘗試不佔用 TPM 配額，重試時重新預扣
+        record_call(payload, latency=time.monotonic() - start_time, error=e)
+        raise
+    _record(key, payload, result, cost, time.monotonic() - start_time)
+    return result
+
+async def post_chat_completion_async(session, url, payload, timeout, stream=DEEPSEEK_STREAM, on_text=None,
+                                     idle_timeout=STREAM_IDLE_TIMEOUT):
+    """
+    post_chat_completion 的 aiohttp 版本（session 需已帶有認證標頭），同樣先查回應快取
+
+    快取（SQLite）、用量帳本（JSONL）與卡帶的讀寫都是阻塞的檔案操作，交給 asyncio.to_thread
+    在執行緒中進行，不阻塞事件迴圈上其他請求的串流；contextvars 的標示會一併帶入執行緒。
+    """
+    if api_cassette is not None and api_cassette.replaying:
+        return _replayed(await api_cassette.replay_async("deepseek", payload), on_text)
+    key, result = await asyncio.to_thread(_cached, url, payload)
+    if result is not None:
+        return _replayed(result, on_text)
+
+    # 與同步呼叫共用 RPM／TPM 配額，等待期間不阻塞事件迴圈
+    cost = await deepseek_limiter.acquire_async(request_cost(prompt_text(payload), payload["max_tokens"]))
+    start_time = time.monotonic()
+    try:
+        if stream:
+            result = await _stream_chat_completion_async(session, url, payload, idle_timeout, on_text)
+        else:
+            request_timeout = aiohttp.ClientTimeout(total=timeout)
+            async with session.post(url, json=payload, timeout=request_timeout) as response:
+                if response.status != 200:
+                    raise error_for_status(response.status, await response.text(), response.headers, "DeepSeek API")
+                result = await response.json(content_type=None)
+    except Exception as e:
+        deepseek_limiter.refund(cost)  # 失敗的嘗試不佔用 TPM 配額，重試時重新預扣
+        await asyncio.to_thread(record_call, payload, latency=time.monotonic() - start_time, error=e)
+        raise
+    await asyncio.to_thread(_record, key, payload, result, cost, time.monotonic() - start_time)
+    return result
+
+async def _stream_chat_completion_async(session, url, payload, idle_timeout, on_text):
+    """以 aiohttp 接收 SSE 串流，回傳結果字典"""
+    # sock_read 即每次讀取的閒置上限，停滯的串流會以 asyncio.TimeoutError 中止
+    request_timeout = aiohttp.ClientTimeout(total=None, sock_connect=CONNECT_TIMEOUT, sock_read=idle_timeout)
+    accumulator = StreamAccumulator(on_text)
+    async with session.post(url, json=_stream_payload(payload), timeout=request_timeout) as response:
+        if response.status != 200:
+            raise error_for_status(response.status, await response.text(), response.headers, "DeepSeek API")
+        async for raw_line in response.content:
+            data = sse_data(raw_line.decode("utf-8").strip())
+            if data is not None and not accumulator.add(data):
+                break
+    if not accumulator.done and accumulator.finish_reason is None:
+        raise APIRequestError("DeepSeek API 串流在完成前中斷")
+    return accumulator.result()
+
+class IncrementalJSONParser:
+    """
+    逐段餵入模型輸出的文字，頂層 JSON 物件中的欄位一完成就回傳 (鍵, 值)
+
+    會略過 ```json 之前的說明文字；物件結束後的內容一律忽略。
+    """
+
+    def __init__(self):
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.field = []
+
+    def _complete_field(self, fields):
+        text = "".join(self.field).strip()
+        self.field = []
+        if text:
+            try:
+                fields.extend(json.loads("{" + text + "}").items())
+            except json.JSONDecodeError:
+                logger.debug(f"無法解析串流中的 JSON 欄位: {text[:100]}")
+
+    def feed(self, text):
+        """處理新增的文字，回傳這段文字中完成的欄位列表"""
+        fields = []
+        for ch in text:
+            if self.finished:
+                break
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.depth = 1
+                continue
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._complete_field(fields)
+                    self.finished = True
+                    continue
+            elif ch == "," and self.depth == 1:
+                self._complete_field(fields)
+                continue
+            self.field.append(ch)
+        return fields
+
+def json_field_watcher():
+    """建立 on_text 回呼：每完成一個頂層 JSON 欄位就寫入日誌"""
+    parser = IncrementalJSONParser()
+
+    def on_text(text):
+        for key, _ in parser.feed(text):
+            logger.info(f"已接收欄位: {key}")
+    return on_text
+
+def markdown_progress(label):
+    """建立 on_text 回呼：Markdown 回應每完成一個標題行就記錄標題與目前已接收的字數"""
+    pending = []
+    received = 0
+
+    def on_text(text):
+        nonlocal received
+        received += len(text)
+        lines = ("".join(pending) + text).split("\n")
+        pending[:] = [lines.pop()]  # 尚未結束的最後一行
+        for line in lines:
+            if line.lstrip().startswith("#"):
+                logger.info(f"{label}已接收 {received} 字：{line.strip()}")
+    return on_text
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+章節對齊的分塊規劃
+
+章節標題（第X章、Chapter N）、頁面標記、段落與句子邊界取自 TokenIndex 建立時的邊界索引，
+分塊時優先讓每塊由完整章節組成；章節本身超過上限時才在章節內依段落／句子切割。
+規劃結果是指向原始字串的 ChunkSpan，不複製文本，直到組合提示詞時才以 text() 取出。
+"""
+
+import logging
+from bisect import bisect_right
+from token_index import TokenIndex
+
+logger = logging.getLogger(__name__)
+
+class ChunkSpan:
+    """原始文本中的一個分塊區段"""
+
+    __slots__ = ("source", "start", "end", "page_range", "tokens")
+
+    def __init__(self, source, start, end, page_range=None, tokens=0):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.page_range = page_range  # (first_page, last_page)，未知時為 None
+        self.tokens = tokens
+
+    def text(self):
+        """取出區段文本（此時才複製字串）"""
+        return self.source[self.start:self.end]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"ChunkSpan(start={self.start}, end={self.end}, page_range={self.page_range}, tokens={self.tokens})"
+
+def _page_range(page_starts, page_numbers, start, end):
+    """區段 [start, end) 涵蓋的首尾頁碼"""
+    if not page_starts:
+        return None
+    first = bisect_right(page_starts, start) - 1
+    last = bisect_right(page_starts, max(start, end - 1)) - 1
+    first_page = page_numbers[max(first, 0)]
+    return first_page, page_numbers[last] if last >= 0 else first_page
+
+def plan_chunks(text, max_tokens, token_index=None, page_starts=None):
+    """
+    將文本規劃為不超過 max_tokens 的 ChunkSpan 列表
+
+    相鄰的完整章節會合併到同一塊，直到再加入下一章就會超過上限；單一章節超過上限時
+    交由 TokenIndex.split_spans 在章節內切割。page_starts 為各頁（從第 1 頁起）在文本中
+    的起始位置，未提供時改用文本中的「--- 第 N 頁 ---」標記推算頁碼範圍。
+    """
+    if token_index is None:
+        token_index = TokenIndex(text)
+    boundaries = token_index.boundaries
+
+    if page_starts is not None:
+        page_numbers = list(range(1, len(page_starts) + 1))
+    else:
+        page_starts, page_numbers = boundaries.pages, boundaries.page_numbers
+
+    spans = []
+
+    def add_span(start, end):
+        spans.append(ChunkSpan(text, start, end, _page_range(page_starts, page_numbers, start, end),
+                               token_index.tokens_between(start, end)))
+
+    # 以章節標題為界劃分區段，第一個標題之前的內容（封面、目錄等）自成一段
+    section_starts = [0] + [offset for offset in boundaries.chapters if offset > 0]
+    section_ends = section_starts[1:] + [len(text)]
+
+    current_start = None
+    current_end = None
+    for start, end in zip(section_starts, section_ends):
+        if token_index.tokens_between(start, end) > max_tokens:
+            # 超長章節連同前面尚未送出的短章節一起切割，避免留下零碎的小塊
+            split_start = start if current_start is None else current_start
+            for span_start, span_end in token_index.split_spans(max_tokens, split_start, end):
+                add_span(span_start, span_end)
+            current_start = None
+            continue
+        if current_start is not None and token_index.tokens_between(current_start, end) > max_tokens:
+            add_span(current_start, current_end)
+            current_start = None
+        if current_start is None:
+            current_start = start
+        current_end = end
+    if current_start is not None:
+        add_span(current_start, current_end)
+
+    logger.info(f"分塊規劃完成：{len(boundaries.chapters)} 個章節標題，{len(spans)} 個區段")
+    return spans
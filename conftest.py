@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""pytest 共用設定：各模組在載入時讀取環境變數，先把快取、帳本與校正檔導向暫存目錄；另提供測試用的範例文本與 PDF"""
+
+import os
+import random
+import tempfile
+import pytest
+
+_tmp_dir = tempfile.mkdtemp(prefix="deepseek-book-analyzer-test-")
+os.environ.setdefault("TEXT_CACHE_DIR", os.path.join(_tmp_dir, "text"))
+os.environ.setdefault("TOKEN_CALIBRATION_PATH", os.path.join(_tmp_dir, "token_calibration.json"))
+os.environ.setdefault("RESPONSE_CACHE_PATH", os.path.join(_tmp_dir, "responses.sqlite3"))
+os.environ.setdefault("USAGE_LEDGER_PATH", os.path.join(_tmp_dir, "usage.jsonl"))
+os.environ.pop("CASSETTE_MODE", None)
+
+SAMPLE_CHINESE = "天地玄黃宇宙洪荒日月盈昃辰宿列張寒來暑往秋收冬藏"
+SAMPLE_WORDS = "the city river light memory time people north market".split()
+
+def make_sample_text(seed, paragraphs=200):
+    """以固定亂數種子產生中英混合的段落文本（句長、段長不一）"""
+    rng = random.Random(seed)
+    result = []
+    for _ in range(paragraphs):
+        sentences = []
+        for _ in range(rng.randint(2, 6)):
+            if rng.random() < 0.6:
+                sentences.append("".join(rng.choice(SAMPLE_CHINESE) for _ in range(rng.randint(8, 30))) + rng.choice("。！？"))
+            else:
+                sentences.append(" ".join(rng.choice(SAMPLE_WORDS) for _ in range(rng.randint(5, 15))).capitalize() + ". ")
+        result.append("".join(sentences))
+    return "\n\n".join(result)
+
+@pytest.fixture
+def sample_text():
+    return make_sample_text
+
+def write_pdf(path, page_texts):
+    """寫出每頁一行 ASCII 文字的最小 PDF（不需額外套件，PyPDF2 可讀回原文）"""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R "
+                       f"/Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+
+    body = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(body))
+        body += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(body)
+    body += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    body += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    body += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(body)
+    return str(path)
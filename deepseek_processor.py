@@ -6,12 +6,25 @@ import time
 import base64
 import logging
 import argparse
-import requests
 from fpdf import FPDF
 from opencc import OpenCC
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor
-import PyPDF2  # 導入PyPDF2用於PDF文本提取
+from functools import partial
+from pdf_extractor import iter_pages  # 以PyPDF2平行提取PDF頁面文本
+from http_session import get_session, log_session_metrics  # 共用連線池
+from async_deepseek import extract_json_content, DEEPSEEK_REQUEST_TIMEOUT
+from token_estimator import count_tokens  # 有詞彙檔時精確計數，否則估算
+from retry_policy import APIRequestError, check_response, deepseek_retry, deepl_retry
+from response_cache import log_cache_stats
+from cassette import api_cassette
+from usage_ledger import set_call_context, call_context, labeled  # 用量帳本依書籍與階段標示每次呼叫
+from chat_completion import post_chat_completion, json_field_watcher, log_prompt_cache_stats, DEEPSEEK_BASE_URL, DEEPSEEK_CHAT_URL
+from prompt_layout import build_messages
+from token_index import TokenIndex
+from chunk_planner import plan_chunks
+from stage_scheduler import StageScheduler
+from batch_pipeline import run_batch
+from boundary_index import get_boundary_index
 import re
 import math
 import traceback
@@ -20,10 +33,16 @@ import traceback
 # API 金鑰與端點設定
 # ==========================
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "your_deepseek_api_key_here")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1"  # 更新為正確的API端點
+DEEPSEEK_API_URL = f"{DEEPSEEK_BASE_URL}/v1"  # 以環境變數 DEEPSEEK_BASE_URL 調整
 
 DEEPL_API_KEY = os.getenv("DEEPL_API_KEY", "your_deepl_api_key_here")
-DEEPL_API_URL = "https://api.deepl.com/v2/translate"
+DEEPL_API_URL = os.getenv("DEEPL_BASE_URL", "https://api.deepl.com").rstrip("/") + "/v2/translate"
+
+# 大型PDF多階段分析：同時執行的階段數、分析的主題數與每次請求的主題數
+STAGE_WORKERS = int(os.getenv("STAGE_WORKERS", "4"))
+MAX_THEMES = 5
+THEMES_PER_BATCH = 3
+ANALYSIS_FIELDS = ["critical_analysis", "comparative_analysis", "reader_recommendations", "conclusion"]
 
 # 初始化 OpenCC（簡體轉繁體）
 cc = OpenCC('s2tw')  # 更改為 s2tw，特別針對台灣繁體中文進行最佳化
@@ -32,7 +51,7 @@ cc = OpenCC('s2tw')  # 更改為 s2tw，特別針對台灣繁體中文進行最
 import logging
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(levelname)s - [%(threadName)s] %(message)s',  # 並行處理多本書時以執行緒名稱區分
     handlers=[
         logging.FileHandler("processing.log"),
         logging.StreamHandler()
@@ -41,70 +60,23 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # 文本分析輔助函數
-def estimate_tokens(text):
-    # 一個中文字約為1.5個token，一個英文單詞約為1個token
-    # 這是粗略估計，實際token數會因模型分詞器而異
-    chinese_char_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-    total_char_count = len(text)
-    english_word_count = len(re.findall(r'\b[a-zA-Z]+\b', text))
-    
-    # 估算總token數
-    estimated_tokens = chinese_char_count * 1.5 + english_word_count + (total_char_count - chinese_char_count - english_word_count) * 0.5
-    return int(estimated_tokens)
-
-def split_text_into_chunks(text, max_tokens=40000):
-    estimated_total_tokens = estimate_tokens(text)
-    
-    if estimated_total_tokens <= max_tokens:
-        return [text]
-    
-    # 計算需要的塊數
-    num_chunks = math.ceil(estimated_total_tokens / max_tokens)
-    chunk_size = len(text) // num_chunks
-    
-    # 確保在完整段落處分割
-    chunks = []
-    start = 0
-    
-    for i in range(1, num_chunks):
-        # 尋找最接近的段落結尾
-        end = min(start + chunk_size, len(text))
-        
-        # 嘗試在段落結束處分割
-        paragraph_end = text.rfind('\n\n', start, end)
-        if paragraph_end != -1 and paragraph_end > start + chunk_size // 2:
-            end = paragraph_end + 2  # 包含兩個換行符
-        else:
-            # 如果找不到段落結束，嘗試在句子結束處分割
-            sentence_end = max(
-                text.rfind('. ', start, end),
-                text.rfind('。', start, end),
-                text.rfind('！', start, end),
-                text.rfind('？', start, end)
-            )
-            if sentence_end != -1 and sentence_end > start + chunk_size // 2:
-                end = sentence_end + 1
-        
-        chunks.append(text[start:end])
-        start = end
-    
-    # 添加最後一個塊
-    chunks.append(text[start:])
-    
-    return chunks
+def split_text_into_chunks(text, max_tokens=40000, token_index=None):
+    # 依章節對齊規劃分塊，切點以前綴和索引二分搜尋，全文只需估算一次 token
+    return [span.text() for span in plan_chunks(text, max_tokens, token_index)]
 
 def analyze_pdf_with_deepseek(text):
-    """使用 DeepSeek API 分析 PDF 文字內容"""
+    """使用 DeepSeek API 分析 PDF 文字內容，回傳 (回應字串, 輸入文本的 token 數)"""
+    token_estimate = 0
     try:
         start_time = time.time()
         # 估計 token 數量
-        token_estimate = len(text) / 0.75 * 1.23  # 中文字符到 token 的粗略轉換比例
+        token_estimate = count_tokens(text)
         logger.info(f"估計PDF文本約含有 {int(token_estimate)} tokens")
         
         # 判斷是否需要分段處理
         if token_estimate > 7500:  # 如果估計token數量超過7500，進行分段處理
             logger.info(f"PDF文本較長，將進行分段處理")
-            return process_large_pdf(text)
+            return process_large_pdf(text), token_estimate
         
         # 建立提示詞
         prompt = f"""
@@ -174,41 +146,54 @@ def analyze_pdf_with_deepseek(text):
         
         # 呼叫 DeepSeek API
         client = DeepseekClient(DEEPSEEK_API_KEY)
-        response = client.extract_content(prompt)
+        with call_context(section="analysis"):
+            response = client.extract_content(prompt)
         
         # 記錄處理時間
         elapsed_time = time.time() - start_time
         minutes, seconds = divmod(elapsed_time, 60)
         logger.info(f"分析完成，耗時: {elapsed_time:.2f} 秒")
         
-        return response
+        return response, token_estimate
     
     except Exception as e:
         error_message = f"分析 PDF 內容時發生錯誤：{str(e)}"
         logger.error(error_message)
         traceback.print_exc()
-        return json.dumps({"error": error_message}, ensure_ascii=False)
+        return json.dumps({"error": error_message}, ensure_ascii=False), token_estimate
+
+def parse_json_response(response):
+    """解析 extract_content 的回應為字典；整段不是 JSON 時再嘗試擷取 ```json 區塊，失敗回傳 None"""
+    try:
+        data = json.loads(response)
+    except (json.JSONDecodeError, TypeError):
+        json_match = re.search(r'```json\s*([\s\S]*?)\s*```', response or "")
+        if not json_match:
+            return None
+        try:
+            data = json.loads(json_match.group(1).strip())
+        except json.JSONDecodeError:
+            return None
+    return data if isinstance(data, dict) else None
 
 def process_large_pdf(text):
     """處理大型PDF文本，將其分段送入DeepSeek API進行分析，然後合併結果"""
     start_time = time.time()
     
     try:
-        # 檢查token數量
-        estimated_tokens = estimate_tokens(text)
+        # 檢查token數量（建立一次前綴和索引，分塊時直接沿用）
+        token_index = TokenIndex(text)
+        estimated_tokens = token_index.total_tokens
         logging.info(f"估計PDF文本約含有 {estimated_tokens} tokens")
         
         # 如果文本過大，分段處理
         if estimated_tokens > 40000:
             logging.info("PDF文本較長，將進行分段處理")
             
-            # 分割文本為更小的片段，每段最多25000 tokens
-            chunks = split_text_into_chunks(text, max_tokens=25000)
+            # 規劃為更小的區段（章節對齊），每段最多25000 tokens；實際組合提示詞時才取出文本
+            chunks = plan_chunks(text, 25000, token_index)
             logging.info(f"文本已分割為 {len(chunks)} 個部分")
             
-            # 取第一部分用於基本資訊提取
-            first_part = chunks[0]
-            
             # 如果超過10個分段，只取10%的部分進行處理
             if len(chunks) > 10:
                 logging.info(f"文本過大，將只取前 {max(5, len(chunks)//5)} 個和最後 {max(1, len(chunks)//10)} 個部分進行處理")
@@ -225,12 +210,12 @@ def process_large_pdf(text):
             logger.info(f"第一階段：處理第一個文本塊獲取基本信息（1/{len(sample_chunks)}）")
             
             # 嘗試識別書籍的封面信息和封底，通常在前幾頁和最後幾頁
-            first_part = sample_chunks[0]
-            last_part = sample_chunks[-1] if len(sample_chunks) > 1 else ""
+            first_part = sample_chunks[0].text()
+            last_part = sample_chunks[-1].text() if len(sample_chunks) > 1 else ""
             cover_info = first_part[:2000] + "\n...\n" + last_part[-2000:] if last_part else first_part[:4000]
             
             base_prompt = f"""
-            請仔細分析以下中文PDF書籍內容的封面、目錄和前言部分，提取書名、作者信息、書籍概述等基本信息。提供詳盡但精簡的分析，總字數嚴格控制在7500字以內。
+            請仔細分析所提供的中文PDF書籍內容的封面、目錄和前言部分，提取書名、作者信息、書籍概述等基本信息。提供詳盡但精簡的分析，總字數嚴格控制在7500字以內。
 
             【分析要求】
             1. 書名分析：準確識別並提供完整書名，通常出現在封面或標題頁上
@@ -239,16 +224,11 @@ def process_large_pdf(text):
             4. 書籍概述：提供內容摘要，包括寫作目的、目標受眾和核心訊息（約500字）
             5. 識別書中的主要主題和關鍵概念（不要以章節為分類）
 
-            以下是PDF書籍的封面、目錄和前言部分：
+            以下是PDF書籍封面與封底的節錄，書籍的目錄或前言（如果存在）請參考所提供的書籍內容：
             ```
             {cover_info}
             ```
 
-            另外，以下是書籍的目錄或前言（如果存在）：
-            ```
-            {first_part}
-            ```
-
             請以有效的JSON格式回傳結果：
             ```json
             {{
@@ -269,73 +249,47 @@ def process_large_pdf(text):
             5. 不要捏造不確定的資訊，如確實找不到某項資訊，請標記為"未找到"
             """
             
-            base_response = client.extract_content(base_prompt)
-            
-            try:
-                base_data = json.loads(base_response)
-                logger.info("成功獲取基本信息")
-            except json.JSONDecodeError as e:
-                logger.error(f"解析基本信息時發生錯誤: {e}")
-                # 嘗試從回應中提取 JSON
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```', base_response)
-                if json_match:
-                    try:
-                        base_data = json.loads(json_match.group(1).strip())
-                        logger.info("從文本中提取 JSON 成功")
-                    except:
-                        logger.error("無法從回應中提取有效 JSON")
-                        return json.dumps({"error": "無法解析基本資訊回應"}, ensure_ascii=False)
-                else:
-                    logger.error("回應中找不到 JSON 格式內容")
-                    return json.dumps({"error": "無法解析基本資訊回應"}, ensure_ascii=False)
-            
-            # 獲取書名和作者信息
-            book_title = base_data.get("full_title", base_data.get("title", "未找到書名"))
-            author_name = base_data.get("author", "未找到作者姓名")
-            
-            logger.info(f"書名: {book_title}")
-            logger.info(f"作者: {author_name}")
-            
-            # 獲取主要主題
-            main_themes = base_data.get("main_themes", [])
-            if not main_themes:
-                logger.warning("未找到主題列表，將自動分析主題")
-                main_themes = ["輸出力法則", "高效工作", "生產力提升", "時間管理", "個人成長"]
-            
-            logger.info(f"找到 {len(main_themes)} 個主題，開始逐一分析")
-            
-            # 第二階段：處理主題分析
-            logger.info("第二階段：處理主題分析")
-            
-            # 初始化最終結果
-            final_result = {
-                "title": book_title,
-                "author": author_name,
-                "author_background": base_data.get("author_background", ""),
-                "book_overview": base_data.get("book_overview", ""),
-                "themes_analysis": [],
-                "key_concepts": [],
-                "critical_analysis": "",
-                "comparative_analysis": "",
-                "reader_recommendations": "",
-                "conclusion": ""
-            }
-            
+            # 之後的階段只依賴基本資訊中的書名、作者與主題列表，交由排程器在基本資訊完成後同時執行
             # 合併所有文本塊以便於主題分析
-            all_text = "".join(sample_chunks)
+            all_text = "".join(span.text() for span in sample_chunks)
+            # 各階段以書籍內容作為訊息開頭：first_part 是 all_text 的開頭，基本資訊階段完成後，
+            # 其餘階段的請求開頭都能命中 DeepSeek 伺服器端的前綴快取
             
-            # 控制主題數量，僅分析前4-5個主要主題以控制字數
-            max_themes = min(5, len(main_themes))
-            important_themes = main_themes[:max_themes]
-            logger.info(f"為控制總字數，將只分析前 {max_themes} 個主題")
+            def run_base_stage(results):
+                """第一階段：基本資訊（其餘階段都依賴此結果）"""
+                base_data = parse_json_response(client.extract_content(base_prompt, context=first_part))
+                if base_data is None:
+                    raise ValueError("無法解析基本資訊回應")
+                logger.info("成功獲取基本信息")
+                
+                # 獲取主要主題
+                main_themes = base_data.get("main_themes", [])
+                if not main_themes:
+                    logger.warning("未找到主題列表，將自動分析主題")
+                    main_themes = ["輸出力法則", "高效工作", "生產力提升", "時間管理", "個人成長"]
+                
+                # 控制主題數量，僅分析前4-5個主要主題以控制字數
+                base_data["important_themes"] = main_themes[:MAX_THEMES]
+                base_data["book_title"] = base_data.get("full_title", base_data.get("title", "未找到書名"))
+                base_data["author_name"] = base_data.get("author", "未找到作者姓名")
+                logger.info(f"書名: {base_data['book_title']}")
+                logger.info(f"作者: {base_data['author_name']}")
+                logger.info(f"找到 {len(main_themes)} 個主題，為控制總字數，將只分析前 {len(base_data['important_themes'])} 個主題")
+                return base_data
             
-            # 每次分析最多3個主題，避免超過API限制
-            for i in range(0, len(important_themes), 3):
-                theme_batch = important_themes[i:i+3]
+            def run_themes_stage(results, batch_number):
+                """第二階段：主題分析，每批最多 THEMES_PER_BATCH 個主題，各批同時進行"""
+                base_data = results["base"]
+                book_title = base_data["book_title"]
+                author_name = base_data["author_name"]
+                i = batch_number * THEMES_PER_BATCH
+                theme_batch = base_data["important_themes"][i:i + THEMES_PER_BATCH]
+                if not theme_batch:
+                    return []
                 logger.info(f"分析主題 {i+1} 到 {i+len(theme_batch)}，共 {len(theme_batch)} 個主題")
                 
                 themes_prompt = f"""
-                請對以下中文PDF書籍內容中的指定主題進行精簡分析，嚴格控制總字數，使最終報告不超過7500字。
+                請對所提供的中文PDF書籍內容中的指定主題進行精簡分析，嚴格控制總字數，使最終報告不超過7500字。
 
                 書名：{book_title}
                 作者：{author_name}
@@ -343,11 +297,6 @@ def process_large_pdf(text):
                 需要分析的主題：
                 {', '.join(theme_batch)}
 
-                PDF完整內容：
-                ```
-                {all_text}
-                ```
-
                 對於每個主題，請提供：
                 1. 主題的詳細說明（約200-250字/主題）
                 2. 2-3個相關核心觀點，每點簡潔說明（約50-70字/點）
@@ -379,158 +328,150 @@ def process_large_pdf(text):
                 5. 嚴格遵循JSON格式，確保格式正確無誤
                 """
                 
-                themes_response = client.extract_content(themes_prompt)
-                
-                try:
-                    themes_data = json.loads(themes_response)
-                    if "themes_analysis" in themes_data and isinstance(themes_data["themes_analysis"], list):
-                        final_result["themes_analysis"].extend(themes_data["themes_analysis"])
-                        logger.info(f"成功獲取 {len(themes_data['themes_analysis'])} 個主題的分析")
-                except:
-                    logger.error("解析主題分析時發生錯誤")
-                    # 嘗試從回應中提取 JSON
-                    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', themes_response)
-                    if json_match:
-                        try:
-                            themes_data = json.loads(json_match.group(1).strip())
-                            if "themes_analysis" in themes_data and isinstance(themes_data["themes_analysis"], list):
-                                final_result["themes_analysis"].extend(themes_data["themes_analysis"])
-                                logger.info(f"從文本中提取 JSON 成功，獲取了 {len(themes_data['themes_analysis'])} 個主題的分析")
-                        except:
-                            logger.error("無法從回應中提取有效 JSON")
+                themes_data = parse_json_response(client.extract_content(themes_prompt, context=all_text))
+                if themes_data and isinstance(themes_data.get("themes_analysis"), list):
+                    logger.info(f"成功獲取 {len(themes_data['themes_analysis'])} 個主題的分析")
+                    return themes_data["themes_analysis"]
+                logger.error("解析主題分析時發生錯誤")
+                return []
             
-            # 第三階段：處理關鍵概念
-            logger.info("第三階段：處理關鍵概念")
-            
-            concepts_prompt = f"""
-            請基於以下中文PDF書籍內容的理解，提取並分析3-5個最關鍵概念。確保分析簡明扼要，嚴格控制字數。
-
-            書名：{book_title}
-            作者：{author_name}
+            def run_concepts_stage(results):
+                """第三階段：關鍵概念（只需要書名與作者）"""
+                book_title = results["base"]["book_title"]
+                author_name = results["base"]["author_name"]
+                
+                concepts_prompt = f"""
+                請基於所提供的中文PDF書籍內容的理解，提取並分析3-5個最關鍵概念。確保分析簡明扼要，嚴格控制字數。
 
-            PDF內容：
-            ```
-            {sample_chunks[0] if len(sample_chunks) > 0 else text[:8000]}
-            ```
+                書名：{book_title}
+                作者：{author_name}
 
-            請為每個關鍵概念提供：
-            1. 概念名稱和簡明定義（約70-90字）
-            2. 概念的基本應用場景（約80-100字）
+                請為每個關鍵概念提供：
+                1. 概念名稱和簡明定義（約70-90字）
+                2. 概念的基本應用場景（約80-100字）
 
-            請以有效的JSON格式回傳分析結果：
-            ```json
-            {{
-                "key_concepts": [
-                    {{
-                        "term": "關鍵概念名稱",
-                        "definition": "簡明定義（約70-90字）",
-                        "applications": "基本應用場景（約80-100字）"
-                    }},
-                    {{
-                        "term": "關鍵概念名稱2",
-                        "definition": "簡明定義（約70-90字）",
-                        "applications": "基本應用場景（約80-100字）"
-                    }}
-                    // 提供3-5個關鍵概念
-                ]
-            }}
-            ```
-            
-            請確保：
-            1. 只提供3-5個最核心的關鍵概念
-            2. 嚴格控制每個概念的字數在規定範圍內
-            3. 提供精準但簡短的概念分析
-            4. 嚴格遵循JSON格式，確保格式正確無誤
-            """
-            
-            concepts_response = client.extract_content(concepts_prompt)
-            
-            try:
-                concepts_data = json.loads(concepts_response)
-                if "key_concepts" in concepts_data and isinstance(concepts_data["key_concepts"], list):
-                    final_result["key_concepts"] = concepts_data["key_concepts"]
+                請以有效的JSON格式回傳分析結果：
+                ```json
+                {{
+                    "key_concepts": [
+                        {{
+                            "term": "關鍵概念名稱",
+                            "definition": "簡明定義（約70-90字）",
+                            "applications": "基本應用場景（約80-100字）"
+                        }},
+                        {{
+                            "term": "關鍵概念名稱2",
+                            "definition": "簡明定義（約70-90字）",
+                            "applications": "基本應用場景（約80-100字）"
+                        }}
+                        // 提供3-5個關鍵概念
+                    ]
+                }}
+                ```
+                
+                請確保：
+                1. 只提供3-5個最核心的關鍵概念
+                2. 嚴格控制每個概念的字數在規定範圍內
+                3. 提供精準但簡短的概念分析
+                4. 嚴格遵循JSON格式，確保格式正確無誤
+                """
+                
+                concepts_data = parse_json_response(client.extract_content(concepts_prompt, context=first_part))
+                if concepts_data and isinstance(concepts_data.get("key_concepts"), list):
                     logger.info(f"成功獲取 {len(concepts_data['key_concepts'])} 個關鍵概念")
-            except:
+                    return concepts_data["key_concepts"]
                 logger.error("解析關鍵概念時發生錯誤")
-                # 嘗試從回應中提取 JSON
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```', concepts_response)
-                if json_match:
-                    try:
-                        concepts_data = json.loads(json_match.group(1).strip())
-                        if "key_concepts" in concepts_data and isinstance(concepts_data["key_concepts"], list):
-                            final_result["key_concepts"] = concepts_data["key_concepts"]
-                            logger.info(f"從文本中提取 JSON 成功，獲取了 {len(concepts_data['key_concepts'])} 個關鍵概念")
-                    except:
-                        logger.error("無法從回應中提取有效 JSON")
+                return []
             
-            # 第四階段：批判性分析、比較分析和讀者建議
-            logger.info("第四階段：處理批判性分析、比較分析和讀者建議")
-            
-            analysis_prompt = f"""
-            請基於對《{book_title}》的理解，提供精簡的批判性分析、比較分析、讀者建議和總結。請嚴格控制總字數，使最終報告不超過7500字。
+            def run_analysis_stage(results):
+                """第四階段：批判性分析、比較分析和讀者建議（只需要書名與作者）"""
+                book_title = results["base"]["book_title"]
+                author_name = results["base"]["author_name"]
+                
+                analysis_prompt = f"""
+                請基於對《{book_title}》的理解，提供精簡的批判性分析、比較分析、讀者建議和總結。請嚴格控制總字數，使最終報告不超過7500字。
 
-            【分析要求】
-            1. 批判性分析（約200-250字）：
-               - 書籍主要優點
-               - 理論和方法的局限性
-               - 適用範圍和條件
-        
-            2. 比較分析（約150-200字）：
-               - 與同類書籍的簡要比較
-               - 在相關領域的定位
-               - 對讀者的價值
-        
-            3. 讀者建議（約150-200字）：
-               - 適合的讀者群體
-               - 閱讀建議
-               - 如何應用書中方法
-        
-            4. 結論（約100-150字）：
-               - 書籍整體評價
-               - 核心價值
+                【分析要求】
+                1. 批判性分析（約200-250字）：
+                   - 書籍主要優點
+                   - 理論和方法的局限性
+                   - 適用範圍和條件
+            
+                2. 比較分析（約150-200字）：
+                   - 與同類書籍的簡要比較
+                   - 在相關領域的定位
+                   - 對讀者的價值
+            
+                3. 讀者建議（約150-200字）：
+                   - 適合的讀者群體
+                   - 閱讀建議
+                   - 如何應用書中方法
+            
+                4. 結論（約100-150字）：
+                   - 書籍整體評價
+                   - 核心價值
 
-            書名：{book_title}
-            作者：{author_name}
+                書名：{book_title}
+                作者：{author_name}
 
-            請以有效的JSON格式回傳分析結果：
-            ```json
-            {{
-                "critical_analysis": "批判性分析（約200-250字）",
-                "comparative_analysis": "比較分析（約150-200字）",
-                "reader_recommendations": "讀者建議（約150-200字）",
-                "conclusion": "結論（約100-150字）"
-            }}
-            ```
+                請以有效的JSON格式回傳分析結果：
+                ```json
+                {{
+                    "critical_analysis": "批判性分析（約200-250字）",
+                    "comparative_analysis": "比較分析（約150-200字）",
+                    "reader_recommendations": "讀者建議（約150-200字）",
+                    "conclusion": "結論（約100-150字）"
+                }}
+                ```
+                
+                請確保：
+                1. 分析要有深度但極其精簡
+                2. 嚴格控制每個部分的字數
+                3. 提供有價值但簡明的建議
+                4. 評價客觀公正
+                5. 嚴格遵循JSON格式，確保格式正確無誤
+                """
+                
+                analysis_data = parse_json_response(client.extract_content(analysis_prompt))
+                if analysis_data is None:
+                    logger.error("解析分析結果時發生錯誤")
+                    return {}
+                return {field: analysis_data[field] for field in ANALYSIS_FIELDS if field in analysis_data}
             
-            請確保：
-            1. 分析要有深度但極其精簡
-            2. 嚴格控制每個部分的字數
-            3. 提供有價值但簡明的建議
-            4. 評價客觀公正
-            5. 嚴格遵循JSON格式，確保格式正確無誤
-            """
+            # 各階段在排程器的工作執行緒中執行，以 labeled 帶入書籍名稱並標示階段
+            scheduler = StageScheduler(max_workers=STAGE_WORKERS)
+            scheduler.add("base", labeled(run_base_stage, section="base"))
+            theme_stages = []
+            for batch_number in range(math.ceil(MAX_THEMES / THEMES_PER_BATCH)):
+                name = f"themes_{batch_number + 1}"
+                scheduler.add(name, labeled(lambda results, n=batch_number: run_themes_stage(results, n), section="themes"),
+                              depends_on=["base"])
+                theme_stages.append(name)
+            scheduler.add("concepts", labeled(run_concepts_stage, section="concepts"), depends_on=["base"])
+            scheduler.add("analysis", labeled(run_analysis_stage, section="analysis"), depends_on=["base"])
+            results, errors = scheduler.run()
             
-            analysis_response = client.extract_content(analysis_prompt)
+            if "base" not in results:
+                logger.error(f"無法取得基本資訊: {errors.get('base')}")
+                return json.dumps({"error": "無法解析基本資訊回應"}, ensure_ascii=False)
             
-            try:
-                analysis_data = json.loads(analysis_response)
-                for field in ["critical_analysis", "comparative_analysis", "reader_recommendations", "conclusion"]:
-                    if field in analysis_data:
-                        final_result[field] = analysis_data[field]
-                        logger.info(f"成功獲取{field}")
-            except:
-                logger.error("解析分析結果時發生錯誤")
-                # 嘗試從回應中提取 JSON
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```', analysis_response)
-                if json_match:
-                    try:
-                        analysis_data = json.loads(json_match.group(1).strip())
-                        for field in ["critical_analysis", "comparative_analysis", "reader_recommendations", "conclusion"]:
-                            if field in analysis_data:
-                                final_result[field] = analysis_data[field]
-                                logger.info(f"從文本中提取 JSON 成功，獲取了{field}")
-                    except:
-                        logger.error("無法從回應中提取有效 JSON")
+            # 依固定順序合併各階段結果
+            base_data = results["base"]
+            final_result = {
+                "title": base_data["book_title"],
+                "author": base_data["author_name"],
+                "author_background": base_data.get("author_background", ""),
+                "book_overview": base_data.get("book_overview", ""),
+                "themes_analysis": [],
+                "key_concepts": results.get("concepts", []),
+                "critical_analysis": "",
+                "comparative_analysis": "",
+                "reader_recommendations": "",
+                "conclusion": ""
+            }
+            for name in theme_stages:
+                final_result["themes_analysis"].extend(results.get(name, []))
+            final_result.update(results.get("analysis", {}))
             
             # 返回最終合併結果
             elapsed_time = time.time() - start_time
@@ -547,68 +488,15 @@ def process_large_pdf(text):
 
 def split_large_text(text, max_chunk_size=5000):
     """
-    將大型文本按一定大小分割，但嘗試以段落為單位切割，確保語意完整性
+    將大型文本按一定大小分割，但嘗試以章節、段落為單位切割，確保語意完整性
     """
     # 如果文本夠短，直接返回
     if len(text) <= max_chunk_size:
         return [text]
     
-    chunks = []
-    
-    # 嘗試按章節分割
-    chapter_patterns = [
-        r'第[一二三四五六七八九十百零0-9１２３４５６７８９０]+[章節课]',  # 匹配"第一章"、"第1章"等格式
-        r'Chapter\s+\d+',  # 匹配英文章節標題
-        r'CHAPTER\s+\d+', 
-        r'\n\d+[\.\s]+'   # 匹配數字+點+空格的格式
-    ]
-    
-    # 合併所有章節模式
-    combined_pattern = '|'.join(chapter_patterns)
-    chapters = re.split(f'({combined_pattern})', text)
-    
-    current_chunk = ""
-    for i in range(0, len(chapters), 2):
-        if i < len(chapters):
-            chapter_start = chapters[i]
-            if i + 1 < len(chapters):
-                chapter_title = chapters[i + 1]
-                current_part = chapter_title + chapter_start
-            else:
-                current_part = chapter_start
-                
-            # 如果當前塊加上新章節超過最大大小，則保存當前塊並開始新塊
-            if len(current_chunk) + len(current_part) > max_chunk_size and current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = current_part
-            else:
-                current_chunk += current_part
-    
-    # 添加最後一個塊
-    if current_chunk:
-        chunks.append(current_chunk)
-    
-    # 如果按章節分割無效（例如沒有找到章節標記），則按段落分割
-    if not chunks:
-        paragraphs = text.split('\n\n')
-        current_chunk = ""
-        
-        for para in paragraphs:
-            if len(current_chunk) + len(para) + 2 > max_chunk_size and current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = para
-            else:
-                if current_chunk:
-                    current_chunk += '\n\n'
-                current_chunk += para
-        
-        if current_chunk:
-            chunks.append(current_chunk)
-    
-    # 如果連段落分割也無效，則直接按字符數分割
-    if not chunks:
-        for i in range(0, len(text), max_chunk_size):
-            chunks.append(text[i:i + max_chunk_size])
+    # 依序以章節、段落、句子為切點合併區段，都無法切割時才按字符數分割
+    spans = get_boundary_index(text).split_by_length(max_chunk_size)
+    chunks = [text[start:end] for start, end in spans]
     
     logger.info(f"文本已分割為 {len(chunks)} 個部分")
     return chunks
@@ -617,51 +505,45 @@ def split_large_text(text, max_chunk_size=5000):
 class DeepseekClient:
     def __init__(self, api_key):
         self.api_key = api_key
-        self.api_url = "https://api.deepseek.com/v1/chat/completions"
+        self.api_url = DEEPSEEK_CHAT_URL
         self.headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {api_key}"
         }
         
-    def extract_content(self, prompt):
-        """使用 DeepSeek API 擷取內容"""
+    def extract_content(self, prompt, context=None):
+        """
+        使用 DeepSeek API 擷取內容；串流模式下每完成一個頂層 JSON 欄位就寫入日誌
+
+        context 為書籍內容時，依 PROMPT_LAYOUT 放在指示之前，同一份內容的多次請求可命中伺服器端快取
+        """
         try:
             payload = {
                 "model": "deepseek-chat",
-                "messages": [
-                    {"role": "user", "content": prompt}
-                ],
+                "messages": build_messages(prompt, context),
                 "temperature": 0.3,
                 "max_tokens": 8192
             }
             
-            logger.info("發送請求至 DeepSeek API...")
-            response = requests.post(self.api_url, json=payload, headers=self.headers)
+            def send():
+                logger.info("發送請求至 DeepSeek API...")
+                # 串流接收時，JSON 欄位一完成就寫入日誌，停滯的串流會提前中止
+                result = post_chat_completion(self.api_url, self.headers, payload, timeout=DEEPSEEK_REQUEST_TIMEOUT,
+                                              on_text=json_field_watcher())
+                return result
             
-            if response.status_code == 200:
-                result = response.json()
-                content = result["choices"][0]["message"]["content"]
-                logger.info("成功從 DeepSeek API 獲取回應")
-                
-                # 尝试提取 JSON 部分（如果存在）
-                json_match = re.search(r'```json\s*([\s\S]*?)\s*```', content)
-                if json_match:
-                    json_str = json_match.group(1).strip()
-                    try:
-                        # 验证 JSON 是否有效
-                        parsed_json = json.loads(json_str)
-                        return json.dumps(parsed_json, ensure_ascii=False)
-                    except json.JSONDecodeError:
-                        logger.warning("無法解析返回的 JSON 格式，返回原始內容")
-                        return content
-                else:
-                    logger.warning("回應中找不到 JSON 格式，返回原始內容")
-                    return content
-            else:
-                error_msg = f"DeepSeek API 請求失敗: HTTP {response.status_code}, {response.text}"
-                logger.error(error_msg)
-                return json.dumps({"error": error_msg}, ensure_ascii=False)
-                
+            # 429／5xx／逾時依共用策略重試，其他 4xx 直接失敗
+            result = deepseek_retry.call(send, "DeepSeek API")
+            content = result["choices"][0]["message"]["content"]
+            logger.info("成功從 DeepSeek API 獲取回應")
+            
+            # 尝试提取 JSON 部分（如果存在，與 AsyncDeepseekClient 共用）
+            return extract_json_content(content)
+            
+        except APIRequestError as e:
+            error_msg = str(e)
+            logger.error(error_msg)
+            return json.dumps({"error": error_msg}, ensure_ascii=False)
         except Exception as e:
             error_msg = f"呼叫 DeepSeek API 時發生錯誤: {str(e)}"
             logger.error(error_msg)
@@ -682,6 +564,8 @@ def extract_content(input_file, max_retries=3):
         # 這裡只取前100K字元進行分析，實際應用時可能需要更複雜的分段處理邏輯
         pdf_text = pdf_text[:100000]
     
+    # 傳輸層錯誤已由 DeepseekClient 重試，這裡處理的是回應內容無法解析等情況
+    delays = deepseek_retry.delays()
     for attempt in range(max_retries):
         try:
             # 實例化 DeepseekClient 客戶端，連接至 DeepSeek API
@@ -745,18 +629,18 @@ def extract_content(input_file, max_retries=3):
                 logger.error(f"無法解析DeepSeek回應為JSON: {content[:500]}...")
                 if attempt == max_retries - 1:
                     raise Exception("無法解析DeepSeek回應為JSON")
-                time.sleep(2 ** attempt)
+                time.sleep(next(delays))
                 
         except Exception as e:
             logger.error(f"分析過程發生錯誤: {str(e)}")
             if attempt == max_retries - 1:
                 raise Exception(f"分析過程失敗，已嘗試 {max_retries} 次: {str(e)}")
-            time.sleep(2 ** attempt)  # 指數退避
+            time.sleep(next(delays))  # 與 API 重試相同的 decorrelated jitter 退避
     
     raise Exception("所有分析嘗試均失敗")
 
-def extract_pdf_text(pdf_file):
-    """使用PyPDF2從PDF提取文本"""
+def extract_pdf_text(pdf_file, extract_workers=None, use_text_cache=True):
+    """使用PyPDF2從PDF提取文本（頁面分片平行提取，優先讀取文本快取）"""
     logger.info(f"開始從PDF提取文本: {pdf_file}")
     
     try:
@@ -764,18 +648,15 @@ def extract_pdf_text(pdf_file):
         file_size = os.path.getsize(pdf_file)
         logger.info(f"PDF檔案大小: {file_size / 1024 / 1024:.2f} MB")
         
-        text = ""
-        with open(pdf_file, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            num_pages = len(reader.pages)
-            logger.info(f"PDF頁數: {num_pages}")
-            
-            # 提取每頁文本
-            for page_num in range(num_pages):
-                page = reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text:
-                    text += f"\n--- 第 {page_num+1} 頁 ---\n{page_text}"
+        # 逐頁串流讀取並加上頁碼標記，最後一次性組合
+        parts = []
+        num_pages = 0
+        for page_num, page_text in iter_pages(pdf_file, workers=extract_workers, use_cache=use_text_cache):
+            num_pages = page_num
+            if page_text:
+                parts.append(f"\n--- 第 {page_num} 頁 ---\n{page_text}")
+        logger.info(f"PDF頁數: {num_pages}")
+        text = "".join(parts)
         
         # 檢查是否成功提取文本
         if not text.strip():
@@ -801,48 +682,42 @@ def translate_text(text, max_retries=3):
         return text  # 直接返回字典或列表，不翻譯目錄結構
 
     # 處理純文本
-    retry_count = 0
-    while retry_count < max_retries:
-        retry_count += 1
-        try:
-            logging.info(f"呼叫 DeepL API 進行翻譯 (第 {retry_count} 次嘗試)...")
-            params = {
-                "auth_key": DEEPL_API_KEY,
-                "text": text,
-                "target_lang": "ZH-HANT",  # 指定繁體中文作為目標語言
-                "tag_handling": "xml",  # 保留格式標籤
-                "formality": "default",  # 語氣：正式/非正式
-                "preserve_formatting": True,  # 保留原文格式
-                "split_sentences": "1"  # 保持句子完整性
-            }
-            response = requests.post(
-                DEEPL_API_URL, 
-                data=params,
-                timeout=30  # 設定30秒超時
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"DeepL API 請求失敗，狀態碼：{response.status_code}，回應內容：{response.text}")
-                if retry_count == max_retries - 1:
-                    raise Exception(f"DeepL API 請求失敗，狀態碼：{response.status_code}")
-                time.sleep(2 ** retry_count)  # 指數退避
-                continue
-            
-            result = response.json()
-            translated_text = result["translations"][0]["text"]
-            
-            # 由於已經直接指定ZH-HANT作為目標語言，不需要額外轉換
-            # 但保留此轉換以確保繁體字符的一致性
-            traditional_text = cc.convert(translated_text)
-            return traditional_text
-            
-        except Exception as e:
-            logger.error(f"翻譯過程發生錯誤: {str(e)}")
-            if retry_count == max_retries - 1:
-                raise Exception(f"翻譯過程失敗，已嘗試 {max_retries} 次: {str(e)}")
-            time.sleep(2 ** retry_count)  # 指數退避
+    params = {
+        "auth_key": DEEPL_API_KEY,
+        "text": text,
+        "target_lang": "ZH-HANT",  # 指定繁體中文作為目標語言
+        "tag_handling": "xml",  # 保留格式標籤
+        "formality": "default",  # 語氣：正式/非正式
+        "preserve_formatting": True,  # 保留原文格式
+        "split_sentences": "1"  # 保持句子完整性
+    }
+    
+    def send():
+        if api_cassette is not None and api_cassette.replaying:
+            return api_cassette.replay("deepl", params)
+        logging.info("呼叫 DeepL API 進行翻譯...")
+        start_time = time.monotonic()
+        response = get_session().post(
+            DEEPL_API_URL, 
+            data=params,
+            timeout=30  # 設定30秒超時
+        )
+        result = check_response(response, "DeepL API").json()
+        if api_cassette is not None:
+            api_cassette.record("deepl", params, result, time.monotonic() - start_time)
+        return result
+    
+    try:
+        # 最多嘗試 max_retries 次，429／5xx／逾時才重試
+        result = deepl_retry.call(send, "DeepL API", max_attempts=max_retries)
+        translated_text = result["translations"][0]["text"]
+    except Exception as e:
+        logger.error(f"翻譯過程發生錯誤: {str(e)}")
+        raise Exception(f"翻譯過程失敗: {str(e)}")
     
-    raise Exception("所有翻譯嘗試均失敗")
+    # 由於已經直接指定ZH-HANT作為目標語言，不需要額外轉換
+    # 但保留此轉換以確保繁體字符的一致性
+    return cc.convert(translated_text)
 
 def process_chapters_for_translation(chapters):
     """特別處理章節資料結構，將其準備為可翻譯的格式"""
@@ -1230,16 +1105,20 @@ def generate_markdown(translated_data, output_file):
 # ==========================
 # 主流程
 # ==========================
-def process_single_file(input_file, output_folder):
-    """處理單一PDF檔案的完整流程"""
+def process_single_file(input_file, output_folder, extract_workers=None, use_text_cache=True, pdf_text=None):
+    """處理單一PDF檔案的完整流程（批次管線已提取文本時由 pdf_text 傳入）"""
     try:
         start_time = time.time()
         logger.info(f"開始處理檔案: {os.path.basename(input_file)}")
+        set_call_context(book=os.path.splitext(os.path.basename(input_file))[0])
         
         # 1. 呼叫 deepseek API 分析中文 PDF 內容
         logger.info("步驟1: 分析 PDF 內容")
         extract_start = time.time()
-        extracted_data_str = analyze_pdf_with_deepseek(extract_pdf_text(input_file))
+        if pdf_text is None:
+            pdf_text = extract_pdf_text(input_file, extract_workers, use_text_cache)
+        # 分析時已計算全書 token 數，直接沿用，不再對全文重新計數
+        extracted_data_str, input_tokens = analyze_pdf_with_deepseek(pdf_text)
         
         # 記錄原始回應長度以便調試
         logger.info(f"API回應長度: {len(extracted_data_str)} 字符")
@@ -1297,7 +1176,8 @@ def process_single_file(input_file, output_folder):
             "filename": os.path.basename(input_file),
             "success": md_result,
             "md_output": md_output,
-            "time_elapsed": total_time
+            "time_elapsed": total_time,
+            "input_tokens": input_tokens
         }
         
     except Exception as e:
@@ -1309,6 +1189,17 @@ def process_single_file(input_file, output_folder):
             "error": str(e)
         }
 
+def process_batch(input_dir, output_folder, max_workers=4, extract_workers=None, use_text_cache=True, max_files=0):
+    """以「提取行程池 → 有界佇列 → API 執行緒」管線處理目錄中的所有PDF檔案"""
+    return run_batch(
+        input_dir,
+        partial(extract_pdf_text, extract_workers=1, use_text_cache=use_text_cache),
+        lambda pdf_file, pdf_text: process_single_file(pdf_file, output_folder, pdf_text=pdf_text),
+        extract_workers=extract_workers,
+        api_workers=max_workers,
+        max_files=max_files,
+    )
+
 def main():
     """主流程"""
     parser = argparse.ArgumentParser(description="Deepseek 文件分析與翻譯工具")
@@ -1321,7 +1212,11 @@ def main():
     
     parser.add_argument("--output", dest="output_dir", help="輸出目錄路徑")
     parser.add_argument("--max-workers", type=int, default=4, 
-                        help="最大並行處理線程數")
+                        help="目錄模式下同時呼叫API分析的PDF檔案數")
+    parser.add_argument("--extract-workers", type=int, default=0,
+                        help="PDF文本提取的並行行程數；目錄模式下為同時提取的檔案數 (0=依CPU核心數)")
+    parser.add_argument("--no-text-cache", action="store_true",
+                        help="不使用PDF提取文本快取，強制重新解析PDF")
     parser.add_argument("--max-files", type=int, default=0,
                         help="最大處理檔案數量 (0=全部)")
     parser.add_argument("--log-level", choices=["debug", "info", "warning", "error"], default="info",
@@ -1366,7 +1261,7 @@ def main():
             return
             
         # 執行單一檔案處理
-        result = process_single_file(args.input, args.output_dir)
+        result = process_single_file(args.input, args.output_dir, args.extract_workers, not args.no_text_cache)
         if result["success"]:
             logger.info(f"成功處理檔案: {result['filename']}")
         else:
@@ -1383,41 +1278,14 @@ def main():
             logger.error(f"指定的輸入路徑不是目錄: {args.input_dir}")
             return
         
-        pdf_files = [os.path.join(args.input_dir, f) for f in os.listdir(args.input_dir) 
-                    if f.lower().endswith('.pdf') and os.path.isfile(os.path.join(args.input_dir, f))]
-        
-        if not pdf_files:
-            logger.warning(f"沒有找到PDF檔案於目錄: {args.input_dir}")
-            return
-        
-        # 限制處理檔案數量
-        if args.max_files > 0 and len(pdf_files) > args.max_files:
-            logger.info(f"限制處理檔案數量為 {args.max_files} (共有 {len(pdf_files)} 個檔案)")
-            pdf_files = pdf_files[:args.max_files]
-        
-        logger.info(f"找到 {len(pdf_files)} 個PDF檔案需要處理")
-        
-        # 開始處理檔案
-        results = []
-        for i, pdf_file in enumerate(pdf_files):
-            logger.info(f"處理檔案 ({i+1}/{len(pdf_files)}): {os.path.basename(pdf_file)}")
-            result = process_single_file(pdf_file, args.output_dir)
-            results.append(result)
-        
-        # 輸出統計
-        success_count = sum(1 for r in results if r["success"])
-        logger.info("\n===== 處理結果統計 =====")
-        logger.info(f"總檔案數: {len(results)}")
-        logger.info(f"成功處理: {success_count}")
-        logger.info(f"失敗檔案: {len(results) - success_count}")
-        
-        if len(results) - success_count > 0:
-            logger.info("\n失敗檔案清單:")
-            for r in results:
-                if not r["success"]:
-                    logger.info(f"- {r['filename']}: {r.get('error', '未知錯誤')}")
+        # 提取與 API 分析以管線重疊進行：--extract-workers 個行程提取，--max-workers 個執行緒呼叫 API
+        process_batch(args.input_dir, args.output_dir, args.max_workers, args.extract_workers,
+                      not args.no_text_cache, args.max_files)
     
     logger.info(f"\n處理完成，輸出目錄: {args.output_dir}")
+    log_session_metrics()
+    log_cache_stats()
+    log_prompt_cache_stats()
 
 def test_integration():
     """端對端整合測試"""
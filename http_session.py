@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+共用 HTTP 連線池
+
+所有 DeepSeek（及 DeepL）呼叫共用同一個 requests.Session，連線以 keep-alive 重複使用，
+不必每次請求都重新進行 TCP 與 TLS 握手。session_metrics 回報實際建立的連線數與重用比例。
+"""
+
+import os
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# 快取的連線池數量（每個主機一個池）
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+# 每個主機同時保留的連線數，應不小於同時進行的請求數
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "32"))
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def _create_session():
+    """建立掛載連線池 adapter 的 Session（重試由各呼叫端自行處理）"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def get_session():
+    """取得行程內共用的 Session（fork 出的子行程會各自建立新的 Session）"""
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                _session = _create_session()
+                _session_pid = os.getpid()
+    return _session
+
+def session_metrics():
+    """統計共用 Session 的請求數、新建連線數與連線重用比例"""
+    total_requests = 0
+    new_connections = 0
+    if _session is not None and _session_pid == os.getpid():
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    total_requests += pool.num_requests
+                    new_connections += pool.num_connections
+    reused = max(0, total_requests - new_connections)
+    return {
+        "requests": total_requests,
+        "new_connections": new_connections,
+        "reused": reused,
+        "reuse_ratio": reused / total_requests if total_requests else 0.0,
+    }
+
+def log_session_metrics():
+    """將連線重用統計寫入日誌"""
+    metrics = session_metrics()
+    if metrics["requests"]:
+        logger.info(f"HTTP 連線統計：{metrics['requests']} 次請求，新建 {metrics['new_connections']} 條連線，"
+                    f"重用率 {metrics['reuse_ratio']:.0%}")
+    return metrics
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本機模擬 DeepSeek 與 DeepL API
+
+不連線正式端點也能測試吞吐量、重試與斷路器：
+1. POST /v1/chat/completions：支援一般與串流（SSE）模式，回應內容依提示詞中的 ```json 範本產生
+   相同結構的模擬 JSON（沒有範本時回傳 Markdown 文字），usage 含 prompt_cache_hit_tokens
+   （與先前請求相同的最長開頭，以 64 tokens 為單位計算）
+2. POST /v2/translate：DeepL 翻譯介面，原文照樣傳回
+3. 延遲：首段文字的等待時間依指定分布抽樣，之後依每秒 token 數輸出
+4. 故障注入：依比例回傳 429（含 Retry-After）、5xx，或在回應前／串流中途停滯
+
+用法：
+    python mock_api_server.py --port 8765 --latency lognormal:0.5,0.5 --rate-429 0.1
+    export DEEPSEEK_BASE_URL=http://127.0.0.1:8765 DEEPL_BASE_URL=http://127.0.0.1:8765
+
+程式內使用：server = start_mock_server(rate_5xx=0.2)；server.base_url；server.shutdown()
+"""
+
+import re
+import sys
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from token_estimator import count_tokens
+
+# 伺服器端前綴快取的計算單位（DeepSeek 以 64 tokens 為單位命中）
+CACHE_UNIT_TOKENS = 64
+# 比對共同開頭時的字元粒度（命中的字元再換算並捨去為 CACHE_UNIT_TOKENS 的整數倍）
+CACHE_UNIT_CHARS = 64
+# 串流時每個區塊的字元數
+STREAM_CHUNK_CHARS = 8
+# 沒有 JSON 範本時產生的 Markdown 段落
+FILLER_PARAGRAPH = "這是模擬伺服器產生的分析段落，用於離線測試報告生成流程與效能。"
+
+def parse_latency(spec):
+    """
+    解析延遲分布設定，回傳抽樣函式（秒）
+
+    fixed:0.5、uniform:0.2,1.5、normal:平均,標準差、lognormal:中位數,sigma
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v] if params else []
+    if kind == "fixed":
+        return lambda: values[0] if values else 0.0
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda: random.lognormvariate(math.log(values[0]), values[1])
+    raise argparse.ArgumentTypeError(f"無法解析的延遲分布: {spec}")
+
+# ==========================
+# 模擬回應內容
+# ==========================
+def _json_template(prompt):
+    """取出提示詞中最後一個 ```json 範本，移除 // 註解與尾隨逗號後解析；無法解析時只保留欄位名稱"""
+    blocks = re.findall(r'```json\s*([\s\S]*?)\s*```', prompt)
+    if not blocks:
+        return None
+    block = re.sub(r'^\s*//.*$', '', blocks[-1], flags=re.M)
+    block = re.sub(r',(\s*[\]}])', r'\1', block)
+    try:
+        return json.loads(block)
+    except json.JSONDecodeError:
+        keys = re.findall(r'"(\w+)"\s*:', block)
+        return {key: f"（模擬）{key}" for key in dict.fromkeys(keys)} or None
+
+def _fill(template):
+    """依範本結構產生模擬值：字串加上標記，其餘型別保留"""
+    if isinstance(template, dict):
+        return {key: _fill(value) for key, value in template.items()}
+    if isinstance(template, list):
+        return [_fill(value) for value in template]
+    if isinstance(template, str):
+        return f"（模擬）{template}"
+    return template
+
+def mock_content(prompt, max_tokens, canned=None):
+    """依提示詞產生回應內容：先比對 canned 的關鍵字，再依 JSON 範本，最後產生 Markdown 段落"""
+    for keyword, content in (canned or {}).items():
+        if keyword in prompt:
+            return content
+    template = _json_template(prompt)
+    if template is not None:
+        return "```json\n" + json.dumps(_fill(template), ensure_ascii=False, indent=2) + "\n```"
+    paragraphs = max(1, min(max_tokens, 600) // 40)
+    return "## 模擬回應\n\n" + "\n\n".join(FILLER_PARAGRAPH for _ in range(paragraphs))
+
+# ==========================
+# HTTP 伺服器
+# ==========================
+class MockAPIServer(ThreadingHTTPServer):
+    """保存設定、統計與前綴快取狀態的模擬伺服器"""
+
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        super().__init__(address, MockRequestHandler)
+        self.options = options
+        self.first_token_delay = parse_latency(options.latency)
+        self.canned = {}
+        if options.responses:
+            with open(options.responses, encoding="utf-8") as f:
+                self.canned = json.load(f)
+        self._lock = threading.Lock()
+        self._prefixes = set()
+        self.stats = {}
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def cache_hit_tokens(self, messages):
+        """
+        模擬前綴快取：找出與先前任一請求相同的最長開頭，命中的 token 數捨去為 CACHE_UNIT_TOKENS 的整數倍
+
+        訊息連同角色序列化後，每 CACHE_UNIT_CHARS 個字元記錄一次累計雜湊；本次請求的所有開頭隨後加入快取。
+        """
+        text = "".join(f"{message.get('role')}\x00{message.get('content') or ''}\x01" for message in messages)
+        digest = hashlib.sha256()
+        prefixes = []
+        for start in range(0, len(text) - CACHE_UNIT_CHARS + 1, CACHE_UNIT_CHARS):
+            digest.update(text[start:start + CACHE_UNIT_CHARS].encode("utf-8"))
+            prefixes.append(digest.digest())
+        with self._lock:
+            matched = 0
+            while matched < len(prefixes) and prefixes[matched] in self._prefixes:
+                matched += 1
+            self._prefixes.update(prefixes)
+        if not matched:
+            return 0
+        return count_tokens(text[:matched * CACHE_UNIT_CHARS]) // CACHE_UNIT_TOKENS * CACHE_UNIT_TOKENS
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            super().log_message(format, *args)
+
+    # ---------- 共用 ----------
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.count(str(status))
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _inject_fault(self):
+        """依設定的比例注入故障，已送出故障回應時回傳 True"""
+        options = self.server.options
+        roll = random.random()
+        if roll < options.rate_429:
+            self._send_json(429, {"error": {"message": "Rate limit reached (mock)"}},
+                            {"Retry-After": f"{options.retry_after:g}"})
+            return True
+        roll -= options.rate_429
+        if roll < options.rate_5xx:
+            status = random.choice([500, 502, 503])
+            self._send_json(status, {"error": {"message": f"Server error {status} (mock)"}})
+            return True
+        roll -= options.rate_5xx
+        if roll < options.rate_timeout:
+            # 不送出任何回應，由客戶端的逾時處理
+            self.server.count("timeout")
+            time.sleep(options.stall_seconds)
+            self.close_connection = True
+            return True
+        return False
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length).decode("utf-8")
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        body = self._read_body()
+        if path.endswith("/chat/completions"):
+            self._chat_completions(body)
+        elif path.endswith("/v2/translate"):
+            self._translate(body)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    # ---------- DeepSeek ----------
+    def _chat_completions(self, body):
+        try:
+            payload = json.loads(body)
+            messages = payload["messages"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            self._send_json(400, {"error": {"message": "Invalid request body"}})
+            return
+        if self._inject_fault():
+            return
+
+        options = self.server.options
+        prompt = "\n".join(message.get("content") or "" for message in messages)
+        max_tokens = payload.get("max_tokens") or 4096
+        content = mock_content(prompt, max_tokens, self.server.canned)
+        prompt_tokens = count_tokens(prompt)
+        hit_tokens = min(prompt_tokens, self.server.cache_hit_tokens(messages))
+        completion_tokens = count_tokens(content)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": hit_tokens,
+            "prompt_cache_miss_tokens": prompt_tokens - hit_tokens,
+        }
+        model = payload.get("model") or "deepseek-chat"
+        response_id = f"mock-{random.getrandbits(48):012x}"
+        per_char = completion_tokens / max(1, len(content)) / options.tokens_per_second if options.tokens_per_second > 0 else 0.0
+
+        time.sleep(self.server.first_token_delay())
+        if not payload.get("stream"):
+            time.sleep(per_char * len(content))
+            self._send_json(200, {
+                "id": response_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        stall_at = len(content) // 2 if random.random() < options.rate_stall else None
+
+        def event(choices, usage=None):
+            chunk = {"id": response_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": choices}
+            if usage is not None:
+                chunk["usage"] = usage
+            self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+
+        try:
+            for start in range(0, len(content), STREAM_CHUNK_CHARS):
+                if stall_at is not None and start >= stall_at:
+                    # 串流中途停滯，測試客戶端的閒置逾時
+                    self.server.count("stall")
+                    time.sleep(options.stall_seconds)
+                    self.close_connection = True
+                    return
+                piece = content[start:start + STREAM_CHUNK_CHARS]
+                event([{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}])
+                time.sleep(per_char * len(piece))
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if (payload.get("stream_options") or {}).get("include_usage"):
+                event([], usage)
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.server.count("200")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    # ---------- DeepL ----------
+    def _translate(self, body):
+        if "json" in (self.headers.get("Content-Type") or ""):
+            texts = json.loads(body or "{}").get("text") or []
+            texts = [texts] if isinstance(texts, str) else texts
+        else:
+            texts = parse_qs(body).get("text", [])
+        if self._inject_fault():
+            return
+        time.sleep(self.server.first_token_delay())
+        self._send_json(200, {"translations": [{"detected_source_language": "EN", "text": text} for text in texts]})
+
+# ==========================
+# 啟動
+# ==========================
+def build_parser():
+    parser = argparse.ArgumentParser(description='本機模擬 DeepSeek 與 DeepL API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help='0 代表自動選擇可用的埠')
+    parser.add_argument('--latency', default='lognormal:0.5,0.5',
+                        help='首段文字前的延遲分布：fixed:秒、uniform:下限,上限、normal:平均,標準差、lognormal:中位數,sigma')
+    parser.add_argument('--tokens-per-second', type=float, default=50.0, help='輸出速度（0 代表立即送出全部內容）')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='回傳 429 的比例')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='429 回應的 Retry-After 秒數')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='回傳 500／502／503 的比例')
+    parser.add_argument('--rate-timeout', type=float, default=0.0, help='不回應直到逾時的比例')
+    parser.add_argument('--rate-stall', type=float, default=0.0, help='串流中途停滯的比例')
+    parser.add_argument('--stall-seconds', type=float, default=600.0, help='逾時與停滯持續的秒數')
+    parser.add_argument('--responses', help='JSON 檔案：{提示詞關鍵字: 回應內容}，比對到時優先使用')
+    parser.add_argument('--seed', type=int, help='隨機種子，讓延遲與故障注入可重現')
+    parser.add_argument('--verbose', action='store_true', help='輸出每個請求的存取紀錄')
+    return parser
+
+def start_mock_server(**overrides):
+    """在背景執行緒啟動模擬伺服器（參數同命令列選項，預設自動選擇埠），回傳伺服器物件"""
+    options = build_parser().parse_args([])
+    options.port = 0
+    vars(options).update(overrides)
+    if options.seed is not None:
+        random.seed(options.seed)
+    server = MockAPIServer((options.host, options.port), options)
+    threading.Thread(target=server.serve_forever, name="mock-api", daemon=True).start()
+    return server
+
+def main():
+    options = build_parser().parse_args()
+    if options.seed is not None:
+        random.seed(options.seed)
+    server = MockAPIServer((options.host, options.port), options)
+    print(f"模擬 API 伺服器已啟動：{server.base_url}")
+    print(f"  export DEEPSEEK_BASE_URL={server.base_url} DEEPL_BASE_URL={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"\n請求統計: {json.dumps(server.stats, ensure_ascii=False)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,15 +9,20 @@
 """
 
 import os
-import sys
 import json
 import time
 import logging
-import requests
+import argparse
+from functools import partial
 from pathlib import Path
-import PyPDF2
-import re
-import math
+from pdf_extractor import read_text_within_budget
+from batch_pipeline import run_batch
+from http_session import log_session_metrics  # 共用連線池
+from token_estimator import count_tokens  # 有詞彙檔時精確計數，否則估算
+from retry_policy import APIRequestError, deepseek_retry
+from response_cache import log_cache_stats
+from usage_ledger import labeled  # 用量帳本依書籍與部分類型標示每次呼叫
+from chat_completion import post_chat_completion, markdown_progress, log_prompt_cache_stats, DEEPSEEK_CHAT_URL  # DEEPSEEK_STREAM=1 時串流接收並記錄進度
 from dotenv import load_dotenv
 import opencc
 
@@ -29,7 +34,10 @@ load_dotenv()
 # ==========================
 # 獲取 Deepseek API 金鑰，優先從環境變數取得
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = DEEPSEEK_CHAT_URL  # 以環境變數 DEEPSEEK_BASE_URL 調整
+
+# 送入API的書籍文本上限（約10000個漢字），提取時達到此預算即停止讀取後續頁面
+MAX_INPUT_TOKENS = 15000
 
 # 建立桌面上的輸出資料夾
 DESKTOP_PATH = str(Path.home() / "Desktop")
@@ -53,46 +61,25 @@ logger = logging.getLogger(__name__)
 # ==========================
 # 輔助函數
 # ==========================
-def estimate_tokens(text):
-    """估算文字的 token 數量"""
-    # 一個中文字約為1.5個token，一個英文單詞約為1個token
-    chinese_char_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-    total_char_count = len(text)
-    english_word_count = len(re.findall(r'\b[a-zA-Z]+\b', text))
-    
-    # 估算總token數
-    estimated_tokens = chinese_char_count * 1.5 + english_word_count + (total_char_count - chinese_char_count - english_word_count) * 0.5
-    return int(estimated_tokens)
-
-def extract_pdf_text(pdf_path):
+def extract_pdf_text(pdf_path, extract_workers=None, use_text_cache=True):
     """從PDF檔案提取文字內容"""
     try:
         logger.info(f"正在提取PDF文本: {pdf_path}")
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ''
-            for page in reader.pages:
-                text += page.extract_text() + "\n\n"
-            
-            # 處理提取的文本
-            text = text.strip()
-            if not text:
-                logger.error("無法從PDF中提取任何文本")
-                return None
-                
-            # 估算token並截斷以符合API限制
-            tokens = estimate_tokens(text)
-            logger.info(f"提取完成。共 {len(reader.pages)} 頁，約 {tokens} tokens")
-            
-            # 將文本限制在15000個token以內（約10000個漢字）
-            if tokens > 15000:
-                logger.info(f"文本過長，將截斷至約15000個tokens")
-                # 估計截斷點（粗略計算）
-                cutoff = int(len(text) * (15000 / tokens))
-                text = text[:cutoff]
-                logger.info(f"截斷後約 {estimate_tokens(text)} tokens")
-            
-            return text
+        # 逐頁估算token，達到預算即停止讀取，長書不必解析全部頁面
+        text, pages_read, tokens = read_text_within_budget(
+            pdf_path, MAX_INPUT_TOKENS, count_tokens,
+            workers=extract_workers, use_cache=use_text_cache
+        )
+        
+        # 處理提取的文本
+        text = text.strip()
+        if not text:
+            logger.error("無法從PDF中提取任何文本")
+            return None
+        
+        logger.info(f"提取完成。讀取 {pages_read} 頁，約 {tokens} tokens")
+        
+        return text
     except Exception as e:
         logger.error(f"PDF提取失敗: {str(e)}")
         return None
@@ -218,35 +205,35 @@ def generate_section_analysis(content, book_name, section_type):
         logger.error(f"無效的部分類型: {section_type}")
         return None
     
-    try:
-        logger.info(f"開始呼叫 Deepseek API 生成 {section_type} 部分的分析報告...")
-        
-        response = requests.post(
+    def send():
+        result = post_chat_completion(
             DEEPSEEK_API_URL,
-            headers=headers,
-            json={
+            headers,
+            {
                 "model": "deepseek-chat",
                 "messages": [{"role": "user", "content": prompt}],
                 "temperature": 0.4,
                 "max_tokens": 4096  # 每部分使用較小的token限制
             },
-            timeout=300
+            timeout=300,
+            on_text=markdown_progress(f"{section_type} 部分")  # 串流時每完成一個標題就記錄進度
         )
+        content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        if not content:
+            raise APIRequestError("API 返回空內容")
+        return content
+    
+    try:
+        logger.info(f"開始呼叫 Deepseek API 生成 {section_type} 部分的分析報告...")
+        
+        # 429／5xx／逾時與空回應依共用策略重試，其他 4xx 直接失敗
+        content = deepseek_retry.call(labeled(send, book=book_name, section=section_type), f"{section_type} 部分")
+        
+        # 轉換為繁體中文
+        content = cc.convert(content)
+        logger.info(f"成功獲取 {section_type} 部分報告，字數約: {len(content)}")
+        return content
         
-        if response.status_code == 200:
-            result = response.json()
-            content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-            
-            if content:
-                # 轉換為繁體中文
-                content = cc.convert(content)
-                logger.info(f"成功獲取 {section_type} 部分報告，字數約: {len(content)}")
-                return content
-            else:
-                logger.error("API 返回空內容")
-        else:
-            logger.error(f"API 請求失敗: {response.status_code} - {response.text}")
-            
     except Exception as e:
         logger.error(f"API 調用錯誤: {str(e)}")
     
@@ -267,12 +254,13 @@ def save_report(content, book_name):
 # ==========================
 # 主要處理函數
 # ==========================
-def process_book(pdf_path):
-    """處理流程，使用多次API呼叫生成更詳細的書籍分析報告"""
+def process_book(pdf_path, extract_workers=None, use_text_cache=True, pdf_text=None):
+    """處理流程，使用多次API呼叫生成更詳細的書籍分析報告；成功時回傳報告路徑"""
     try:
         # 1. 提取PDF文本
         start_time = time.time()
-        pdf_text = extract_pdf_text(pdf_path)
+        if pdf_text is None:
+            pdf_text = extract_pdf_text(pdf_path, extract_workers, use_text_cache)
         if not pdf_text:
             print("錯誤：無法從PDF提取文本或內容為空")
             return
@@ -357,9 +345,14 @@ def process_book(pdf_path):
         minutes, seconds = divmod(elapsed_time, 60)
         print(f"\n處理完成！")
         print(f"總耗時: {int(minutes)}分{seconds:.2f}秒")
+        log_session_metrics()
+        log_cache_stats()
+        log_prompt_cache_stats()
         print(f"分析報告已儲存至: {report_path}")
         print(f"報告總字數約: {len(full_report)}")
         
+        return report_path
+        
     except Exception as e:
         print(f"處理過程中發生錯誤: {str(e)}")
         logger.error(f"處理失敗: {str(e)}")
@@ -369,15 +362,44 @@ def process_book(pdf_path):
 # ==========================
 def main():
     """主程式入口點"""
+    parser = argparse.ArgumentParser(description='多階段深度書籍分析工具')
+    parser.add_argument('pdf_path', nargs='?', help='要處理的 PDF 檔案路徑')
+    parser.add_argument('--extract-workers', type=int, default=0,
+                        help='PDF 文本提取的並行行程數（0=依 CPU 核心數）')
+    parser.add_argument('--no-text-cache', action='store_true',
+                        help='不使用 PDF 提取文本快取，強制重新解析 PDF')
+    parser.add_argument('--input-dir', help='批次模式：處理目錄中所有 PDF 檔案')
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help='批次模式下同時呼叫 API 分析的書籍數')
+    parser.add_argument('--max-files', type=int, default=0,
+                        help='批次模式下最多處理的檔案數（0=不限制）')
+    args = parser.parse_args()
+    
     print("=" * 80)
     print("多階段深度書籍分析工具")
     print("此工具將使用多次 Deepseek API 呼叫生成更詳細的深度書籍分析報告")
     print(f"結果將存放於桌面的「{os.path.basename(OUTPUT_FOLDER)}」資料夾中")
     print("=" * 80)
     
+    # 批次模式：提取與 API 分析以管線重疊進行
+    if args.input_dir:
+        if not os.path.isdir(args.input_dir):
+            print(f"錯誤：找不到目錄 '{args.input_dir}'")
+            return
+        results = run_batch(
+            args.input_dir,
+            partial(extract_pdf_text, extract_workers=1, use_text_cache=not args.no_text_cache),
+            lambda pdf_path, pdf_text: process_book(pdf_path, pdf_text=pdf_text) is not None,
+            extract_workers=args.extract_workers,
+            api_workers=args.max_workers,
+            max_files=args.max_files,
+        )
+        print(f"批次處理完成：{sum(1 for r in results if r['success'])}/{len(results)} 本成功，結果保存在：{OUTPUT_FOLDER}")
+        return
+    
     # 取得PDF路徑
-    if len(sys.argv) > 1:
-        pdf_path = sys.argv[1]
+    if args.pdf_path:
+        pdf_path = args.pdf_path
     else:
         pdf_path = input("請輸入PDF檔案完整路徑: ").strip()
     
@@ -395,7 +417,7 @@ def main():
         return
     
     # 處理書籍
-    process_book(pdf_path)
+    process_book(pdf_path, args.extract_workers, not args.no_text_cache)
 
 if __name__ == "__main__":
     main()
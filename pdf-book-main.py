@@ -8,15 +8,22 @@
 """
 
 import os
-import sys
 import json
 import time
 import logging
-import requests
+import argparse
+from functools import partial
 from pathlib import Path
-import PyPDF2
-import re
-import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pdf_extractor import read_text_within_budget
+from batch_pipeline import run_batch
+from http_session import log_session_metrics  # 共用連線池
+from token_estimator import count_tokens  # 有詞彙檔時精確計數，否則估算
+from retry_policy import APIRequestError, deepseek_retry
+from response_cache import log_cache_stats
+from usage_ledger import labeled  # 用量帳本依書籍與部分類型標示每次呼叫
+from chat_completion import post_chat_completion, markdown_progress, log_prompt_cache_stats, DEEPSEEK_CHAT_URL  # DEEPSEEK_STREAM=1 時串流接收並記錄進度
+from prompt_layout import build_messages, use_prefix_layout
 from dotenv import load_dotenv
 import opencc
 
@@ -28,7 +35,29 @@ load_dotenv()
 # ==========================
 # 獲取 Deepseek API 金鑰，優先從環境變數取得
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = DEEPSEEK_CHAT_URL  # 以環境變數 DEEPSEEK_BASE_URL 調整
+
+# 送入API的書籍文本上限，提取時達到此預算即停止讀取後續頁面
+MAX_INPUT_TOKENS = 20000
+
+# 同時呼叫 API 生成的報告部分數量（各部分彼此獨立，預設七個部分全部並行）
+SECTION_WORKERS = int(os.getenv("SECTION_WORKERS", "7"))
+
+# 各部分送入的書籍內容：slice（預設）為依部分順序平均切出的七分之一節錄；full 為完整文本，
+# 七次呼叫的開頭完全相同，可命中 DeepSeek 伺服器端的前綴快取，但送出的 prompt token 約為七倍，
+# 且第一部分需先單獨完成
+SECTION_CONTEXT = os.getenv("SECTION_CONTEXT", "slice")
+
+# 七個報告部分，依報告中的順序排列：(部分類型, 顯示名稱)
+REPORT_SECTIONS = [
+    ("book_overview", "書籍概覽"),
+    ("theoretical_framework", "理論框架分析"),
+    ("key_arguments", "關鍵論點分析"),
+    ("methodology_analysis", "方法論與案例分析"),
+    ("chapter_deep_dive", "章節深度剖析"),
+    ("practical_guidance", "實用指引與跨領域啟示"),
+    ("critical_reflection", "批判性反思"),
+]
 
 # 建立桌面上的輸出資料夾
 DESKTOP_PATH = str(Path.home() / "Desktop")
@@ -41,7 +70,7 @@ cc = opencc.OpenCC('s2tw')  # 針對台灣繁體中文進行最佳化
 # 配置日誌
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(threadName)s - %(levelname)s - %(message)s',
     handlers=[
         logging.FileHandler("processing.log", encoding="utf-8"),
         logging.StreamHandler()
@@ -52,46 +81,25 @@ logger = logging.getLogger(__name__)
 # ==========================
 # 輔助函數
 # ==========================
-def estimate_tokens(text):
-    """估算文字的 token 數量"""
-    # 一個中文字約為1.5個token，一個英文單詞約為1個token
-    chinese_char_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
-    total_char_count = len(text)
-    english_word_count = len(re.findall(r'\b[a-zA-Z]+\b', text))
-    
-    # 估算總token數
-    estimated_tokens = chinese_char_count * 1.5 + english_word_count + (total_char_count - chinese_char_count - english_word_count) * 0.5
-    return int(estimated_tokens)
-
-def extract_pdf_text(pdf_path):
+def extract_pdf_text(pdf_path, extract_workers=None, use_text_cache=True):
     """從PDF檔案提取文字內容"""
     try:
         logger.info(f"正在提取PDF文本: {pdf_path}")
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ''
-            for page in reader.pages:
-                text += page.extract_text() + "\n\n"
-            
-            # 處理提取的文本
-            text = text.strip()
-            if not text:
-                logger.error("無法從PDF中提取任何文本")
-                return None
-                
-            # 估算token並截斷以符合API限制
-            tokens = estimate_tokens(text)
-            logger.info(f"提取完成。共 {len(reader.pages)} 頁，約 {tokens} tokens")
-            
-            # 將文本限制在20000個token以內
-            if tokens > 20000:
-                logger.info(f"文本過長，將截斷至約20000個tokens")
-                # 估計截斷點（粗略計算）
-                cutoff = int(len(text) * (20000 / tokens))
-                text = text[:cutoff]
-                logger.info(f"截斷後約 {estimate_tokens(text)} tokens")
-            
-            return text
+        # 逐頁估算token，達到預算即停止讀取，長書不必解析全部頁面
+        text, pages_read, tokens = read_text_within_budget(
+            pdf_path, MAX_INPUT_TOKENS, count_tokens,
+            workers=extract_workers, use_cache=use_text_cache
+        )
+        
+        # 處理提取的文本
+        text = text.strip()
+        if not text:
+            logger.error("無法從PDF中提取任何文本")
+            return None
+        
+        logger.info(f"提取完成。讀取 {pages_read} 頁，約 {tokens} tokens")
+        
+        return text
     except Exception as e:
         logger.error(f"PDF提取失敗: {str(e)}")
         return None
@@ -108,6 +116,13 @@ def save_report(content, book_name):
         logger.error(f"儲存報告失敗: {str(e)}")
         return None
 
+def section_context(content, section_type):
+    """該部分送入的書籍內容"""
+    if SECTION_CONTEXT == "full":
+        return content
+    index = [name for name, _ in REPORT_SECTIONS].index(section_type)
+    return content[int(index * len(content) / len(REPORT_SECTIONS)):int((index + 1) * len(content) / len(REPORT_SECTIONS))]
+
 def generate_api_section(content, book_name, section_type, max_tokens=4096, temperature=0.4):
     """為特定報告部分生成分析內容"""
     if not DEEPSEEK_API_KEY:
@@ -138,9 +153,7 @@ def generate_api_section(content, book_name, section_type, max_tokens=4096, temp
            - 評估作者在相關領域的貢獻及專業地位
            - 其他著作與本書的關聯
         
-        分析需深入、全面、專業，總字數至少900字。請基於以下書籍節錄進行分析：
-        
-        {content[:int(len(content)/7)]}
+        分析需深入、全面、專業，總字數至少900字。請基於所提供的書籍內容進行分析。
         """,
         
         "theoretical_framework": f"""
@@ -164,9 +177,7 @@ def generate_api_section(content, book_name, section_type, max_tokens=4096, temp
            - 不同職業、年齡層讀者的收穫差異
            - 企業/個人應用的具體場景建議
         
-        分析需邏輯嚴謹、見解獨到，總字數至少1500字。請基於以下書籍節錄進行分析：
-        
-        {content[int(len(content)/7):int(2*len(content)/7)]}
+        分析需邏輯嚴謹、見解獨到，總字數至少1500字。請基於所提供的書籍內容進行分析。
         """,
         
         # 第二部分：核心摘要
@@ -186,9 +197,7 @@ def generate_api_section(content, book_name, section_type, max_tokens=4096, temp
            - 評估作者如何創新性地發展或應用這些理論
            - 分析理論基礎的科學性與可靠性
         
-        分析需深入、學術性強，總字數至少1300字。請基於以下書籍節錄進行分析：
-        
-        {content[int(2*len(content)/7):int(3*len(content)/7)]}
+        分析需深入、學術性強，總字數至少1300字。請基於所提供的書籍內容進行分析。
         """,
         
         "methodology_analysis": f"""
@@ -212,9 +221,7 @@ def generate_api_section(content, book_name, section_type, max_tokens=4096, temp
            - 評估書中方法在現代社會的適用性和創新性
            - 比較歷史上類似著作的長期影響
         
-        分析需具體、實用、深入，總字數至少1800字。請基於以下書籍節錄進行分析：
-        
-        {content[int(3*len(content)/7):int(4*len(content)/7)]}
+        分析需具體、實用、深入，總字數至少1800字。請基於所提供的書籍內容進行分析。
         """,
         
         # 第三部分：批判分析
@@ -229,9 +236,7 @@ def generate_api_section(content, book_name, section_type, max_tokens=4096, temp
            - 引用關鍵段落並提供深度解讀
            - 比較同一主題在不同著作中的處理方式
         
-        分析需學術性強、見解獨到，總字數至少1200字。請基於以下書籍節錄進行分析：
-        
-        {content[int(4*len(content)/7):int(5*len(content)/7)]}
+        分析需學術性強、見解獨到，總字數至少1200字。請基於所提供的書籍內容進行分析。
         """,
         
         "practical_guidance": f"""
@@ -256,9 +261,7 @@ def generate_api_section(content, book_name, section_type, max_tokens=4096, temp
            - 提出基於書中理論的商業模式創新
            - 評估在教育、管理、心理健康等領域的實踐價值
         
-        分析需實用性強、前瞻性高、操作性強，總字數至少2000字。請基於以下書籍節錄進行分析：
-        
-        {content[int(5*len(content)/7):int(6*len(content)/7)]}
+        分析需實用性強、前瞻性高、操作性強，總字數至少2000字。請基於所提供的書籍內容進行分析。
         """,
         
         "critical_reflection": f"""
@@ -283,9 +286,7 @@ def generate_api_section(content, book_name, section_type, max_tokens=4096, temp
            - 推薦至少8本相關延伸閱讀，並說明與本書的關聯
            - 提出個人化學習計劃模板
         
-        分析需批判性強、建設性高、前瞻視野廣，總字數至少2200字。請基於以下書籍節錄進行分析：
-        
-        {content[int(6*len(content)/7):]}
+        分析需批判性強、建設性高、前瞻視野廣，總字數至少2200字。請基於所提供的書籍內容進行分析。
         """
     }
     
@@ -293,89 +294,97 @@ def generate_api_section(content, book_name, section_type, max_tokens=4096, temp
     if not prompt:
         logger.error(f"無效的部分類型: {section_type}")
         return None
+    # 書籍內容在前、各部分的指示在後（PROMPT_LAYOUT=inline 時合併為單一訊息）
+    messages = build_messages(prompt, section_context(content, section_type), inline_label="書籍節錄")
     
-    try:
-        logger.info(f"開始呼叫 Deepseek API 生成 {section_type} 部分的分析報告...")
-        
-        response = requests.post(
+    def send():
+        result = post_chat_completion(
             DEEPSEEK_API_URL,
-            headers=headers,
-            json={
+            headers,
+            {
                 "model": "deepseek-chat",
-                "messages": [{"role": "user", "content": prompt}],
+                "messages": messages,
                 "temperature": temperature,
                 "max_tokens": max_tokens
             },
-            timeout=300
+            timeout=300,
+            on_text=markdown_progress(f"{section_type} 部分")  # 串流時每完成一個標題就記錄進度
         )
+        content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
+        if not content:
+            raise APIRequestError("API 返回空內容")
+        return content
+    
+    try:
+        logger.info(f"開始呼叫 Deepseek API 生成 {section_type} 部分的分析報告...")
+        
+        # 429／5xx／逾時與空回應依共用策略重試，其他 4xx 直接失敗
+        content = deepseek_retry.call(labeled(send, book=book_name, section=section_type), f"{section_type} 部分")
+        
+        # 轉換為繁體中文
+        content = cc.convert(content)
+        logger.info(f"成功獲取 {section_type} 部分報告，字數約: {len(content)}")
+        return content
         
-        if response.status_code == 200:
-            result = response.json()
-            content = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-            
-            if content:
-                # 轉換為繁體中文
-                content = cc.convert(content)
-                logger.info(f"成功獲取 {section_type} 部分報告，字數約: {len(content)}")
-                return content
-            else:
-                logger.error("API 返回空內容")
-        else:
-            logger.error(f"API 請求失敗: {response.status_code} - {response.text}")
-            
     except Exception as e:
         logger.error(f"API 調用錯誤: {str(e)}")
     
     return None
 
+def generate_report_sections(content, book_name, max_workers=SECTION_WORKERS):
+    """並行生成所有報告部分，回傳 {部分類型: 內容}；單一部分失敗時其值為 None，不影響其他部分"""
+    results = {}
+    sections = REPORT_SECTIONS
+    if SECTION_CONTEXT == "full" and not use_prefix_layout():
+        logger.info("PROMPT_LAYOUT=inline 時各部分的請求開頭不同，SECTION_CONTEXT=full 無法命中伺服器端前綴快取")
+    elif SECTION_CONTEXT == "full" and max_workers > 1:
+        # 伺服器端快取在第一個請求完成後才建立，先單獨生成第一部分，其餘部分再並行送出以命中快取
+        section_type, label = sections[0]
+        results[section_type] = generate_api_section(content, book_name, section_type)
+        logger.info(f"《{book_name}》{label}{'已完成' if results[section_type] else '生成失敗'}")
+        sections = sections[1:]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(generate_api_section, content, book_name, section_type): (section_type, label)
+            for section_type, label in sections
+        }
+        for future in as_completed(futures):
+            section_type, label = futures[future]
+            try:
+                results[section_type] = future.result()
+            except Exception as e:
+                logger.error(f"生成 {section_type} 部分時發生錯誤: {str(e)}")
+                results[section_type] = None
+            logger.info(f"《{book_name}》{label}{'已完成' if results[section_type] else '生成失敗'}")
+    return results
+
 # ==========================
 # 主要處理函數
 # ==========================
-def process_book(pdf_path):
-    """處理流程，使用7次API呼叫生成極度詳細的書籍分析報告"""
+def process_book(pdf_path, extract_workers=None, use_text_cache=True, section_workers=SECTION_WORKERS, pdf_text=None):
+    """處理流程，使用7次API呼叫生成極度詳細的書籍分析報告；成功時回傳報告路徑"""
     try:
         # 1. 提取PDF文本
         start_time = time.time()
-        pdf_text = extract_pdf_text(pdf_path)
+        if pdf_text is None:
+            pdf_text = extract_pdf_text(pdf_path, extract_workers, use_text_cache)
         if not pdf_text:
-            print("錯誤：無法從PDF提取文本或內容為空")
+            logger.error(f"無法從PDF提取文本或內容為空: {pdf_path}")
             return
         
         # 獲取書名（不含副檔名）
         book_name = os.path.splitext(os.path.basename(pdf_path))[0]
         
-        # 2. 分段生成分析報告
-        print("正在使用 Deepseek API 分段生成極詳盡的深度分析報告...")
-        
-        # 第一部分：導論與整體定位
-        print("\n=== 第一部分：導論與整體定位 ===")
-        
-        print("- 正在生成書籍概覽...")
-        book_overview = generate_api_section(pdf_text, book_name, "book_overview")
-        
-        print("- 正在生成理論框架分析...")
-        theoretical_framework = generate_api_section(pdf_text, book_name, "theoretical_framework")
-        
-        # 第二部分：核心摘要
-        print("\n=== 第二部分：核心摘要 ===")
-        
-        print("- 正在生成關鍵論點分析...")
-        key_arguments = generate_api_section(pdf_text, book_name, "key_arguments")
-        
-        print("- 正在生成方法論與案例分析...")
-        methodology_analysis = generate_api_section(pdf_text, book_name, "methodology_analysis")
-        
-        # 第三部分：批判分析
-        print("\n=== 第三部分：批判分析 ===")
-        
-        print("- 正在生成章節深度剖析...")
-        chapter_deep_dive = generate_api_section(pdf_text, book_name, "chapter_deep_dive")
-        
-        print("- 正在生成實用指引與跨領域啟示...")
-        practical_guidance = generate_api_section(pdf_text, book_name, "practical_guidance")
-        
-        print("- 正在生成批判性反思...")
-        critical_reflection = generate_api_section(pdf_text, book_name, "critical_reflection")
+        # 2. 分段生成分析報告（七個部分同時送出，完成順序不影響報告順序）
+        logger.info(f"《{book_name}》正在使用 Deepseek API 並行生成極詳盡的深度分析報告（最多同時 {section_workers} 個部分）...")
+        sections = generate_report_sections(pdf_text, book_name, section_workers)
+        book_overview = sections["book_overview"]
+        theoretical_framework = sections["theoretical_framework"]
+        key_arguments = sections["key_arguments"]
+        methodology_analysis = sections["methodology_analysis"]
+        chapter_deep_dive = sections["chapter_deep_dive"]
+        practical_guidance = sections["practical_guidance"]
+        critical_reflection = sections["critical_reflection"]
         
         # 檢查是否至少有部分內容生成成功
         successful_sections = [
@@ -387,11 +396,11 @@ def process_book(pdf_path):
         ]
         
         if not successful_sections:
-            print("錯誤：所有部分都生成失敗")
+            logger.error(f"《{book_name}》所有部分都生成失敗")
             return
         
         # 3. 合併所有部分
-        print("正在合併各部分報告...")
+        logger.info(f"《{book_name}》正在合併各部分報告...")
         
         # 創建報告標題和目錄
         full_report = f"""# 《{book_name}》深度分析報告
@@ -467,7 +476,7 @@ def process_book(pdf_path):
         # 4. 儲存報告
         report_path = save_report(full_report, book_name)
         if not report_path:
-            print("錯誤：無法儲存分析報告")
+            logger.error(f"《{book_name}》無法儲存分析報告")
             return
         
         # 5. 完成並顯示耗時與字數統計
@@ -486,33 +495,64 @@ def process_book(pdf_path):
         }
         total_words = len(full_report)
         
-        print(f"\n處理完成！")
-        print(f"總耗時: {int(minutes)}分{seconds:.2f}秒")
-        print(f"分析報告已儲存至: {report_path}")
-        print(f"報告總字數: {total_words}")
-        print("\n各部分字數統計:")
-        for section, count in section_word_counts.items():
-            if count > 0:
-                print(f"- {section}: {count} 字")
+        logger.info(f"《{book_name}》處理完成！總耗時: {int(minutes)}分{seconds:.2f}秒")
+        log_session_metrics()
+        log_cache_stats()
+        log_prompt_cache_stats()
+        logger.info(f"《{book_name}》分析報告已儲存至: {report_path}，報告總字數: {total_words}")
+        logger.info(f"《{book_name}》各部分字數統計: " + "，".join(
+            f"{section} {count} 字" for section, count in section_word_counts.items() if count > 0))
+        
+        return report_path
         
     except Exception as e:
-        print(f"處理過程中發生錯誤: {str(e)}")
-        logger.error(f"處理失敗: {str(e)}")
+        logger.error(f"處理 {pdf_path} 時發生錯誤: {str(e)}")
 
 # ==========================
 # 主程式
 # ==========================
 def main():
     """主程式入口點"""
+    parser = argparse.ArgumentParser(description='強化版多階段深度書籍分析工具')
+    parser.add_argument('pdf_path', nargs='?', help='要處理的 PDF 檔案路徑')
+    parser.add_argument('--extract-workers', type=int, default=0,
+                        help='PDF 文本提取的並行行程數（0=依 CPU 核心數）')
+    parser.add_argument('--no-text-cache', action='store_true',
+                        help='不使用 PDF 提取文本快取，強制重新解析 PDF')
+    parser.add_argument('--input-dir', help='批次模式：處理目錄中所有 PDF 檔案')
+    parser.add_argument('--max-workers', type=int, default=4,
+                        help='批次模式下同時呼叫 API 分析的書籍數')
+    parser.add_argument('--max-files', type=int, default=0,
+                        help='批次模式下最多處理的檔案數（0=不限制）')
+    parser.add_argument('--section-workers', type=int, default=SECTION_WORKERS,
+                        help='同時生成的報告部分數量（1=依序生成）')
+    args = parser.parse_args()
+    
     print("=" * 80)
     print("強化版多階段深度書籍分析工具")
     print("此工具將使用7次 Deepseek API 呼叫生成極為詳盡的深度書籍分析報告")
     print(f"結果將存放於桌面的「{os.path.basename(OUTPUT_FOLDER)}」資料夾中")
     print("=" * 80)
     
+    # 批次模式：提取與 API 分析以管線重疊進行
+    if args.input_dir:
+        if not os.path.isdir(args.input_dir):
+            print(f"錯誤：找不到目錄 '{args.input_dir}'")
+            return
+        results = run_batch(
+            args.input_dir,
+            partial(extract_pdf_text, extract_workers=1, use_text_cache=not args.no_text_cache),
+            lambda pdf_path, pdf_text: process_book(pdf_path, section_workers=args.section_workers, pdf_text=pdf_text) is not None,
+            extract_workers=args.extract_workers,
+            api_workers=args.max_workers,
+            max_files=args.max_files,
+        )
+        print(f"批次處理完成：{sum(1 for r in results if r['success'])}/{len(results)} 本成功，結果保存在：{OUTPUT_FOLDER}")
+        return
+    
     # 取得PDF路徑
-    if len(sys.argv) > 1:
-        pdf_path = sys.argv[1]
+    if args.pdf_path:
+        pdf_path = args.pdf_path
     else:
         pdf_path = input("請輸入PDF檔案完整路徑: ").strip()
     
@@ -530,7 +570,7 @@ def main():
         return
     
     # 處理書籍
-    process_book(pdf_path)
+    process_book(pdf_path, args.extract_workers, not args.no_text_cache, args.section_workers)
 
 if __name__ == "__main__":
     main()
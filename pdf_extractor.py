@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF 文本提取引擎
+
+將頁面範圍分片交給 ProcessPoolExecutor 平行提取，每個工作行程各自開啟
+PyPDF2.PdfReader，完成後依頁碼順序重組，供各分析腳本共用。
+iter_pages 以生成器逐頁交出 (頁碼, 文本)，提取端不必持有整本書：依 token 預算讀取的腳本
+（read_text_within_budget）邊讀邊停；book_analyzer 與 deepseek_processor 的章節分塊與全書摘要
+需要完整文本，仍會組合全書。
+提取前會先查詢以 PDF 內容雜湊為鍵的磁碟快取（見 text_cache.py），提前停止的讀取
+也會把已讀的頁面寫入快取，下次從快取交出後再接續提取。
+"""
+
+import os
+import time
+import logging
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+import PyPDF2
+from text_cache import TextCache, PageWriter
+from token_index import TokenIndex
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# 預設工作行程數（0 或 None 表示依 CPU 核心數決定）
+DEFAULT_EXTRACT_WORKERS = os.cpu_count() or 1
+
+# 頁數低於此值時直接在目前行程提取，避免行程啟動成本大於收益
+PARALLEL_MIN_PAGES = 32
+
+# 每個工作行程平均分到的分片數，分片越細負載越平均
+SHARDS_PER_WORKER = 4
+
+# 依 token 預算提取時的分片頁數：分片越小，達到預算後白白提取的頁面越少
+BUDGET_SHARD_PAGES = 4
+
+# 提取器版本，提取邏輯或 PyPDF2 版本變動時快取會自動失效
+EXTRACTOR_VERSION = f"pypdf2-{PyPDF2.__version__}-1"
+
+text_cache = TextCache()
+
+# ==========================
+# 頁面分片與提取
+# ==========================
+def count_pages(pdf_path):
+    """取得 PDF 總頁數"""
+    with open(pdf_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+def plan_page_ranges(num_pages, workers, shards_per_worker=SHARDS_PER_WORKER, max_shard_pages=None):
+    """將 [0, num_pages) 切成連續的頁面範圍 [(start, end), ...]"""
+    if num_pages <= 0:
+        return []
+    num_shards = max(1, min(num_pages, workers * shards_per_worker))
+    shard_size = -(-num_pages // num_shards)  # 向上取整
+    if max_shard_pages:
+        shard_size = min(shard_size, max_shard_pages)
+    return [(start, min(start + shard_size, num_pages)) for start in range(0, num_pages, shard_size)]
+
+def _iter_page_range(pdf_path, start, end):
+    """在目前行程中逐頁提取 [start, end)，產生 (頁碼, 文本)，頁碼從 1 起算"""
+    with open(pdf_path, 'rb') as file:
+        reader = PyPDF2.PdfReader(file)
+        for page_num in range(start, end):
+            yield page_num + 1, reader.pages[page_num].extract_text() or ""
+
+def _extract_page_range(pdf_path, start, end):
+    """工作行程：自行開啟 PdfReader 並提取 [start, end) 的每頁文本"""
+    return start, [page_text for _, page_text in _iter_page_range(pdf_path, start, end)]
+
+def resolve_workers(workers):
+    """將使用者指定的工作行程數正規化（None/0 代表使用預設值）"""
+    if not workers or workers < 0:
+        return DEFAULT_EXTRACT_WORKERS
+    return workers
+
+def iter_pages(pdf_path, workers=None, use_cache=True, max_shard_pages=None):
+    """
+    逐頁產生 (page_no, text) 記錄，page_no 從 1 起算
+
+    平行模式下同時進行中的分片數量有上限（每個行程兩個），已完成的分片
+    依頁碼順序逐頁交出，因此記憶體用量取決於分片大小而非整本書
+（寫入快取時另保留已交出頁面的壓縮文本）。
+
+    use_cache 為 True 時先查詢文本快取；完整的快取直接交出，只含開頭頁面的快取
+    交出後從下一頁接續提取。生成器結束或被提前關閉時，將目前已交出的頁面寫回快取
+    （讀完全書者標記為完整）。max_shard_pages 限制每個分片的頁數，供提前停止讀取的
+    呼叫端減少多餘提取。
+    """
+    if not use_cache:
+        yield from _iter_pages_uncached(pdf_path, workers, max_shard_pages)
+        return
+
+    name = os.path.basename(pdf_path)
+    key = text_cache.make_key(pdf_path, EXTRACTOR_VERSION)
+    cached_pages, complete = text_cache.get(key) or ([], False)
+    if complete:
+        logger.info(f"使用文本快取：{name}（{len(cached_pages)} 頁）")
+        yield from enumerate(cached_pages, start=1)
+        return
+    if cached_pages:
+        logger.info(f"使用文本快取：{name} 的前 {len(cached_pages)} 頁，其後的頁面接續提取")
+
+    writer = PageWriter()
+    pages = None
+    finished = False
+    try:
+        for page_no, page_text in enumerate(cached_pages, start=1):
+            writer.add(page_text)
+            yield page_no, page_text
+        pages = _iter_pages_uncached(pdf_path, workers, max_shard_pages, start_page=len(cached_pages))
+        for page_no, page_text in pages:
+            writer.add(page_text)
+            yield page_no, page_text
+        finished = True
+    finally:
+        if pages is not None:
+            pages.close()  # 先取消尚未完成的分片再寫入快取
+        if finished or len(writer.offsets) > len(cached_pages):
+            text_cache.put(key, writer, source=name, complete=finished)
+
+def _iter_pages_uncached(pdf_path, workers=None, max_shard_pages=None, start_page=0):
+    """直接以 PyPDF2 逐頁提取（從索引 start_page 的頁面開始），不經過快取"""
+    workers = resolve_workers(workers)
+    start_time = time.time()
+    num_pages = count_pages(pdf_path)
+    next_page = start_page  # 下一個尚未交出的頁面索引
+
+    if workers > 1 and num_pages - start_page >= PARALLEL_MIN_PAGES:
+        ranges = iter([(start_page + start, start_page + end) for start, end in
+                       plan_page_ranges(num_pages - start_page, workers, max_shard_pages=max_shard_pages)])
+        logger.info(f"以 {workers} 個行程平行提取 {num_pages - start_page} 頁")
+        executor = None
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            pending = deque(executor.submit(_extract_page_range, pdf_path, start, end)
+                            for start, end in islice(ranges, workers * 2))
+            while pending:
+                start, shard_pages = pending.popleft().result()
+                shard = next(ranges, None)
+                if shard:
+                    pending.append(executor.submit(_extract_page_range, pdf_path, *shard))
+                for offset, page_text in enumerate(shard_pages):
+                    yield start + offset + 1, page_text
+                next_page = start + len(shard_pages)
+        except (OSError, RuntimeError) as e:
+            # 例如受限環境無法建立子行程，或行程池異常終止
+            logger.warning(f"平行提取失敗，自第 {next_page + 1} 頁起改為單一行程提取: {e}")
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    if next_page < num_pages:
+        yield from _iter_page_range(pdf_path, next_page, num_pages)
+
+    elapsed = time.time() - start_time
+    if elapsed > 0:
+        extracted = num_pages - start_page
+        logger.info(f"PDF 頁面提取完成：{extracted} 頁，耗時 {elapsed:.2f} 秒（{extracted / elapsed:.1f} 頁/秒）")
+
+def extract_pages(pdf_path, workers=None, use_cache=True):
+    """提取 PDF 每一頁的文本，回傳依頁碼排序的字串列表"""
+    return [page_text for _, page_text in iter_pages(pdf_path, workers=workers, use_cache=use_cache)]
+
+def read_text_within_budget(pdf_path, max_tokens, estimate_tokens, workers=None, use_cache=True, separator="\n\n"):
+    """
+    逐頁累加估算的 token 數，達到 max_tokens 即停止讀取後續頁面
+
+    最後一頁依剩餘預算截斷在句子或段落結尾，效果等同先提取全文再截斷，
+    但長書只需解析開頭的少數頁面。回傳 (文本, 已讀頁數, 估算 token 數)。
+    """
+    parts = []
+    total_tokens = 0
+    pages_read = 0
+    pages = iter_pages(pdf_path, workers=workers, use_cache=use_cache, max_shard_pages=BUDGET_SHARD_PAGES)
+    try:
+        for pages_read, page_text in pages:
+            page_tokens = estimate_tokens(page_text)
+            if total_tokens + page_tokens >= max_tokens:
+                remaining = max_tokens - total_tokens
+                if page_tokens > 0 and remaining > 0:
+                    parts.append(TokenIndex(page_text, estimate_tokens, cache_boundaries=False).truncate(remaining))
+                total_tokens = max_tokens
+                logger.info(f"已達 {max_tokens} tokens 預算，於第 {pages_read} 頁停止提取")
+                break
+            parts.append(page_text)
+            total_tokens += page_tokens
+    finally:
+        # 關閉生成器以取消尚未完成的分片
+        pages.close()
+    return separator.join(parts), pages_read, total_tokens
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示詞排列方式
+
+DeepSeek 伺服器端會快取請求開頭相同的 token（context caching），命中部分以較低價格計費且
+處理較快。原本的提示詞把各部分不同的指示放在前面、書籍內容放在最後，同一本書的多次呼叫
+開頭都不相同，快取從未命中。
+
+prefix 排列（預設）把書籍內容放在第一則 system 訊息，開頭文字對同一份內容固定不變，
+各部分的指示放在其後的 user 訊息；inline 排列維持原本單一 user 訊息的寫法。
+"""
+
+import os
+
+# prefix：書籍內容在前、指示在後；inline：原本的單一訊息排列
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "prefix")
+
+# 書籍內容訊息的開頭，不含任何隨請求變動的文字
+BOOK_CONTEXT_HEADER = "以下是一本書籍的內容，之後的每個分析請求都以這份內容為依據。\n\n"
+
+def use_prefix_layout():
+    return PROMPT_LAYOUT == "prefix"
+
+def book_context_message(context):
+    """放在最前面的書籍內容訊息；同一份內容產生的訊息完全相同，才能命中伺服器端快取"""
+    return {"role": "system", "content": BOOK_CONTEXT_HEADER + context}
+
+def build_messages(instructions, context=None, inline_label="以下是PDF內容"):
+    """
+    組合請求訊息
+
+    prefix 排列：[書籍內容, 指示]；inline 排列：指示之後接上「inline_label：」與內容
+    """
+    if context is None:
+        return [{"role": "user", "content": instructions}]
+    if use_prefix_layout():
+        return [book_context_message(context), {"role": "user", "content": instructions}]
+    return [{"role": "user", "content": f"{instructions}\n\n{inline_label}：\n```\n{context}\n```"}]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DeepSeek API 速率限制
+
+以兩個令牌桶同時限制每分鐘請求數（RPM）與每分鐘 token 數（TPM）。每次呼叫先預扣
+「估算的 prompt token 數 + max_tokens」，收到回應後依 usage 退回多扣的部分；
+請求失敗（429、5xx、逾時）時退回全部預扣的 token，重試不會重複消耗 TPM 配額。
+
+桶內餘額允許為負：呼叫端在鎖內登記預扣並算出需要等待的時間，再於鎖外等待，
+因此多個執行緒（或協程）會依到達順序平均地錯開送出，而不是同時衝出後一起收到 429。
+同步程式使用 acquire，asyncio 程式使用 acquire_async，兩者共用同一組桶。
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from token_estimator import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# 每分鐘請求數與 token 數上限（0 代表不限制）
+DEEPSEEK_RPM = int(os.getenv("DEEPSEEK_RPM", "0"))
+DEEPSEEK_TPM = int(os.getenv("DEEPSEEK_TPM", "0"))
+# 桶容量相當於幾秒的配額；數值越小送出越平均，越大越允許短暫突發
+RATE_LIMIT_BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "2"))
+
+# 等待超過此秒數時寫入日誌
+LOG_WAIT_SECONDS = 1.0
+
+class TokenBucket:
+    """以每秒 rate 的速度補充、容量為 capacity 的令牌桶（不自行加鎖）"""
+
+    def __init__(self, per_minute, burst_seconds=RATE_LIMIT_BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost):
+        """餘額補足 cost 所需的秒數"""
+        return max(0.0, (cost - self.level) / self.rate)
+
+class RateLimiter:
+    """RPM／TPM 雙令牌桶限制器，執行緒與 asyncio 皆可安全使用"""
+
+    def __init__(self, rpm=DEEPSEEK_RPM, tpm=DEEPSEEK_TPM, burst_seconds=RATE_LIMIT_BURST_SECONDS):
+        self.requests = TokenBucket(rpm, burst_seconds) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm, burst_seconds) if tpm > 0 else None
+        self._lock = threading.Lock()
+        self.total_requests = 0
+        self.total_wait = 0.0
+
+    @property
+    def enabled(self):
+        return self.requests is not None or self.tokens is not None
+
+    def _reserve(self, cost):
+        """登記一次呼叫並回傳需要等待的秒數（鎖只保護帳目，不在鎖內等待）"""
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            if self.requests is not None:
+                self.requests.refill(now)
+                wait = max(wait, self.requests.wait_time(1))
+                self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.refill(now)
+                wait = max(wait, self.tokens.wait_time(cost))
+                self.tokens.level -= cost
+            self.total_requests += 1
+            self.total_wait += wait
+        if wait >= LOG_WAIT_SECONDS:
+            logger.info(f"已達 API 速率上限，等待 {wait:.1f} 秒後送出（預估 {cost} tokens）")
+        return wait
+
+    def acquire(self, cost):
+        """同步等待直到可以送出花費 cost 個 token 的請求"""
+        if self.enabled:
+            wait = self._reserve(cost)
+            if wait > 0:
+                time.sleep(wait)
+        return cost
+
+    async def acquire_async(self, cost):
+        """acquire 的 asyncio 版本，等待期間不阻塞事件迴圈"""
+        if self.enabled:
+            wait = self._reserve(cost)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        return cost
+
+    def refund(self, tokens):
+        """退回預扣的 token（實際用量低於預估，或請求失敗時退回全部）"""
+        if self.tokens is None or tokens <= 0:
+            return
+        with self._lock:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + tokens)
+
+# 所有 DeepSeek 呼叫共用的限制器
+deepseek_limiter = RateLimiter()
+
+def request_cost(prompt, max_tokens):
+    """一次呼叫預扣的 token 數：估算的 prompt token 數加上回應上限"""
+    return count_tokens(prompt) + max_tokens
+
+def settle_usage(cost, usage):
+    """依回應中的 usage.total_tokens 退回多預扣的 token"""
+    if usage and usage.get("total_tokens"):
+        deepseek_limiter.refund(cost - usage["total_tokens"])
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DeepSeek 回應快取
+
+以 API 位址、model、messages、temperature 與 max_tokens 的雜湊為鍵，將成功的 chat completion
+結果存進 SQLite（WAL 模式，多個工作行程可同時讀寫），重新分析同一本書時
+（例如程式中斷後重跑、只修改報告排版）不必再付費呼叫 API。
+
+查詢順序為行程內的 LRU 記憶體快取 → SQLite；過期（TTL）的項目視為未命中，
+資料庫超過容量上限時依最後存取時間淘汰最舊的項目。
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# 設為 0 可停用回應快取
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") == "1"
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", str(Path.home() / ".cache" / "deepseek-book-analyzer" / "responses.sqlite3"))
+# 項目保存天數（0 代表不過期）
+RESPONSE_CACHE_TTL_DAYS = float(os.getenv("RESPONSE_CACHE_TTL_DAYS", "30"))
+# 資料庫中回應內容（壓縮後）的總大小上限
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_MB", "256")) * 1024 * 1024
+# 記憶體 LRU 保留的回應數
+RESPONSE_CACHE_MEMORY_ITEMS = int(os.getenv("RESPONSE_CACHE_MEMORY_ITEMS", "256"))
+
+# 每寫入幾筆檢查一次容量
+EVICT_CHECK_INTERVAL = 32
+# 多行程同時寫入時等待鎖的秒數
+SQLITE_BUSY_TIMEOUT = 30
+
+# 影響回應內容、納入快取鍵的請求欄位
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    body BLOB NOT NULL
+)
+"""
+
+def cache_key(payload, url=None):
+    """請求的快取鍵（與 stream 等傳輸參數無關；納入 API 位址，模擬伺服器的回應不會混入正式結果）"""
+    fields = {name: payload.get(name) for name in KEY_FIELDS}
+    fields["url"] = url
+    encoded = json.dumps(fields, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """記憶體 LRU 加上 SQLite 的兩層回應快取，執行緒與多行程皆可安全使用"""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl_days=RESPONSE_CACHE_TTL_DAYS,
+                 max_bytes=RESPONSE_CACHE_MAX_BYTES, memory_items=RESPONSE_CACHE_MEMORY_ITEMS):
+        self.path = path
+        self.ttl = ttl_days * 86400
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()  # 鍵 -> (建立時間, 結果)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connection(self):
+        """每個執行緒（及 fork 後的子行程）各自開啟連線"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(SCHEMA)
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def _remember(self, key, created, result):
+        with self._lock:
+            self._memory[key] = (created, result)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """讀取快取的結果字典，未命中或已過期時回傳 None"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._expired(entry[0]):
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[1]
+
+        try:
+            conn = self._connection()
+            row = conn.execute("SELECT created, body FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and not self._expired(row[0]):
+                result = json.loads(zlib.decompress(row[1]).decode("utf-8"))
+                conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+                self._remember(key, row[0], result)
+                with self._lock:
+                    self.disk_hits += 1
+                return result
+        except (sqlite3.Error, OSError, ValueError, zlib.error) as e:
+            logger.warning(f"讀取回應快取失敗: {e}")
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result, model=None):
+        """寫入成功的結果字典"""
+        now = time.time()
+        self._remember(key, now, result)
+        body = zlib.compress(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+        try:
+            conn = self._connection()
+            conn.execute("INSERT OR REPLACE INTO responses (key, model, created, accessed, size, body) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", (key, model, now, now, len(body), body))
+            conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"寫入回應快取失敗: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            check = self._writes % EVICT_CHECK_INTERVAL == 1
+        if check:
+            self.evict()
+
+    def evict(self):
+        """刪除過期項目；總大小仍超過上限時依最後存取時間淘汰最舊的項目"""
+        try:
+            conn = self._connection()
+            if self.ttl > 0:
+                conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                removed = 0
+                for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+                logger.info(f"回應快取超過容量上限，淘汰 {removed} 筆最久未使用的項目")
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"整理回應快取失敗: {e}")
+
+    def stats(self):
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": hits / total if total else 0.0,
+        }
+
+# 所有 DeepSeek 呼叫共用的回應快取（停用時為 None）
+response_cache = ResponseCache() if RESPONSE_CACHE_ENABLED else None
+
+def log_cache_stats():
+    """將回應快取的命中統計寫入日誌"""
+    if response_cache is None:
+        return None
+    stats = response_cache.stats()
+    if stats["memory_hits"] + stats["disk_hits"] + stats["misses"]:
+        logger.info(f"回應快取：命中 {stats['memory_hits'] + stats['disk_hits']} 次"
+                    f"（記憶體 {stats['memory_hits']}，磁碟 {stats['disk_hits']}），"
+                    f"未命中 {stats['misses']} 次，命中率 {stats['hit_ratio']:.0%}")
+    return stats
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API 重試策略與斷路器
+
+所有 DeepSeek 與 DeepL 呼叫共用同一套重試規則：
+1. 分類：429、5xx、逾時與連線錯誤可重試；其他 4xx（金鑰錯誤、請求格式錯誤）立即放棄
+2. 等待：採 decorrelated jitter（在 base 與上次等待的三倍之間隨機取值），
+   回應帶有 Retry-After 時至少等待伺服器要求的秒數
+3. 上限：每次呼叫有嘗試次數與總耗時上限，不會無止境地重試
+4. 斷路器：端點連續多次 5xx／逾時後暫停所有工作執行緒，冷卻期過後只放行一個探測請求，
+   成功才恢復，失敗則加倍冷卻時間；等待時間超出呼叫的耗時上限時直接失敗
+"""
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from email.utils import parsedate_to_datetime
+import requests
+
+try:
+    import aiohttp
+except ImportError:  # 只有非同步客戶端需要 aiohttp
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# 目前是第幾次嘗試（1 為第一次），供用量帳本等記錄重試
+current_attempt = contextvars.ContextVar("current_attempt", default=1)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# 每次呼叫最多嘗試的次數（含第一次）
+API_MAX_ATTEMPTS = int(os.getenv("API_MAX_ATTEMPTS", "4"))
+# decorrelated jitter 的起始與最大等待秒數
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "60"))
+# 單次呼叫（含所有重試與等待）的總耗時上限
+RETRY_MAX_ELAPSED = float(os.getenv("RETRY_MAX_ELAPSED", "900"))
+# 連續幾次端點故障後斷路，以及斷路的冷卻秒數（探測失敗時加倍，最多 CIRCUIT_MAX_OPEN_SECONDS）
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+CIRCUIT_MAX_OPEN_SECONDS = float(os.getenv("CIRCUIT_MAX_OPEN_SECONDS", "600"))
+
+# 可重試的 HTTP 狀態碼
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+# 探測請求進行中時，其他呼叫重新檢查斷路器狀態的間隔
+PROBE_POLL_SECONDS = 1.0
+
+# 可重試的網路層例外
+RETRY_EXCEPTIONS = (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                    asyncio.TimeoutError, TimeoutError, ConnectionError)
+if aiohttp is not None:
+    RETRY_EXCEPTIONS += (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+
+class APIRequestError(Exception):
+    """API 呼叫失敗；status 為 HTTP 狀態碼（非 HTTP 錯誤時為 None）"""
+
+    def __init__(self, message, status=None, retry_after=None, retryable=True):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.retryable = retryable
+
+class CircuitOpenError(APIRequestError):
+    """斷路器開啟且冷卻時間超出呼叫的耗時上限"""
+
+    def __init__(self, message):
+        super().__init__(message, retryable=False)
+
+def parse_retry_after(value):
+    """解析 Retry-After 標頭（秒數或 HTTP 日期），無法解析時回傳 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def error_for_status(status, text, headers=None, service="API"):
+    """依 HTTP 狀態碼建立 APIRequestError"""
+    retry_after = parse_retry_after((headers or {}).get("Retry-After"))
+    return APIRequestError(f"{service} 請求失敗: HTTP {status}, {text[:500]}",
+                           status=status, retry_after=retry_after, retryable=status in RETRY_STATUS)
+
+def check_response(response, service="API"):
+    """requests 回應非 200 時拋出 APIRequestError，否則原樣回傳"""
+    if response.status_code != 200:
+        raise error_for_status(response.status_code, response.text, response.headers, service)
+    return response
+
+def is_retryable(error):
+    if isinstance(error, APIRequestError):
+        return error.retryable
+    return isinstance(error, RETRY_EXCEPTIONS)
+
+def is_outage(error):
+    """端點本身故障（5xx、逾時、連線失敗）；429 與空回應代表端點仍在運作"""
+    if isinstance(error, APIRequestError):
+        return error.status is not None and error.status >= 500
+    return isinstance(error, RETRY_EXCEPTIONS)
+
+class CircuitBreaker:
+    """端點層級的斷路器，同一端點的所有執行緒與協程共用"""
+
+    def __init__(self, name, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS,
+                 max_open_seconds=CIRCUIT_MAX_OPEN_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_open_seconds = max_open_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.open_seconds = reset_seconds
+        self.open_until = 0.0
+        self.probing = False  # 半開狀態下是否已有探測請求在途
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        """目前需要等待的秒數；0 代表可以送出（半開狀態下只有第一個呼叫者拿到 0）"""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            if self.state == "open":
+                remaining = self.open_until - time.monotonic()
+                if remaining > 0:
+                    return remaining
+                self.state = "half_open"
+                logger.info(f"{self.name} 斷路器冷卻結束，送出探測請求")
+            if self.probing:
+                return PROBE_POLL_SECONDS
+            self.probing = True
+            return 0.0
+
+    def record_success(self):
+        with self._lock:
+            if self.state != "closed":
+                logger.info(f"{self.name} 已恢復，解除暫停")
+            self.state = "closed"
+            self.failures = 0
+            self.probing = False
+            self.open_seconds = self.reset_seconds
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == "half_open":
+                self.open_seconds = min(self.open_seconds * 2, self.max_open_seconds)
+            elif self.state == "open" or self.failures < self.failure_threshold:
+                return
+            self.state = "open"
+            self.open_until = time.monotonic() + self.open_seconds
+            logger.warning(f"{self.name} 連續 {self.failures} 次故障，暫停所有請求 {self.open_seconds:.1f} 秒")
+
+    def release_probe(self):
+        """探測請求遇到非故障錯誤（429、其他 4xx）：狀態不變，改由下一個呼叫者探測"""
+        with self._lock:
+            self.probing = False
+
+class RetryPolicy:
+    """
+    可重複使用的重試策略
+
+    用法：
+        response = deepseek_retry.call(send, "DeepSeek API")
+    send 在每次嘗試時被呼叫一次，成功時回傳結果，失敗時拋出例外（通常由 check_response 產生）。
+    """
+
+    def __init__(self, breaker=None, max_attempts=API_MAX_ATTEMPTS, base_delay=RETRY_BASE_DELAY,
+                 max_delay=RETRY_MAX_DELAY, max_elapsed=RETRY_MAX_ELAPSED):
+        self.breaker = breaker
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+
+    def delays(self):
+        """無限產生 decorrelated jitter 等待秒數"""
+        delay = self.base_delay
+        while True:
+            delay = min(self.max_delay, random.uniform(self.base_delay, delay * 3))
+            yield delay
+
+    def _breaker_wait(self, start_time, description):
+        """斷路器需要的等待秒數；超出耗時上限時拋出 CircuitOpenError"""
+        wait = self.breaker.wait_time() if self.breaker else 0.0
+        if wait and time.monotonic() - start_time + wait > self.max_elapsed:
+            raise CircuitOpenError(f"{self.breaker.name} 暫停中，{description} 放棄呼叫")
+        return wait
+
+    def _after_failure(self, error, attempt, max_attempts, delays, start_time, description):
+        """記錄失敗並回傳下次嘗試前的等待秒數；不應重試時回傳 None"""
+        if self.breaker:
+            if is_outage(error):
+                self.breaker.record_failure()
+            else:
+                # 429 與其他 4xx 無法說明端點是否恢復，不改變斷路器狀態
+                self.breaker.release_probe()
+        if not is_retryable(error) or attempt >= max_attempts:
+            return None
+        delay = next(delays)
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() - start_time + delay > self.max_elapsed:
+            return None
+        logger.warning(f"{description} 失敗（第 {attempt}/{max_attempts} 次）: {error}，{delay:.1f} 秒後重試")
+        return delay
+
+    def call(self, func, description="API", max_attempts=None):
+        """同步執行 func 並依策略重試，全部失敗時拋出最後一次的例外"""
+        max_attempts = max_attempts or self.max_attempts
+        delays = self.delays()
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self._breaker_wait(start_time, description)
+            if wait:
+                time.sleep(wait)
+                continue
+            attempt += 1
+            token = current_attempt.set(attempt)
+            try:
+                result = func()
+            except Exception as e:
+                delay = self._after_failure(e, attempt, max_attempts, delays, start_time, description)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            finally:
+                current_attempt.reset(token)
+            if self.breaker:
+                self.breaker.record_success()
+            return result
+
+    async def call_async(self, func, description="API", max_attempts=None):
+        """call 的 asyncio 版本，func 為回傳 awaitable 的函式"""
+        max_attempts = max_attempts or self.max_attempts
+        delays = self.delays()
+        start_time = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self._breaker_wait(start_time, description)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            attempt += 1
+            token = current_attempt.set(attempt)
+            try:
+                result = await func()
+            except Exception as e:
+                delay = self._after_failure(e, attempt, max_attempts, delays, start_time, description)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                current_attempt.reset(token)
+            if self.breaker:
+                self.breaker.record_success()
+            return result
+
+# 各端點共用的斷路器與重試策略
+deepseek_retry = RetryPolicy(CircuitBreaker("DeepSeek API"))
+deepl_retry = RetryPolicy(CircuitBreaker("DeepL API"))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相依關係排程器
+
+將多階段分析描述為有向無環圖：每個階段宣告它依賴哪些階段，排程器在依賴的
+階段全部成功後立即把它提交到執行緒池，彼此獨立的階段因此同時進行。
+某階段失敗時，依賴它的階段會被略過，其餘階段不受影響。
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+class StageScheduler:
+    """以執行緒池依相依關係執行各階段"""
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._stages = {}  # 名稱 -> (函式, 依賴階段)
+
+    def add(self, name, func, depends_on=()):
+        """
+        新增階段；func 以目前已完成階段的結果字典為唯一參數，回傳值即此階段的結果
+        """
+        if name in self._stages:
+            raise ValueError(f"階段名稱重複: {name}")
+        self._stages[name] = (func, tuple(depends_on))
+
+    def run(self):
+        """執行所有階段，回傳 (結果字典, 錯誤字典)"""
+        results = {}
+        errors = {}
+        pending = dict(self._stages)
+        running = {}
+        start_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            while pending or running:
+                for name, (func, depends_on) in list(pending.items()):
+                    failed = [dep for dep in depends_on if dep in errors or dep not in self._stages]
+                    if failed:
+                        # 依賴的階段失敗（或不存在），此階段無法執行
+                        del pending[name]
+                        errors[name] = RuntimeError(f"依賴的階段未完成: {', '.join(failed)}")
+                        logger.warning(f"略過階段 {name}：依賴的階段 {', '.join(failed)} 未完成")
+                    elif all(dep in results for dep in depends_on):
+                        del pending[name]
+                        logger.info(f"開始階段 {name}（已耗時 {time.time() - start_time:.1f} 秒）")
+                        # 傳入結果字典的複本，避免與主執行緒的更新互相干擾
+                        running[executor.submit(func, dict(results))] = name
+
+                if not running:
+                    # 剩下的階段彼此循環依賴，永遠無法開始
+                    for name in pending:
+                        errors[name] = RuntimeError("階段之間存在循環依賴")
+                        logger.error(f"略過階段 {name}：存在循環依賴")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                        logger.info(f"階段 {name} 完成（已耗時 {time.time() - start_time:.1f} 秒）")
+                    except Exception as e:
+                        errors[name] = e
+                        logger.error(f"階段 {name} 失敗: {e}")
+
+        return results, errors
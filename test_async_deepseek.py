@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""以本機模擬伺服器測試 asyncio 版 DeepSeek 客戶端"""
+
+import json
+import asyncio
+import threading
+import pytest
+import chat_completion
+from async_deepseek import AsyncDeepseekClient
+from mock_api_server import start_mock_server
+
+@pytest.fixture(scope="module")
+def server():
+    server = start_mock_server(latency="fixed:0", tokens_per_second=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def calls(monkeypatch):
+    """記錄寫入用量帳本時所在的執行緒"""
+    threads = []
+    record_call = chat_completion.record_call
+
+    def recording(*args, **kwargs):
+        threads.append(threading.current_thread())
+        record_call(*args, **kwargs)
+    monkeypatch.setattr(chat_completion, "record_call", recording)
+    return threads
+
+def test_semaphore_is_created_inside_the_loop(server):
+    client = AsyncDeepseekClient("k", max_concurrency=2, api_url=f"{server.base_url}/v1/chat/completions")
+    assert client._semaphore is None
+
+    async def run(prompt):
+        async with client:
+            return await asyncio.gather(*(client.chat(f"{prompt} {i}", stream=True) for i in range(3)))
+
+    # 同一個客戶端可在不同的事件迴圈中使用
+    assert all(asyncio.run(run("第一輪")))
+    assert all(asyncio.run(run("第二輪")))
+
+def test_blocking_io_runs_off_the_event_loop(server, calls):
+    client = AsyncDeepseekClient("k", api_url=f"{server.base_url}/v1/chat/completions")
+
+    async def run():
+        async with client:
+            first = await client.chat("測試執行緒", stream=False)
+            cached = await client.chat("測試執行緒", stream=False)
+        return first, cached
+
+    first, cached = asyncio.run(run())
+    assert first == cached
+    assert len(calls) == 2  # 一次 API 呼叫、一次回應快取命中
+    assert all(thread is not threading.main_thread() for thread in calls)
+
+def test_timeout_message_falls_back_to_the_configured_timeout():
+    client = AsyncDeepseekClient("k", timeout=42)
+
+    async def timeout(prompt, **kwargs):
+        raise asyncio.TimeoutError()
+    client.chat = timeout
+
+    error = json.loads(asyncio.run(client.extract_content("測試")))["error"]
+    assert error.endswith("逾時（42）")
+    assert json.loads(asyncio.run(client.extract_content("測試", timeout=7)))["error"].endswith("逾時（7）")
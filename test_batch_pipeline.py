@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試批次處理管線"""
+
+import threading
+from batch_pipeline import run_pipeline
+
+def fake_extract(path):
+    """模擬提取：empty 回傳空值（提取函式自行記錄錯誤），broken 拋出例外"""
+    if "empty" in path:
+        return None
+    if "broken" in path:
+        raise ValueError("壞檔")
+    return f"{path} 的內容"
+
+def test_extraction_failures_skip_the_api_stage():
+    analyzed = []
+    lock = threading.Lock()
+
+    def analyze(path, text):
+        with lock:
+            analyzed.append((path, text))
+        return True
+
+    paths = ["a.pdf", "empty.pdf", "broken.pdf", "b.pdf"]
+    results = run_pipeline(paths, fake_extract, analyze, extract_workers=1, api_workers=2)
+
+    assert [r["filename"] for r in results] == paths
+    assert [r["success"] for r in results] == [True, False, False, True]
+    assert "文本提取失敗" in results[1]["error"] and "壞檔" in results[2]["error"]
+    assert sorted(analyzed) == [("a.pdf", "a.pdf 的內容"), ("b.pdf", "b.pdf 的內容")]
+
+def test_analysis_errors_are_recorded_per_book():
+    def analyze(path, text):
+        if path == "b.pdf":
+            raise RuntimeError("API 失敗")
+        return {"success": True, "input_tokens": 5}
+
+    results = run_pipeline(["a.pdf", "b.pdf"], fake_extract, analyze, extract_workers=1, api_workers=1)
+    assert results[0] == {"success": True, "input_tokens": 5, "filename": "a.pdf"}
+    assert results[1]["success"] is False and results[1]["error"] == "API 失敗"
+
+def test_api_stage_runs_books_concurrently_in_input_order():
+    barrier = threading.Barrier(3, timeout=5)  # 只有三本書同時分析時才會通過
+
+    def analyze(path, text):
+        barrier.wait()
+        return {"success": True, "input_tokens": len(text)}
+
+    paths = [f"{name}.pdf" for name in "cab"]
+    results = run_pipeline(paths, fake_extract, analyze, extract_workers=1, api_workers=3, queue_size=1)
+    assert [r["filename"] for r in results] == paths
+    assert all(r["success"] for r in results)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試大型書籍分段分析的並行 map 與依序 reduce"""
+
+import re
+import time
+import threading
+import importlib
+import pytest
+
+class FakeClient:
+    """依提示詞類型回傳固定結構；分塊請求越前面的越晚完成，並記錄同時進行的請求數"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def extract_content(self, prompt):
+        match = re.search(r"第 (\d+)/(\d+) 部分", prompt)
+        if match is None:
+            if "初步分析" in prompt:
+                return {"title": "書名", "author": "作者", "estimated_structure": []}
+            return {"comprehensive_overview": "整合概述", "reading_guide": "導讀"}
+
+        index, total = int(match.group(1)), int(match.group(2))
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        time.sleep(0.01 * (total - index))
+        with self.lock:
+            self.running -= 1
+        if index in self.failing:
+            return {"error": "API 錯誤"}
+        return {"identified_chapters": [{"chapter_title": f"第 {index} 部分"}],
+                "partial_overview": f"概述{index}", "partial_evaluation": f"評價{index}"}
+
+@pytest.fixture
+def book_analyzer(tmp_path, monkeypatch):
+    # 模組載入時會在桌面建立輸出資料夾與日誌，先把家目錄與目前目錄指向暫存目錄
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("book_analyzer")
+
+@pytest.fixture
+def book(sample_text):
+    return sample_text(3, paragraphs=400)
+
+def run(book_analyzer, monkeypatch, book, client, workers):
+    monkeypatch.setattr(book_analyzer, "DeepseekClient", lambda api_key: client)
+    return book_analyzer.process_large_book(book, chunk_workers=workers)
+
+def test_chunks_are_analyzed_in_parallel_and_merged_in_order(book_analyzer, monkeypatch, book):
+    client = FakeClient()
+    result = run(book_analyzer, monkeypatch, book, client, workers=4)
+    total = len(result["chapter_analysis"])
+    assert total > 4 and client.peak == 4
+    assert [chapter["chapter_title"] for chapter in result["chapter_analysis"]] == [f"第 {i} 部分" for i in range(1, total + 1)]
+    assert result["evaluation"] == " ".join(f"評價{i}" for i in range(1, total + 1))
+    assert result["overview"] == "整合概述" and result["reading_guide"] == "導讀"
+
+def test_failed_chunks_are_skipped(book_analyzer, monkeypatch, book):
+    result = run(book_analyzer, monkeypatch, book, FakeClient(failing={2}), workers=4)
+    titles = [chapter["chapter_title"] for chapter in result["chapter_analysis"]]
+    assert "第 2 部分" not in titles and titles[:2] == ["第 1 部分", "第 3 部分"]
+
+def test_one_worker_is_sequential(book_analyzer, monkeypatch, book):
+    client = FakeClient()
+    serial = run(book_analyzer, monkeypatch, book, client, workers=1)
+    assert client.peak == 1
+    assert serial == run(book_analyzer, monkeypatch, book, FakeClient(), workers=4)
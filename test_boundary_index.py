@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試文本邊界索引"""
+
+import boundary_index
+from boundary_index import BoundaryIndex, get_boundary_index
+
+SAMPLE = ("--- 第 1 頁 ---\n第一章 緣起\n天地玄黃。宇宙洪荒！\n\n"
+          "日月盈昃？辰宿列張。書中提到第三章的內容。\n\n"
+          "--- 第 2 頁 ---\nChapter 2\nThe sky is blue. The sea is deep.")
+
+def test_finds_each_kind_of_boundary():
+    index = BoundaryIndex(SAMPLE)
+    assert [SAMPLE[o:o + 3] for o in index.pages] == ["---", "---"]
+    assert list(index.page_numbers) == [1, 2]
+    assert [SAMPLE[o:o + 3] for o in index.chapters] == ["第一章", "Cha"]
+    assert all(SAMPLE[o - 2:o] == "\n\n" for o in index.paragraphs)
+    # 英文句號需後接空格，文末的 "." 不算邊界
+    assert [SAMPLE[o - 1] for o in index.sentences] == ["。", "！", "？", "。", "。", "."]
+
+def test_chapter_heading_must_start_a_line():
+    index = BoundaryIndex("前文提到第三章的論點。\n第三章 正文")
+    assert len(index.chapters) == 1
+    assert index.chapters[0] == len("前文提到第三章的論點。\n")
+
+def test_between_is_exclusive():
+    index = BoundaryIndex("一。二。三。")
+    assert list(index.between("sentences", 2, 6)) == [4]
+
+def test_split_by_length_prefers_coarse_boundaries():
+    text = "第一章\n" + "甲。" * 30 + "\n\n" + "乙。" * 30 + "\n第二章\n" + "丙。" * 10
+    spans = BoundaryIndex(text).split_by_length(80)
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(spans, spans[1:]))
+    assert all(end - start <= 80 for start, end in spans)
+    assert text[spans[-1][0]:].startswith("第二章")
+
+def test_split_by_length_hard_cuts_without_boundaries():
+    assert BoundaryIndex("x" * 25).split_by_length(10) == [(0, 10), (10, 20), (20, 25)]
+
+def test_cache_is_keyed_on_digest():
+    text = SAMPLE * 3
+    index = get_boundary_index(text)
+    assert get_boundary_index("".join([SAMPLE] * 3)) is index  # 內容相同的不同字串物件
+    assert all(not isinstance(key[1], str) for key in boundary_index._cache)
+    assert get_boundary_index(text, cache=False) is not index
+
+def test_cache_is_bounded():
+    for i in range(boundary_index.BOUNDARY_CACHE_SIZE + 3):
+        get_boundary_index(f"文本 {i}。")
+    assert len(boundary_index._cache) == boundary_index.BOUNDARY_CACHE_SIZE
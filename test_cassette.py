@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試 API 卡帶的錄製、比對與重播"""
+
+import gzip
+import json
+import asyncio
+import pytest
+import cassette
+import chat_completion
+from cassette import Cassette, request_key
+from retry_policy import APIRequestError
+from token_calibration import TokenCalibration
+
+def payload(content="請分析這本書", **overrides):
+    data = {"model": "deepseek-chat", "messages": [{"role": "user", "content": content}],
+            "temperature": 0.3, "max_tokens": 200}
+    data.update(overrides)
+    return data
+
+def result(content):
+    return {"model": "deepseek-chat", "choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+
+@pytest.fixture
+def calibration(tmp_path, monkeypatch):
+    """卡帶會凍結校正資料，改用獨立的實例，不影響其他測試"""
+    calibration = TokenCalibration(str(tmp_path / "token_calibration.json"))
+    monkeypatch.setattr(cassette, "token_calibration", calibration)
+    return calibration
+
+@pytest.fixture
+def path(tmp_path, calibration):
+    return str(tmp_path / "cassette.jsonl.gz")
+
+def test_invalid_mode(path):
+    with pytest.raises(ValueError):
+        Cassette(path, mode="play")
+
+# ==========================
+# 請求比對
+# ==========================
+def test_deepseek_key_ignores_transport_fields():
+    key = request_key("deepseek", payload())
+    assert request_key("deepseek", payload(stream=True, stream_options={"include_usage": True})) == key
+    assert request_key("deepseek", payload(temperature=0.7)) != key
+    assert request_key("deepseek", payload("請評論這本書")) != key
+    assert request_key("deepl", payload()) != key
+
+def test_deepl_key_ignores_auth_key():
+    params = {"text": "你好", "target_lang": "EN"}
+    key = request_key("deepl", dict(params, auth_key="secret-1"))
+    assert request_key("deepl", dict(params, auth_key="secret-2")) == key
+    assert request_key("deepl", dict(params, target_lang="JA", auth_key="secret-1")) != key
+
+# ==========================
+# 錄製與重播
+# ==========================
+def test_replay_in_recorded_order_then_repeat_last(path):
+    recorder = Cassette(path, mode="record")
+    for content in ("第一次", "第二次"):
+        recorder.record("deepseek", payload(stream=True), result(content), latency=1.23456)
+    recorder.record("deepseek", payload("另一個請求"), result("另一個"), latency=0.5)
+    recorder.record("deepl", {"text": "你好", "auth_key": "k"}, {"translations": [{"text": "Hello"}]}, latency=0.1)
+    assert recorder.recorded == 4
+
+    player = Cassette(path, mode="replay")
+    assert player.replay("deepseek", payload("另一個請求")) == result("另一個")
+    contents = [player.replay("deepseek", payload(stream=False))["choices"][0]["message"]["content"] for _ in range(3)]
+    assert contents == ["第一次", "第二次", "第二次"]
+    assert player.replay("deepl", {"text": "你好", "auth_key": "other"}) == {"translations": [{"text": "Hello"}]}
+    assert player.replayed == 5
+
+def test_missing_request_is_not_retryable(path):
+    Cassette(path, mode="record").record("deepseek", payload(), result("有"), latency=0)
+    with pytest.raises(APIRequestError) as excinfo:
+        Cassette(path, mode="replay").replay("deepseek", payload("沒錄過"))
+    assert excinfo.value.retryable is False
+
+def test_replay_async_and_latency_scale(path, monkeypatch):
+    Cassette(path, mode="record").record("deepseek", payload(), result("非同步"), latency=2.0)
+    waits = []
+
+    async def fake_sleep(seconds):
+        waits.append(seconds)
+    monkeypatch.setattr(cassette.asyncio, "sleep", fake_sleep)
+    player = Cassette(path, mode="replay", latency_scale=0.5)
+    assert asyncio.run(player.replay_async("deepseek", payload())) == result("非同步")
+    assert waits == [1.0]
+
+def test_appending_to_an_existing_cassette(path):
+    Cassette(path, mode="record").record("deepseek", payload(), result("舊"), latency=0)
+    Cassette(path, mode="record").record("deepseek", payload("新請求"), result("新"), latency=0)
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert ["calibration" in line for line in lines] == [True, False, False]
+    assert Cassette(path, mode="replay").replay("deepseek", payload()) == result("舊")
+
+# ==========================
+# 校正資料
+# ==========================
+def test_calibration_is_pinned_from_the_header(path, calibration):
+    recorded_stats = {"zh": {"estimated": 1000.0, "actual": 1300.0, "samples": 10}}
+    calibration.freeze(recorded_stats)
+    Cassette(path, mode="record")
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        assert json.loads(f.readline()) == {"calibration": recorded_stats}
+
+    # 重播時即使本機的校正資料已改變，仍沿用卡帶中的版本並凍結
+    calibration._stats = {"zh": {"estimated": 1000.0, "actual": 900.0, "samples": 10}}
+    calibration.frozen = False
+    Cassette(path, mode="replay")
+    assert calibration.snapshot() == recorded_stats and calibration.frozen
+    calibration.record("中文" * 500, 2000, 5000)
+    assert calibration.snapshot() == recorded_stats
+
+def test_unreadable_cassette_fails_replay(path):
+    with open(path, "wb") as f:
+        f.write(b"not gzip")
+    with pytest.raises(OSError):
+        Cassette(path, mode="replay")
+
+def test_chat_completion_replays_without_network(path, monkeypatch):
+    recorder = Cassette(path, mode="record")
+    recorder.record("deepseek", payload(), result("重播內容"), latency=0)
+    monkeypatch.setattr(chat_completion, "api_cassette", Cassette(path, mode="replay"))
+
+    received = []
+    replayed = chat_completion.post_chat_completion("http://127.0.0.1:9/unreachable", {}, payload(),
+                                                    stream=True, on_text=received.append)
+    assert replayed == result("重播內容")
+    assert received == ["重播內容"]
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試 SSE 串流的組合、逐欄位 JSON 解析與閒置逾時"""
+
+import json
+import asyncio
+import logging
+import pytest
+import requests
+import chat_completion
+from chat_completion import (IncrementalJSONParser, StreamAccumulator, markdown_progress, sse_data,
+                             stream_chat_completion, post_chat_completion_async)
+from retry_policy import APIRequestError
+from mock_api_server import start_mock_server
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+def chunk(content=None, finish_reason=None, usage=None):
+    """一個 SSE 區塊的 data 內容"""
+    data = {"model": "deepseek-chat", "choices": []}
+    if content is not None or finish_reason is not None:
+        delta = {"content": content} if content is not None else {}
+        data["choices"].append({"index": 0, "delta": delta, "finish_reason": finish_reason})
+    if usage is not None:
+        data["usage"] = usage
+    return json.dumps(data, ensure_ascii=False)
+
+def feed_all(parser, pieces):
+    fields = []
+    for piece in pieces:
+        fields.extend(parser.feed(piece))
+    return fields
+
+# ==========================
+# StreamAccumulator
+# ==========================
+def test_sse_data_skips_comments_and_blank_lines():
+    assert sse_data(": keep-alive") is None
+    assert sse_data("") is None
+    assert sse_data("data: [DONE]") == "[DONE]"
+
+def test_accumulator_joins_deltas_and_keeps_usage_only_chunk():
+    received = []
+    accumulator = StreamAccumulator(received.append)
+    usage = {"prompt_tokens": 10, "completion_tokens": 3, "total_tokens": 13}
+    for data in (chunk("你"), chunk("好"), chunk(finish_reason="stop"), chunk(usage=usage)):
+        assert accumulator.add(data)
+    assert not accumulator.add("[DONE]")
+    assert accumulator.done
+
+    result = accumulator.result()
+    assert received == ["你", "好"]
+    assert result["choices"][0]["message"]["content"] == "你好"
+    assert result["choices"][0]["finish_reason"] == "stop"
+    assert result["usage"] == usage
+
+def test_accumulator_raises_on_error_chunk():
+    with pytest.raises(APIRequestError):
+        StreamAccumulator().add(json.dumps({"error": {"message": "overloaded"}}))
+
+# ==========================
+# IncrementalJSONParser
+# ==========================
+def test_fields_split_across_chunks():
+    text = '{"title": "書名", "pages": 320, "tags": ["a", "b"]}'
+    parser = IncrementalJSONParser()
+    fields = feed_all(parser, text)  # 逐字元餵入
+    assert fields == [("title", "書名"), ("pages", 320), ("tags", ["a", "b"])]
+
+def test_field_is_returned_as_soon_as_it_completes():
+    parser = IncrementalJSONParser()
+    assert parser.feed('{"a": "x') == []
+    assert parser.feed('yz", "b"') == [("a", "xyz")]
+    assert parser.feed(': 1}') == [("b", 1)]
+
+def test_escaped_quotes_and_braces_inside_strings():
+    value = 'He said "hi" {not a brace}, [nor this] \\ end'
+    text = json.dumps({"quote": value, "next": True}, ensure_ascii=False)
+    parser = IncrementalJSONParser()
+    assert feed_all(parser, [text[i:i + 3] for i in range(0, len(text), 3)]) == [("quote", value), ("next", True)]
+
+def test_nested_objects_and_arrays():
+    data = {"outline": {"parts": [{"name": "一", "pages": [1, 2]}, {"name": "二"}]}, "count": 2}
+    text = json.dumps(data, ensure_ascii=False)
+    parser = IncrementalJSONParser()
+    assert dict(feed_all(parser, [text[i:i + 5] for i in range(0, len(text), 5)])) == data
+    assert parser.finished
+
+def test_json_fence_split_between_deltas():
+    pieces = ["以下是分析結果：\n``", "`js", "on\n{\"sum", "mary\": \"好書\"", "}\n`", "``\n補充說明 {\"x\": 1}"]
+    parser = IncrementalJSONParser()
+    assert feed_all(parser, pieces) == [("summary", "好書")]
+
+def test_json_field_watcher_logs_fields(caplog):
+    on_text = chat_completion.json_field_watcher()
+    with caplog.at_level(logging.INFO, logger="chat_completion"):
+        for piece in ('{"a": 1,', ' "b": 2}'):
+            on_text(piece)
+    assert [r.getMessage() for r in caplog.records] == ["已接收欄位: a", "已接收欄位: b"]
+
+def test_markdown_progress_logs_completed_headings(caplog):
+    on_text = markdown_progress("測試部分")
+    with caplog.at_level(logging.INFO, logger="chat_completion"):
+        for piece in ("# 標", "題一\n內文", "\n## 標題二", "\n結尾"):
+            on_text(piece)
+    messages = [r.getMessage() for r in caplog.records]
+    assert messages == ["測試部分已接收 8 字：# 標題一", "測試部分已接收 18 字：## 標題二"]
+
+# ==========================
+# 實際串流（本機模擬伺服器）
+# ==========================
+def payload():
+    return {"model": "deepseek-chat", "messages": [{"role": "user", "content": "請分析這本書"}],
+            "temperature": 0.3, "max_tokens": 200}
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def start(**options):
+        server = start_mock_server(latency="fixed:0", tokens_per_second=0, **options)
+        servers.append(server)
+        return f"{server.base_url}/v1/chat/completions"
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def test_stream_chat_completion_returns_full_result(server):
+    url = server()
+    received = []
+    result = stream_chat_completion(url, {}, payload(), idle_timeout=5, on_text=received.append)
+    content = result["choices"][0]["message"]["content"]
+    assert content and "".join(received) == content
+    assert result["usage"]["completion_tokens"] > 0
+
+def test_stalled_stream_aborts_after_idle_timeout(server):
+    url = server(rate_stall=1.0, stall_seconds=3)
+    with pytest.raises(requests.exceptions.ReadTimeout, match="提前中止"):
+        stream_chat_completion(url, {}, payload(), idle_timeout=0.3)
+
+@pytest.mark.skipif(aiohttp is None, reason="需要 aiohttp")
+def test_stalled_async_stream_aborts_after_idle_timeout(server, monkeypatch):
+    url = server(rate_stall=1.0, stall_seconds=3)
+    monkeypatch.setattr(chat_completion, "response_cache", None)
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            await post_chat_completion_async(session, url, payload(), 30, stream=True, idle_timeout=0.3)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(run())
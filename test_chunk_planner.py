@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試章節對齊的分塊規劃"""
+
+import math
+import random
+import pytest
+from conftest import SAMPLE_CHINESE
+from token_estimator import estimate_tokens_python
+from token_index import TokenIndex
+from chunk_planner import plan_chunks
+
+def legacy_split_text_into_chunks(text, max_tokens):
+    """原本 deepseek_processor 的分塊方式：按字元數平均切開，優先在後半的段落或句子結尾切割"""
+    estimated_tokens = estimate_tokens_python(text)
+    if estimated_tokens <= max_tokens:
+        return [text]
+
+    num_chunks = math.ceil(estimated_tokens / max_tokens)
+    chunk_size = len(text) // num_chunks
+    chunks = []
+    start = 0
+    for _ in range(num_chunks - 1):
+        end = min(start + chunk_size, len(text))
+        paragraph_end = text.rfind('\n\n', start, end)
+        if paragraph_end != -1 and paragraph_end > start + chunk_size // 2:
+            end = paragraph_end + 2
+        else:
+            sentence_end = max(text.rfind('. ', start, end), text.rfind('。', start, end),
+                               text.rfind('！', start, end), text.rfind('？', start, end))
+            if sentence_end != -1 and sentence_end > start + chunk_size // 2:
+                end = sentence_end + 1
+        chunks.append(text[start:end])
+        start = end
+    chunks.append(text[start:])
+    return chunks
+
+def book_with_chapters(sample_text, sizes):
+    """以各章段落數組成含頁面標記與章節標題的書（每章一頁），回傳 (文本, 各章標題位置)"""
+    parts = []
+    chapter_starts = []
+    position = 0
+    for number, paragraphs in enumerate(sizes, 1):
+        chapter = f"--- 第 {number} 頁 ---\n第{number}章 標題\n" + sample_text(0, paragraphs) + "\n\n"
+        chapter_starts.append(position + chapter.index("第", 5))
+        parts.append(chapter)
+        position += len(chapter)
+    return "".join(parts), chapter_starts
+
+def assert_covers(spans, text):
+    assert spans[0].start == 0 and spans[-1].end == len(text)
+    assert all(a.end == b.start for a, b in zip(spans, spans[1:]))
+    assert "".join(span.text() for span in spans) == text
+
+def test_short_chapters_are_merged(sample_text):
+    text, chapter_starts = book_with_chapters(sample_text, [5, 5, 5, 5, 5, 5])
+    index = TokenIndex(text, estimate_tokens_python)
+    max_tokens = index.tokens_between(0, chapter_starts[3]) + 10
+    spans = plan_chunks(text, max_tokens, index)
+
+    assert_covers(spans, text)
+    assert len(spans) == 2
+    # 第一塊收錄前三章，第二塊從第四章的標題開始（標題前的頁面標記留在前一塊）
+    assert spans[1].start == chapter_starts[3]
+    assert [span.page_range for span in spans] == [(1, 4), (4, 6)]
+    assert all(span.tokens <= max_tokens for span in spans)
+
+def test_long_chapter_is_split_inside(sample_text):
+    text, chapter_starts = book_with_chapters(sample_text, [3, 120, 3])
+    index = TokenIndex(text, estimate_tokens_python)
+    max_tokens = 1500
+    spans = plan_chunks(text, max_tokens, index)
+
+    assert_covers(spans, text)
+    assert len(spans) > 3
+    # 超長章節連同前面的短章節一起切割，之後的章節另起一塊
+    assert spans[-1].start == chapter_starts[2]
+    assert spans[0].page_range[0] == 1 and spans[-1].page_range[1] == 3
+    assert all(span.tokens <= max_tokens for span in spans)
+    assert sum(span.tokens for span in spans) == pytest.approx(index.total_tokens, abs=len(spans))
+
+def test_paragraphs_just_under_the_limit():
+    """段落接近上限時，切點退回段落結尾造成的不足不可累積到最後一塊"""
+    rng = random.Random(3)
+    paragraphs = ["".join("。" if i % 20 == 0 else SAMPLE_CHINESE[i % len(SAMPLE_CHINESE)] for i in range(1, rng.randint(1780, 1990)))
+                  for _ in range(12)]
+    text = "\n\n".join(paragraphs)
+    max_tokens = 3000
+    assert all(estimate_tokens_python(paragraph) < max_tokens for paragraph in paragraphs)
+
+    spans = plan_chunks(text, max_tokens, TokenIndex(text, estimate_tokens_python))
+    assert_covers(spans, text)
+    assert all(span.tokens <= max_tokens for span in spans)
+
+def test_explicit_page_starts(sample_text):
+    text = sample_text(0, 30)
+    page_starts = [0, len(text) // 3, 2 * len(text) // 3]
+    spans = plan_chunks(text, 600, TokenIndex(text), page_starts=page_starts)
+    assert spans[0].page_range[0] == 1 and spans[-1].page_range[1] == 3
+    assert all(a.page_range[1] <= b.page_range[0] + 1 for a, b in zip(spans, spans[1:]))
+
+def test_span_text_is_lazy_slice():
+    text = "第一章 開始\n天地玄黃。"
+    [span] = plan_chunks(text, 1000)
+    assert span.text() == text and len(span) == len(text)
+    assert span.page_range is None
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_tokens", [800, 2000, 5000])
+def test_plan_chunks_against_legacy_split(sample_text, seed, max_tokens):
+    """沒有章節標題時，每塊都不超過上限（原本的切法會超過），代價是分塊數略多"""
+    text = sample_text(seed)
+    index = TokenIndex(text, estimate_tokens_python)
+    spans = plan_chunks(text, max_tokens, index)
+    legacy = legacy_split_text_into_chunks(text, max_tokens)
+
+    assert_covers(spans, text)
+    assert "".join(legacy) == text
+    assert len(legacy) <= len(spans) <= len(legacy) * 1.2
+    for span in spans[:-1]:
+        assert text[span.end - 2:span.end] == "\n\n" or text[span.end - 1] in "。！？."
+    assert all(span.tokens <= max_tokens for span in spans)
@@ -6,7 +6,7 @@ import requests
 import os
 
 API_KEY = os.getenv("DEEPSEEK_API_KEY", "your_deepseek_api_key_here")
-API_URL = "https://api.deepseek.com/v1/chat/completions"
+API_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com").rstrip("/") + "/v1/chat/completions"
 
 def test_deepseek_api():
     """測試Deepseek API連接"""
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試 deepseek_processor 單檔流程的 token 計數"""
+
+import json
+import importlib
+
+class FakeClient:
+    def __init__(self, api_key):
+        pass
+
+    def extract_content(self, prompt, context=None):
+        return json.dumps({"title": "書名", "author": "作者"}, ensure_ascii=False)
+
+def test_book_tokens_are_counted_once(tmp_path, monkeypatch):
+    # 模組載入時會在目前目錄建立 processing.log，先切換到暫存目錄
+    monkeypatch.chdir(tmp_path)
+    deepseek_processor = importlib.import_module("deepseek_processor")
+    counted = []
+    count_tokens = deepseek_processor.count_tokens
+
+    def counting(text):
+        counted.append(len(text))
+        return count_tokens(text)
+    monkeypatch.setattr(deepseek_processor, "count_tokens", counting)
+    monkeypatch.setattr(deepseek_processor, "DeepseekClient", FakeClient)
+    monkeypatch.setattr(deepseek_processor, "generate_markdown", lambda data, path: True)
+
+    text = "這是一本關於城市與河流的書。" * 20
+    result = deepseek_processor.process_single_file("book.pdf", str(tmp_path), pdf_text=text)
+    assert result["success"] is True
+    assert counted == [len(text)]
+    assert result["input_tokens"] == count_tokens(text)
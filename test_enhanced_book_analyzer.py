@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試報告各部分的並行生成（pdf-book-main.py 與 enhanced_book_analyzer.py 內容相同）"""
+
+import time
+import threading
+import importlib
+import pytest
+
+@pytest.fixture
+def analyzer(tmp_path, monkeypatch):
+    # 模組載入時會在桌面建立輸出資料夾，先把家目錄與目前目錄指向暫存目錄
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("enhanced_book_analyzer")
+
+def test_sections_are_generated_concurrently(analyzer, monkeypatch):
+    sections = [section_type for section_type, _ in analyzer.REPORT_SECTIONS]
+    barrier = threading.Barrier(len(sections), timeout=5)  # 只有全部同時進行時才會通過
+
+    def generate(content, book_name, section_type):
+        barrier.wait()
+        return f"{book_name}:{section_type}"
+    monkeypatch.setattr(analyzer, "generate_api_section", generate)
+
+    results = analyzer.generate_report_sections("內容", "書名", max_workers=len(sections))
+    assert results == {section_type: f"書名:{section_type}" for section_type in sections}
+
+def test_failed_sections_do_not_affect_the_others(analyzer, monkeypatch):
+    def generate(content, book_name, section_type):
+        if section_type == "key_arguments":
+            raise RuntimeError("API 錯誤")
+        if section_type == "critical_reflection":
+            return None
+        return section_type
+    monkeypatch.setattr(analyzer, "generate_api_section", generate)
+
+    results = analyzer.generate_report_sections("內容", "書名")
+    assert results.pop("key_arguments") is None and results.pop("critical_reflection") is None
+    assert all(results[section_type] == section_type for section_type in results)
+    assert len(results) == len(analyzer.REPORT_SECTIONS) - 2
+
+def test_one_worker_keeps_sections_sequential(analyzer, monkeypatch):
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def generate(content, book_name, section_type):
+        with lock:
+            running.append(section_type)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(section_type)
+        return section_type
+    monkeypatch.setattr(analyzer, "generate_api_section", generate)
+
+    analyzer.generate_report_sections("內容", "書名", max_workers=1)
+    assert max(peak) == 1
+
+def test_full_context_sends_the_first_section_alone(analyzer, monkeypatch):
+    monkeypatch.setattr(analyzer, "SECTION_CONTEXT", "full")
+    monkeypatch.setattr(analyzer, "use_prefix_layout", lambda: True)
+    first = analyzer.REPORT_SECTIONS[0][0]
+    first_done = threading.Event()
+    early = []
+
+    def generate(content, book_name, section_type):
+        if section_type == first:
+            time.sleep(0.05)
+            first_done.set()
+        elif not first_done.is_set():
+            early.append(section_type)  # 其餘部分必須等第一部分完成後才送出
+        return section_type
+    monkeypatch.setattr(analyzer, "generate_api_section", generate)
+
+    results = analyzer.generate_report_sections("內容", "書名")
+    assert early == [] and len(results) == len(analyzer.REPORT_SECTIONS)
+    assert all(results[section_type] == section_type for section_type in results)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試共用 Session 的連線重用與行程隔離"""
+
+import threading
+import pytest
+import http_session
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http_session import get_session, session_metrics, HTTP_POOL_MAXSIZE
+
+class OkHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def fresh_session(monkeypatch):
+    monkeypatch.setattr(http_session, "_session", None)
+    monkeypatch.setattr(http_session, "_session_pid", None)
+
+def test_session_is_shared_within_a_process():
+    session = get_session()
+    assert get_session() is session
+    assert session.get_adapter("https://api.deepseek.com")._pool_maxsize == HTTP_POOL_MAXSIZE
+
+def test_forked_process_gets_its_own_session(monkeypatch):
+    session = get_session()
+    monkeypatch.setattr(http_session.os, "getpid", lambda: -1)
+    assert get_session() is not session
+
+def test_metrics_count_reused_connections(server):
+    assert session_metrics()["requests"] == 0
+    for _ in range(5):
+        assert get_session().get(server, timeout=5).text == "ok"
+    metrics = session_metrics()
+    assert metrics["requests"] == 5
+    assert metrics["new_connections"] == 1
+    assert metrics["reused"] == 4 and metrics["reuse_ratio"] == pytest.approx(0.8)
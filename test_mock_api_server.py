@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試本機模擬伺服器的前綴快取模型"""
+
+import pytest
+import requests
+from mock_api_server import start_mock_server, CACHE_UNIT_TOKENS
+
+BOOK = "這是一本關於城市與河流的書。" * 400
+
+@pytest.fixture
+def server():
+    server = start_mock_server(latency="fixed:0", tokens_per_second=0)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def messages(context, instructions):
+    return [{"role": "system", "content": context}, {"role": "user", "content": instructions}]
+
+def test_first_request_misses(server):
+    assert server.cache_hit_tokens(messages(BOOK, "摘要")) == 0
+
+def test_shared_prefix_hits_in_whole_units(server):
+    server.cache_hit_tokens(messages(BOOK, "請摘要全書"))
+    hit = server.cache_hit_tokens(messages(BOOK, "請評論作者觀點"))
+    assert hit > 0 and hit % CACHE_UNIT_TOKENS == 0
+
+def test_longest_common_prefix_is_partial(server):
+    server.cache_hit_tokens(messages(BOOK, "甲"))
+    full = server.cache_hit_tokens(messages(BOOK, "乙"))
+    half = server.cache_hit_tokens(messages(BOOK[:len(BOOK) // 2] + "改寫的後半部。" * 200, "丙"))
+    assert 0 < half < full
+
+def test_role_and_first_message_must_match(server):
+    server.cache_hit_tokens(messages(BOOK, "甲"))
+    assert server.cache_hit_tokens([{"role": "user", "content": BOOK}]) == 0
+    assert server.cache_hit_tokens(messages("前言不同。" + BOOK, "甲")) == 0
+
+def test_usage_reports_hits(server):
+    url = f"{server.base_url}/v1/chat/completions"
+
+    def usage(instructions):
+        body = {"model": "deepseek-chat", "messages": messages(BOOK, instructions), "max_tokens": 50}
+        return requests.post(url, json=body, timeout=10).json()["usage"]
+
+    assert usage("第一部分")["prompt_cache_hit_tokens"] == 0
+    second = usage("第二部分")
+    assert 0 < second["prompt_cache_hit_tokens"] <= second["prompt_tokens"]
+    assert second["prompt_cache_hit_tokens"] + second["prompt_cache_miss_tokens"] == second["prompt_tokens"]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試平行頁面提取、單一行程退回與依預算提前停止時的文本快取"""
+
+import pytest
+import pdf_extractor
+from concurrent.futures import Future
+from conftest import write_pdf
+from pdf_extractor import iter_pages, extract_pages, plan_page_ranges, read_text_within_budget
+from text_cache import TextCache
+
+NUM_PAGES = 40
+
+def estimate_tokens(text):
+    return len(text)
+
+def page_text(page_no):
+    return f"Page {page_no} text."
+
+@pytest.fixture(scope="module")
+def pdf(tmp_path_factory):
+    return write_pdf(tmp_path_factory.mktemp("pdf") / "book.pdf", [page_text(n) for n in range(1, NUM_PAGES + 1)])
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = TextCache(str(tmp_path / "text"))
+    monkeypatch.setattr(pdf_extractor, "text_cache", cache)
+    return cache
+
+def expected_pages(first=1, last=NUM_PAGES):
+    return [(n, page_text(n)) for n in range(first, last + 1)]
+
+class FailingExecutor:
+    """在目前行程中執行分片，交出 fail_after 個分片後模擬行程池異常終止"""
+
+    def __init__(self, fail_after, error):
+        self.fail_after = fail_after
+        self.error = error
+        self.results = 0
+
+    def __call__(self, max_workers):
+        return self
+
+    def submit(self, fn, *args):
+        future = Future()
+        if self.results >= self.fail_after:
+            future.set_exception(self.error)
+        else:
+            future.set_result(fn(*args))
+        self.results += 1
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+# ==========================
+# 平行提取
+# ==========================
+def test_plan_page_ranges_covers_all_pages():
+    ranges = plan_page_ranges(10, workers=2, shards_per_worker=2)
+    assert ranges[0][0] == 0 and ranges[-1][1] == 10
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    assert max(end - start for start, end in plan_page_ranges(100, 2, max_shard_pages=4)) == 4
+    assert plan_page_ranges(0, 4) == []
+
+def test_parallel_pages_come_back_in_order(pdf):
+    pages = list(iter_pages(pdf, workers=3, use_cache=False, max_shard_pages=3))
+    assert pages == expected_pages()
+
+@pytest.mark.parametrize("fail_after", [0, 1, 5])
+@pytest.mark.parametrize("error", [OSError("無法建立行程"), RuntimeError("行程池異常終止")])
+def test_serial_fallback_resumes_without_gaps(pdf, monkeypatch, caplog, fail_after, error):
+    executor = FailingExecutor(fail_after, error)
+    monkeypatch.setattr(pdf_extractor, "ProcessPoolExecutor", executor)
+    assert list(iter_pages(pdf, workers=2, use_cache=False, max_shard_pages=4)) == expected_pages()
+    assert f"自第 {fail_after * 4 + 1} 頁起改為單一行程提取" in caplog.text
+
+def test_executor_creation_failure_falls_back(pdf, monkeypatch):
+    def unavailable(max_workers):
+        raise OSError("受限環境")
+    monkeypatch.setattr(pdf_extractor, "ProcessPoolExecutor", unavailable)
+    assert extract_pages(pdf, workers=4, use_cache=False) == [text for _, text in expected_pages()]
+
+# ==========================
+# 文本快取與提前停止
+# ==========================
+def test_full_extraction_is_cached(pdf, cache, monkeypatch):
+    assert extract_pages(pdf, workers=1) == [text for _, text in expected_pages()]
+    monkeypatch.setattr(pdf_extractor, "_iter_page_range", None)  # 命中快取時不再解析 PDF
+    assert list(iter_pages(pdf, workers=1)) == expected_pages()
+
+def test_budgeted_read_stores_and_reuses_partial_pages(pdf, cache, monkeypatch):
+    budget = estimate_tokens(page_text(1)) * 5
+    text, pages_read, _ = read_text_within_budget(pdf, budget, estimate_tokens, workers=1)
+    assert 4 <= pages_read < NUM_PAGES
+    key = cache.make_key(pdf, pdf_extractor.EXTRACTOR_VERSION)
+    cached_pages, complete = cache.get(key)
+    assert not complete and cached_pages == [text for _, text in expected_pages(1, pages_read)]
+
+    # 相同預算的讀取完全由快取提供，不開啟 PDF
+    with monkeypatch.context() as patched:
+        patched.setattr(pdf_extractor, "count_pages", None)
+        assert read_text_within_budget(pdf, budget, estimate_tokens, workers=1)[0] == text
+
+    # 需要更多頁面時從下一頁接續提取，讀完後標記為完整
+    extracted = []
+    iter_page_range = pdf_extractor._iter_page_range
+
+    def recording(path, start, end):
+        extracted.append(start)
+        return iter_page_range(path, start, end)
+    monkeypatch.setattr(pdf_extractor, "_iter_page_range", recording)
+    assert list(iter_pages(pdf, workers=1)) == expected_pages()
+    assert extracted == [pages_read]
+    assert cache.get(key) == ([text for _, text in expected_pages()], True)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試前綴快取的提示詞排列與命中統計"""
+
+import pytest
+import prompt_layout
+from prompt_layout import build_messages, BOOK_CONTEXT_HEADER
+from chat_completion import PromptCacheStats
+
+def test_prefix_layout_puts_the_book_first(monkeypatch):
+    monkeypatch.setattr(prompt_layout, "PROMPT_LAYOUT", "prefix")
+    first = build_messages("分析主題", "書籍內容")
+    second = build_messages("分析論點", "書籍內容")
+    assert first[0] == second[0] == {"role": "system", "content": BOOK_CONTEXT_HEADER + "書籍內容"}
+    assert first[1] == {"role": "user", "content": "分析主題"}
+
+def test_inline_layout_keeps_a_single_message(monkeypatch):
+    monkeypatch.setattr(prompt_layout, "PROMPT_LAYOUT", "inline")
+    messages = build_messages("分析主題", "書籍內容", inline_label="書籍內容如下")
+    assert messages == [{"role": "user", "content": "分析主題\n\n書籍內容如下：\n```\n書籍內容\n```"}]
+
+def test_messages_without_context_are_unchanged():
+    assert build_messages("只有指示") == [{"role": "user", "content": "只有指示"}]
+
+def test_cache_stats_accumulate_hits_and_misses():
+    stats = PromptCacheStats()
+    stats.add({"prompt_tokens": 100, "prompt_cache_hit_tokens": 0, "prompt_cache_miss_tokens": 100})
+    stats.add({"prompt_tokens": 100, "prompt_cache_hit_tokens": 64})  # 未附 miss 時由 prompt_tokens 推算
+    stats.add({"prompt_tokens": 100})  # 不支援前綴快取的回應不列入
+    assert stats.stats() == {"requests": 2, "hit_tokens": 64, "miss_tokens": 136,
+                             "hit_ratio": pytest.approx(64 / 200)}
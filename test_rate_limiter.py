@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試 RPM／TPM 速率限制與預扣配額的結算"""
+
+import pytest
+import requests
+import rate_limiter
+import chat_completion
+from rate_limiter import RateLimiter
+
+class FakeResponse:
+    status_code = 200
+    headers = {}
+    text = ""
+
+    def __init__(self, result):
+        self._result = result
+
+    def json(self):
+        return self._result
+
+class FakeSession:
+    """post 時依序回傳或拋出 outcomes 中的項目"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+
+    def post(self, url, **kwargs):
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return FakeResponse(outcome)
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = RateLimiter(tpm=60000, burst_seconds=2)
+    monkeypatch.setattr(chat_completion, "deepseek_limiter", limiter)
+    monkeypatch.setattr(rate_limiter, "deepseek_limiter", limiter)  # settle_usage 使用的限制器
+    monkeypatch.setattr(chat_completion, "response_cache", None)
+    return limiter
+
+def payload():
+    return {"model": "deepseek-chat", "messages": [{"role": "user", "content": "測試速率限制"}],
+            "temperature": 0.3, "max_tokens": 500}
+
+def test_requests_are_spaced_by_rpm():
+    limiter = RateLimiter(rpm=60, burst_seconds=1)
+    assert limiter._reserve(1) == 0
+    assert limiter._reserve(1) == pytest.approx(1, abs=0.05)
+
+def test_refund_is_capped_at_capacity():
+    limiter = RateLimiter(tpm=600, burst_seconds=1)
+    limiter.acquire(5)
+    limiter.refund(50)
+    assert limiter.tokens.level == limiter.tokens.capacity
+
+def test_failed_request_refunds_reservation(limiter, monkeypatch):
+    monkeypatch.setattr(chat_completion, "get_session",
+                        lambda: FakeSession(requests.exceptions.ConnectionError("斷線")))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        chat_completion.post_chat_completion("http://test", {}, payload(), stream=False)
+    assert limiter.tokens.level == pytest.approx(limiter.tokens.capacity)
+
+def test_successful_request_keeps_actual_usage(limiter, monkeypatch):
+    result = {"model": "deepseek-chat", "choices": [{"message": {"content": "好"}}],
+              "usage": {"prompt_tokens": 20, "completion_tokens": 10, "total_tokens": 30}}
+    monkeypatch.setattr(chat_completion, "get_session", lambda: FakeSession(result))
+    chat_completion.post_chat_completion("http://test", {}, payload(), stream=False)
+    assert limiter.tokens.level == pytest.approx(limiter.tokens.capacity - 30, abs=1)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試回應快取的鍵正規化與兩層存取"""
+
+import time
+import pytest
+from response_cache import ResponseCache, cache_key
+
+URL = "https://api.deepseek.com/v1/chat/completions"
+
+def payload(**overrides):
+    data = {"model": "deepseek-chat", "messages": [{"role": "user", "content": "請分析這本書"}],
+            "temperature": 0.3, "max_tokens": 4000}
+    data.update(overrides)
+    return data
+
+def result(content="分析結果"):
+    return {"choices": [{"message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5}}
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(path=str(tmp_path / "responses.sqlite3"))
+
+# ==========================
+# 快取鍵
+# ==========================
+def test_transport_fields_do_not_change_the_key():
+    key = cache_key(payload(), URL)
+    assert cache_key(payload(stream=True, stream_options={"include_usage": True}), URL) == key
+    assert cache_key(payload(timeout=30, user="someone"), URL) == key
+    # 欄位順序與 JSON 排版不影響雜湊
+    assert cache_key(dict(reversed(list(payload().items()))), URL) == key
+
+@pytest.mark.parametrize("changes", [
+    {"model": "deepseek-reasoner"},
+    {"messages": [{"role": "user", "content": "請評論這本書"}]},
+    {"messages": [{"role": "system", "content": "請分析這本書"}]},
+    {"temperature": 0.7},
+    {"max_tokens": 8000},
+])
+def test_response_fields_change_the_key(changes):
+    assert cache_key(payload(**changes), URL) != cache_key(payload(), URL)
+
+def test_url_is_part_of_the_key():
+    assert cache_key(payload(), "http://127.0.0.1:8000/v1/chat/completions") != cache_key(payload(), URL)
+    assert cache_key(payload()) != cache_key(payload(), URL)
+
+# ==========================
+# 存取
+# ==========================
+def test_put_then_get_from_memory_and_disk(cache):
+    key = cache_key(payload(), URL)
+    assert cache.get(key) is None
+    cache.put(key, result(), model="deepseek-chat")
+    assert cache.get(key) == result()
+
+    # 新的實例（例如下一次執行）從 SQLite 讀回
+    reopened = ResponseCache(path=cache.path)
+    assert reopened.get(key) == result()
+    assert reopened.get(key) == result()
+    assert reopened.stats() == {"memory_hits": 1, "disk_hits": 1, "misses": 0, "hit_ratio": 1.0}
+    assert cache.stats()["misses"] == 1
+
+def test_expired_entries_are_misses(cache, monkeypatch):
+    key = cache_key(payload(), URL)
+    cache.put(key, result())
+    later = time.time() + cache.ttl + 1
+    monkeypatch.setattr("response_cache.time.time", lambda: later)
+    assert cache.get(key) is None
+    assert ResponseCache(path=cache.path).get(key) is None
+
+def test_memory_layer_is_bounded(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite3"), memory_items=2)
+    keys = [cache_key(payload(max_tokens=n), URL) for n in range(3)]
+    for n, key in enumerate(keys):
+        cache.put(key, result(str(n)))
+    assert list(cache._memory) == keys[1:]
+    # 被擠出記憶體的項目仍可從磁碟讀回
+    assert cache.get(keys[0]) == result("0")
+    assert cache.stats()["disk_hits"] == 1
+
+def test_evict_removes_least_recently_accessed(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.sqlite3"))
+    keys = [cache_key(payload(max_tokens=n), URL) for n in range(4)]
+    for n, key in enumerate(keys):
+        cache.put(key, result("內容" * 50 + str(n)))
+        time.sleep(0.01)
+    size = cache._connection().execute("SELECT MAX(size) FROM responses").fetchone()[0]
+    cache._memory.clear()
+    cache.get(keys[0])  # 更新存取時間，不應被淘汰
+
+    cache.max_bytes = 2 * size
+    cache.evict()
+    remaining = {row[0] for row in cache._connection().execute("SELECT key FROM responses")}
+    assert remaining == {keys[0], keys[3]}
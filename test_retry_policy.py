@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試重試策略與斷路器"""
+
+import time
+import asyncio
+import pytest
+import retry_policy
+from retry_policy import APIRequestError, CircuitBreaker, CircuitOpenError, RetryPolicy, current_attempt
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """以紀錄取代 time.sleep，測試不實際等待"""
+    recorded = []
+    monkeypatch.setattr(retry_policy.time, "sleep", recorded.append)
+    return recorded
+
+def failing(errors, result="ok"):
+    """依序拋出 errors 中的例外，用完後回傳 result"""
+    calls = []
+
+    def func():
+        calls.append(current_attempt.get())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    func.calls = calls
+    return func
+
+def expire(breaker):
+    """讓斷路器的冷卻時間立即結束"""
+    breaker.open_until = time.monotonic()
+
+def test_retry_after_wins_over_jitter(sleeps):
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.02, max_elapsed=60)
+    func = failing([APIRequestError("429", status=429, retry_after=5)])
+    assert policy.call(func) == "ok"
+    assert sleeps == [5]
+    assert func.calls == [1, 2]
+
+def test_jitter_stays_within_bounds():
+    policy = RetryPolicy(base_delay=1, max_delay=8)
+    delays = policy.delays()
+    for _ in range(200):
+        assert 1 <= next(delays) <= 8
+
+def test_max_elapsed_stops_retries(sleeps):
+    policy = RetryPolicy(max_attempts=5, base_delay=0.01, max_delay=0.02, max_elapsed=3)
+    func = failing([APIRequestError("429", status=429, retry_after=10)])
+    with pytest.raises(APIRequestError):
+        policy.call(func)
+    assert func.calls == [1]
+    assert sleeps == []
+
+def test_non_retryable_error_raises_immediately(sleeps):
+    policy = RetryPolicy(max_attempts=5, base_delay=0.01, max_delay=0.02)
+    func = failing([APIRequestError("401", status=401, retryable=False)])
+    with pytest.raises(APIRequestError):
+        policy.call(func)
+    assert func.calls == [1]
+    assert sleeps == []
+
+def test_gives_up_after_max_attempts(sleeps):
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.02)
+    func = failing([APIRequestError("503", status=503)] * 5)
+    with pytest.raises(APIRequestError):
+        policy.call(func)
+    assert func.calls == [1, 2, 3]
+    assert len(sleeps) == 2
+
+def test_call_async_retries():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.002)
+    func = failing([APIRequestError("502", status=502), asyncio.TimeoutError()])
+
+    async def send():
+        return func()
+    assert asyncio.run(policy.call_async(send)) == "ok"
+    assert func.calls == [1, 2, 3]
+
+def test_breaker_open_half_open_closed():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=5)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.wait_time() > 0
+
+    expire(breaker)
+    assert breaker.wait_time() == 0  # 第一個呼叫者取得探測資格
+    assert breaker.state == "half_open"
+    assert breaker.wait_time() == retry_policy.PROBE_POLL_SECONDS  # 其他呼叫者等待探測結果
+
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.wait_time() == 0
+
+def test_failed_probe_reopens_with_longer_cooldown():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=5)
+    breaker.record_failure()
+    expire(breaker)
+    assert breaker.wait_time() == 0
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.open_seconds == 10
+
+def test_non_outage_error_keeps_half_open_breaker(sleeps):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=5)
+    policy = RetryPolicy(breaker, max_attempts=1)
+    breaker.record_failure()
+    expire(breaker)
+    with pytest.raises(APIRequestError):
+        policy.call(failing([APIRequestError("429", status=429)]))
+    assert breaker.state == "half_open"
+    assert breaker.wait_time() == 0  # 探測資格交給下一個呼叫者
+
+def test_non_outage_error_does_not_reset_failures(sleeps):
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    policy = RetryPolicy(breaker, max_attempts=1)
+    for error in (APIRequestError("503", status=503), APIRequestError("429", status=429),
+                  APIRequestError("503", status=503)):
+        with pytest.raises(APIRequestError):
+            policy.call(failing([error]))
+    assert breaker.failures == 2
+    assert breaker.state == "closed"
+
+def test_open_breaker_beyond_max_elapsed_raises():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_seconds=30)
+    policy = RetryPolicy(breaker, max_elapsed=5)
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        policy.call(lambda: "ok")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試相依關係排程器"""
+
+import threading
+import pytest
+from stage_scheduler import StageScheduler
+
+def recorder(order, lock, name, value=None):
+    """回傳一個記錄執行順序與收到的結果鍵的階段函式"""
+    def stage(results):
+        with lock:
+            order.append((name, sorted(results)))
+        return value if value is not None else name
+    return stage
+
+def test_stages_run_after_their_dependencies():
+    order = []
+    lock = threading.Lock()
+    scheduler = StageScheduler(max_workers=4)
+    scheduler.add("report", recorder(order, lock, "report"), depends_on=["themes", "concepts"])
+    scheduler.add("themes", recorder(order, lock, "themes"), depends_on=["base"])
+    scheduler.add("base", recorder(order, lock, "base", {"title": "書名"}))
+    scheduler.add("concepts", recorder(order, lock, "concepts"), depends_on=["base"])
+
+    results, errors = scheduler.run()
+    assert errors == {}
+    assert results == {"base": {"title": "書名"}, "themes": "themes", "concepts": "concepts", "report": "report"}
+    names = [name for name, _ in order]
+    assert names[0] == "base" and names[-1] == "report"
+    # 每個階段收到的結果字典至少包含它依賴的階段
+    received = dict(order)
+    assert received["themes"] == ["base"] and set(received["report"]) >= {"base", "themes", "concepts"}
+
+def test_independent_stages_run_concurrently():
+    # 兩個階段都要等到對方開始才能完成，依序執行時 barrier 會逾時
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet(results):
+        barrier.wait()
+        return threading.current_thread().name
+
+    scheduler = StageScheduler(max_workers=2)
+    scheduler.add("base", lambda results: None)
+    scheduler.add("themes", meet, depends_on=["base"])
+    scheduler.add("concepts", meet, depends_on=["base"])
+    results, errors = scheduler.run()
+    assert errors == {}
+    assert results["themes"] != results["concepts"]
+
+def test_failed_stage_fails_its_dependents_only():
+    ran = []
+
+    def fail(results):
+        raise ValueError("API 失敗")
+
+    scheduler = StageScheduler(max_workers=2)
+    scheduler.add("base", lambda results: "ok")
+    scheduler.add("themes", fail, depends_on=["base"])
+    scheduler.add("summary", lambda results: ran.append("summary"), depends_on=["themes"])
+    scheduler.add("report", lambda results: ran.append("report"), depends_on=["summary"])
+    scheduler.add("concepts", lambda results: "concepts", depends_on=["base"])
+
+    results, errors = scheduler.run()
+    assert set(results) == {"base", "concepts"}
+    assert isinstance(errors["themes"], ValueError)
+    assert "themes" in str(errors["summary"]) and "summary" in str(errors["report"])
+    assert ran == []
+
+def test_unknown_dependency_is_rejected():
+    scheduler = StageScheduler()
+    scheduler.add("base", lambda results: "ok")
+    scheduler.add("report", lambda results: pytest.fail("不應執行"), depends_on=["missing"])
+    results, errors = scheduler.run()
+    assert results == {"base": "ok"}
+    assert "missing" in str(errors["report"])
+
+def test_cycles_are_rejected_without_blocking_other_stages():
+    scheduler = StageScheduler()
+    scheduler.add("a", lambda results: pytest.fail("不應執行"), depends_on=["b"])
+    scheduler.add("b", lambda results: pytest.fail("不應執行"), depends_on=["a"])
+    scheduler.add("c", lambda results: "ok")
+    results, errors = scheduler.run()
+    assert results == {"c": "ok"}
+    assert set(errors) == {"a", "b"} and all("循環依賴" in str(e) for e in errors.values())
+
+def test_duplicate_stage_names_are_rejected():
+    scheduler = StageScheduler()
+    scheduler.add("base", lambda results: None)
+    with pytest.raises(ValueError):
+        scheduler.add("base", lambda results: None)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試以 PDF 內容雜湊為鍵的提取文本快取"""
+
+import os
+import pytest
+from text_cache import TextCache, PageWriter, CACHE_SUFFIX
+
+PAGES = ["第一頁：天地玄黃。", "", "Page three.\n\n第三段", "最後一頁"]
+
+def writer_for(pages):
+    writer = PageWriter()
+    for page in pages:
+        writer.add(page)
+    return writer
+
+@pytest.fixture
+def cache(tmp_path):
+    return TextCache(str(tmp_path / "text"))
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "book.pdf"
+    path.write_bytes(b"%PDF-1.4 original")
+    return str(path)
+
+def test_round_trip(cache, pdf):
+    key = cache.make_key(pdf, "v1")
+    assert cache.get(key) is None
+    cache.put(key, writer_for(PAGES), source="book.pdf")
+    assert cache.get(key) == (PAGES, True)
+
+def test_partial_entry_round_trip(cache, pdf):
+    key = cache.make_key(pdf, "v1")
+    cache.put(key, writer_for(PAGES[:2]), complete=False)
+    assert cache.get(key) == (PAGES[:2], False)
+
+def test_key_changes_with_content_and_version(cache, pdf):
+    key = cache.make_key(pdf, "v1")
+    cache.put(key, writer_for(PAGES))
+    assert cache.make_key(pdf, "v2") != key
+
+    # 同一路徑的檔案內容改變後，舊的快取不再被使用
+    with open(pdf, "ab") as f:
+        f.write(b" revised")
+    assert cache.make_key(pdf, "v1") != key
+    assert cache.get(cache.make_key(pdf, "v1")) is None
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:len(data) - 5],                           # 截斷的壓縮內容
+    lambda data: data.split(b"\n", 1)[0] + b"\nnot zlib data",    # 損毀的壓縮內容
+    lambda data: b"{broken header\n" + data.split(b"\n", 1)[1],   # 損毀的標頭
+])
+def test_corrupt_entries_are_discarded(cache, pdf, damage):
+    key = cache.make_key(pdf, "v1")
+    cache.put(key, writer_for(["長頁面內容。" * 200]))
+    path = os.path.join(cache.cache_dir, key + CACHE_SUFFIX)
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(damage(data))
+
+    assert cache.get(key) is None
+    assert not os.path.exists(path)
+    # 之後可重新寫入
+    cache.put(key, writer_for(PAGES))
+    assert cache.get(key) == (PAGES, True)
+
+def test_evicts_least_recently_used_by_mtime(cache, pdf):
+    keys = [cache.make_key(pdf, f"v{n}") for n in range(4)]
+    for n, key in enumerate(keys):
+        cache.put(key, writer_for([f"第 {n} 本書的內容。" * 50]))
+        os.utime(os.path.join(cache.cache_dir, key + CACHE_SUFFIX), (1000 + n, 1000 + n))
+    size = os.path.getsize(os.path.join(cache.cache_dir, keys[0] + CACHE_SUFFIX))
+
+    # 讀取會更新存取時間，最舊的 keys[0] 因此保留下來
+    assert cache.get(keys[0]) is not None
+    cache.max_bytes = 2 * size + size // 2
+    cache.evict()
+    remaining = {name[:-len(CACHE_SUFFIX)] for name in os.listdir(cache.cache_dir)}
+    assert remaining == {keys[0], keys[3]}
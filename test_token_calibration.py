@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試 token 估算的自我校正"""
+
+import json
+import os
+import pytest
+import token_estimator
+import token_calibration
+from token_calibration import TokenCalibration, CALIBRATION_SAVE_EVERY, MESSAGE_OVERHEAD_TOKENS
+
+ENGLISH = "The quick brown fox jumps over the lazy dog. " * 40
+
+def test_short_prompts_are_ignored(tmp_path):
+    path = tmp_path / "cal.json"
+    calibration = TokenCalibration(str(path))
+    calibration.record("hello", 2, 12)
+    calibration.flush()
+    assert not path.exists()
+
+def test_saves_in_batches_and_on_flush(tmp_path):
+    path = tmp_path / "cal.json"
+    calibration = TokenCalibration(str(path))
+    for _ in range(CALIBRATION_SAVE_EVERY - 1):
+        calibration.record(ENGLISH, 400, 440)
+    assert not path.exists()
+    calibration.record(ENGLISH, 400, 440)
+    assert json.loads(path.read_text())["en"]["samples"] == CALIBRATION_SAVE_EVERY
+
+    calibration.record(ENGLISH, 400, 440)
+    calibration.flush()
+    assert json.loads(path.read_text())["en"]["samples"] == CALIBRATION_SAVE_EVERY + 1
+
+def test_factor_needs_min_samples(tmp_path):
+    path = str(tmp_path / "cal.json")
+    calibration = TokenCalibration(path)
+    calibration.record(ENGLISH, 400, 600)
+    calibration.flush()
+    assert TokenCalibration(path).factor("en") == 1.0
+    for _ in range(token_calibration.CALIBRATION_MIN_SAMPLES):
+        calibration.record(ENGLISH, 400, 600)
+    calibration.flush()
+    assert TokenCalibration(path).factor("en") == pytest.approx(1.5)
+
+def test_factor_is_fixed_for_the_run(tmp_path, monkeypatch):
+    """新樣本只影響下一次執行，同一次執行的截斷與分塊切點不變"""
+    path = tmp_path / "cal.json"
+    path.write_text(json.dumps({"en": {"estimated": 1000.0, "actual": 1000.0, "samples": 5}}))
+    calibration = TokenCalibration(str(path))
+    monkeypatch.setattr(token_estimator, "token_calibration", calibration)
+    monkeypatch.setattr(token_estimator, "get_exact_tokenizer", lambda: None)
+    before = token_estimator.count_tokens(ENGLISH)
+
+    for _ in range(CALIBRATION_SAVE_EVERY * 2):
+        calibration.record(ENGLISH, 400, 520)
+    assert token_estimator.count_tokens(ENGLISH) == before
+    assert calibration.factor("en") == 1.0
+    assert TokenCalibration(str(path)).factor("en") == pytest.approx(1.3)
+
+@pytest.mark.parametrize("ratio, factor", [(1.04, 1.0), (1.26, 1.3), (1.24, 1.2), (9.0, 4.0)])
+def test_factor_is_rounded_to_steps(tmp_path, ratio, factor):
+    calibration = TokenCalibration(str(tmp_path / "cal.json"))
+    calibration.freeze({"zh": {"estimated": 1000.0, "actual": 1000.0 * ratio, "samples": 5}})
+    assert calibration.factor("zh") == factor
+
+def test_frozen_calibration_ignores_samples(tmp_path):
+    path = tmp_path / "cal.json"
+    calibration = TokenCalibration(str(path))
+    calibration.freeze({"en": {"estimated": 100.0, "actual": 200.0, "samples": 5}})
+    for _ in range(CALIBRATION_SAVE_EVERY):
+        calibration.record(ENGLISH, 400, 440)
+    calibration.flush()
+    assert calibration.factor("en") == 2.0
+    assert not os.path.exists(path)
+
+def test_record_prompt_usage_subtracts_message_overhead(tmp_path, monkeypatch):
+    path = tmp_path / "cal.json"
+    calibration = TokenCalibration(str(path))
+    monkeypatch.setattr(token_estimator, "token_calibration", calibration)
+    estimated = token_estimator.estimate_tokens(ENGLISH)
+    token_estimator.record_prompt_usage(ENGLISH, {"prompt_tokens": estimated + 2 * MESSAGE_OVERHEAD_TOKENS}, messages=2)
+    calibration.flush()
+    stats = json.loads(path.read_text())["en"]
+    assert stats["estimated"] == stats["actual"] == estimated
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""以隨機文本比對向量化估算與原本純 Python 估算的結果，並測試選用的精確分詞計數"""
+
+import random
+import logging
+import pytest
+import token_estimator
+from types import SimpleNamespace
+from token_estimator import (estimate_tokens, estimate_tokens_batch, estimate_tokens_python,
+                             estimate_tokens_segments, count_tokens, count_tokens_segments,
+                             ExactTokenizer, VECTORIZE_MIN_CHARS)
+
+requires_numpy = pytest.mark.skipif(token_estimator.np is None, reason="需要 NumPy")
+
+# 中文、英文字母、數字、底線、帶重音與其他非 ASCII 字母、全形字元、標點與空白，
+# 涵蓋單詞邊界判斷中容易出錯的組合（如 café、abc123、foo_bar、中文夾英文）
+ALPHABET = (list("天地玄黃宇宙洪荒") + list("abcXYZ") + list("0189") + ["_"] + list("éüßñ") +
+            list("αβЖ한あ") + list("ＡＢ１") + list(".,;!?'-。，！") + [" ", "\n", "\t", "　"] +
+            ["\U0001F600", "²", "٠"])
+WORDS = ["the", "Book", "café", "abc123", "foo_bar", "x", "中文", "naïve"]
+
+def random_text(rng, length):
+    pieces = []
+    size = 0
+    while size < length:
+        pieces.append(rng.choice(WORDS) if rng.random() < 0.3 else rng.choice(ALPHABET))
+        size += len(pieces[-1])
+    return "".join(pieces)
+
+@requires_numpy
+def test_fuzz_equivalence():
+    rng = random.Random(20240501)
+    for _ in range(3000):
+        text = random_text(rng, rng.randint(0, 200))
+        expected = estimate_tokens_python(text)
+        assert estimate_tokens_segments(text, [0]) == [expected], repr(text)
+
+@requires_numpy
+def test_long_texts_use_vectorized_path():
+    rng = random.Random(7)
+    for _ in range(20):
+        text = random_text(rng, rng.randint(VECTORIZE_MIN_CHARS, 4 * VECTORIZE_MIN_CHARS))
+        assert estimate_tokens(text) == estimate_tokens_python(text)
+
+@requires_numpy
+def test_segments_match_slices():
+    rng = random.Random(11)
+    for _ in range(200):
+        text = random_text(rng, 300)
+        starts = sorted(set([0] + rng.sample(range(len(text)), rng.randint(0, 20))))
+        bounds = starts + [len(text)]
+        expected = [estimate_tokens_python(text[bounds[i]:bounds[i + 1]]) for i in range(len(starts))]
+        # 切點落在單詞中間時，前後兩段各自計算
+        assert estimate_tokens_segments(text, starts) == expected
+
+@requires_numpy
+def test_batch_matches_individual_estimates():
+    rng = random.Random(13)
+    texts = [random_text(rng, rng.randint(0, 80)) for _ in range(300)] + ["", "abc", "def"]
+    assert estimate_tokens_batch(texts) == [estimate_tokens_python(text) for text in texts]
+    assert estimate_tokens_batch([]) == []
+
+# ==========================
+# 精確分詞計數
+# ==========================
+class FakeTokenizer:
+    """以字元為 token 的假分詞器，記錄每次 encode_batch 收到的文本"""
+
+    def __init__(self):
+        self.batches = []
+
+    @classmethod
+    def from_file(cls, path):
+        return cls()
+
+    def encode_batch(self, texts, add_special_tokens=True):
+        self.batches.append(list(texts))
+        return [SimpleNamespace(ids=list(text)) for text in texts]
+
+@pytest.fixture
+def exact_tokenizer(tmp_path, monkeypatch):
+    """將 count_tokens 指向以 FakeTokenizer 建立的精確分詞器"""
+    path = tmp_path / "tokenizer.json"
+    path.write_text("{}")
+    monkeypatch.setattr(token_estimator, "Tokenizer", FakeTokenizer)
+    monkeypatch.setattr(token_estimator, "DEEPSEEK_TOKENIZER_PATH", str(path))
+    monkeypatch.setattr(token_estimator, "_exact_tokenizer", None)
+    monkeypatch.setattr(token_estimator, "_exact_tokenizer_checked", False)
+    return token_estimator.get_exact_tokenizer()
+
+def test_count_tokens_estimates_without_a_vocabulary(tmp_path, monkeypatch):
+    monkeypatch.setattr(token_estimator, "DEEPSEEK_TOKENIZER_PATH", str(tmp_path / "missing.json"))
+    monkeypatch.setattr(token_estimator, "_exact_tokenizer", None)
+    monkeypatch.setattr(token_estimator, "_exact_tokenizer_checked", False)
+    text = "天地玄黃，the quick fox.\n\n第二段"
+    assert count_tokens(text) == estimate_tokens(text)
+    assert count_tokens_segments(text, [0, 5]) == estimate_tokens_segments(text, [0, 5])
+
+def test_vocabulary_without_tokenizers_package_falls_back(tmp_path, monkeypatch, caplog):
+    path = tmp_path / "tokenizer.json"
+    path.write_text("{}")
+    monkeypatch.setattr(token_estimator, "Tokenizer", None)
+    monkeypatch.setattr(token_estimator, "DEEPSEEK_TOKENIZER_PATH", str(path))
+    monkeypatch.setattr(token_estimator, "_exact_tokenizer", None)
+    monkeypatch.setattr(token_estimator, "_exact_tokenizer_checked", False)
+    with caplog.at_level(logging.WARNING, logger="token_estimator"):
+        assert token_estimator.get_exact_tokenizer() is None
+    assert "未安裝 tokenizers" in caplog.text
+    assert count_tokens("abc def") == estimate_tokens("abc def")
+
+def test_exact_counts_are_summed_per_paragraph(exact_tokenizer):
+    text = "第一段。\n\nsecond paragraph\n\n第一段。\n\n"
+    assert count_tokens(text) == len(text)
+    # 重複的段落只送進分詞器一次，第二次呼叫全部命中快取
+    assert exact_tokenizer._tokenizer.batches == [["第一段。\n\n", "second paragraph\n\n"]]
+    assert count_tokens(text) == len(text)
+    assert len(exact_tokenizer._tokenizer.batches) == 1
+    assert exact_tokenizer.hits == 3 and exact_tokenizer.misses == 2
+
+def test_exact_segments_split_paragraphs_at_the_starts(exact_tokenizer):
+    text = "甲乙丙\n\n丁戊\n\nxyz"
+    starts = [0, 2, 9]
+    bounds = starts + [len(text)]
+    assert count_tokens_segments(text, starts) == [bounds[i + 1] - bounds[i] for i in range(len(starts))]
+
+def test_paragraph_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(token_estimator, "Tokenizer", FakeTokenizer)
+    tokenizer = ExactTokenizer(str(tmp_path / "tokenizer.json"), cache_size=2)
+    assert tokenizer.count("a\n\nbb\n\nccc") == 10
+    assert list(tokenizer._cache) == ["bb\n\n", "ccc"]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試 TokenIndex 的前綴和、截斷與分塊切點"""
+
+import pytest
+from token_estimator import estimate_tokens_python
+from token_index import TokenIndex
+
+SEEDS = range(5)
+
+def legacy_truncate(text, max_tokens):
+    """原本的截斷方式：依估算 token 數按字元比例切斷"""
+    tokens = estimate_tokens_python(text)
+    if tokens <= max_tokens:
+        return text
+    cutoff = int(len(text) * (max_tokens / tokens))
+    return text[:cutoff]
+
+def is_boundary(text, offset):
+    """offset 是否緊接在段落結尾（\n\n）或句末標點之後"""
+    return offset == len(text) or text[offset - 2:offset] == "\n\n" or text[offset - 1] in "。！？."
+
+def longest_step(index):
+    """相鄰邊界間最多的 token 數（截斷誤差的上限）"""
+    return max(b - a for a, b in zip(index.cumulative, index.cumulative[1:]))
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_prefix_sums_match_the_estimator(sample_text, seed):
+    text = sample_text(seed)
+    index = TokenIndex(text, estimate_tokens_python)
+    paragraphs = text.split("\n\n")
+
+    assert list(index.offsets) == sorted(index.offsets)
+    assert list(index.cumulative) == sorted(index.cumulative)
+    # 每段各自取整後加總
+    assert index.total_tokens == sum(estimate_tokens_python(p + "\n\n") for p in paragraphs[:-1]) + estimate_tokens_python(paragraphs[-1])
+    assert index.tokens_before(len(text)) == index.total_tokens
+
+    # 段落邊界上的區段 token 數與直接估算一致
+    start = len(paragraphs[0]) + 2
+    end = start + len(paragraphs[1]) + 2
+    assert index.tokens_between(start, end) == estimate_tokens_python(text[start:end])
+
+def test_default_estimator_agrees_with_python_version(sample_text):
+    text = sample_text(0)
+    assert TokenIndex(text).total_tokens == TokenIndex(text, estimate_tokens_python).total_tokens
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("budget", [500, 3000, 10000])
+def test_cut_offset_is_last_boundary_within_budget(sample_text, seed, budget):
+    text = sample_text(seed)
+    index = TokenIndex(text, estimate_tokens_python)
+    cut = index.cut_offset(budget)
+
+    assert is_boundary(text, cut)
+    assert index.tokens_before(cut) <= budget
+    following = [offset for offset in index.offsets if offset > cut]
+    assert index._tokens_at(following[0]) > budget
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("budget", [500, 3000, 10000])
+def test_truncate_against_legacy_truncation(sample_text, seed, budget):
+    text = sample_text(seed)
+    index = TokenIndex(text, estimate_tokens_python)
+    truncated = index.truncate(budget)
+    legacy = legacy_truncate(text, budget)
+
+    assert text.startswith(truncated) and text.startswith(legacy)
+    assert is_boundary(text, len(truncated))
+    # 停在句子結尾，與預算相差不到一句；原本的比例切法在中英密度不均時偏差可能更大
+    step = longest_step(index)
+    assert abs(estimate_tokens_python(truncated) - budget) <= step
+    assert abs(estimate_tokens_python(truncated) - budget) <= abs(estimate_tokens_python(legacy) - budget) + step
+
+def test_truncate_keeps_short_text_and_cuts_long_first_sentence():
+    assert TokenIndex("短句。").truncate(100) == "短句。"
+    text = "無標點的長句" * 100
+    truncated = TokenIndex(text, estimate_tokens_python).truncate(150)
+    assert text.startswith(truncated) and 0 < len(truncated) < len(text)
+    assert abs(estimate_tokens_python(truncated) - 150) <= 2
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("max_tokens", [800, 2000, 5000])
+def test_split_spans_cover_the_text(sample_text, seed, max_tokens):
+    text = sample_text(seed)
+    index = TokenIndex(text, estimate_tokens_python)
+    spans = index.split_spans(max_tokens)
+
+    assert spans[0][0] == 0 and spans[-1][1] == len(text)
+    assert all(a[1] == b[0] for a, b in zip(spans, spans[1:]))
+    assert "".join(index.split(max_tokens)) == text
+    # 切點退到邊界後剩餘量放不下時會多切一塊，但每塊都不超過上限
+    assert len(spans) >= -(-index.total_tokens // max_tokens)
+    assert all(index.tokens_between(start, end) <= max_tokens for start, end in spans)
+    # 各塊平均分配 token，切在邊界上只差一句左右
+    target = index.total_tokens / len(spans)
+    step = longest_step(index)
+    for start, end in spans[:-1]:
+        assert is_boundary(text, end)
+        assert abs(index.tokens_between(start, end) - target) <= target / 2 + step
+
+def test_split_spans_within_a_range(sample_text):
+    text = sample_text(1)
+    index = TokenIndex(text, estimate_tokens_python)
+    start, end = 1000, len(text) - 1000
+    spans = index.split_spans(1500, start, end)
+    assert spans[0][0] == start and spans[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(spans, spans[1:]))
+    assert index.split_spans(10 ** 9, start, end) == [(start, end)]
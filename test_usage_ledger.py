@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""測試用量帳本的計價、標示與彙總報告"""
+
+import sys
+import json
+import pytest
+import usage_ledger
+from concurrent.futures import ThreadPoolExecutor
+from usage_ledger import UsageLedger, aggregate, call_context, entry_cost, labeled, set_call_context
+
+PAYLOAD = {"model": "deepseek-chat", "messages": []}
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    ledger = UsageLedger(str(tmp_path / "usage.jsonl"))
+    monkeypatch.setattr(usage_ledger, "usage_ledger", ledger)
+    monkeypatch.setattr(usage_ledger, "PRICE_INPUT", 1.0)
+    monkeypatch.setattr(usage_ledger, "PRICE_CACHED_INPUT", 0.1)
+    monkeypatch.setattr(usage_ledger, "PRICE_OUTPUT", 2.0)
+    yield ledger
+    set_call_context()  # 清除主執行緒上的標示，不影響其他測試
+
+def usage(prompt, completion, hit=0):
+    return {"prompt_tokens": prompt, "completion_tokens": completion, "prompt_cache_hit_tokens": hit}
+
+# ==========================
+# 計價
+# ==========================
+def test_cache_hit_tokens_use_the_cached_price(ledger):
+    miss = {"prompt_tokens": 1_000_000, "completion_tokens": 0, "cache_hit_tokens": 0}
+    hit = dict(miss, cache_hit_tokens=1_000_000)
+    partial = dict(miss, cache_hit_tokens=250_000, completion_tokens=500_000)
+    assert entry_cost(miss) == pytest.approx(1.0)
+    assert entry_cost(hit) == pytest.approx(0.1)
+    assert entry_cost(partial) == pytest.approx(0.75 + 0.025 + 1.0)
+
+def test_response_cache_hits_are_free(ledger):
+    assert entry_cost({"cached": True, "prompt_tokens": 1000, "completion_tokens": 1000}) == 0.0
+
+# ==========================
+# 標示
+# ==========================
+def test_labels_follow_contextvars_into_thread_pools(ledger):
+    set_call_context(book="甲書")
+
+    def call(section):
+        usage_ledger.record_call(PAYLOAD, usage(100, 10), latency=0.5, status=200)
+        return section
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        # 未包裝的工作不會繼承提交者的標示
+        executor.submit(call, "plain").result()
+        futures = [executor.submit(labeled(call, section=name), name) for name in ("概覽", "論點", "評價")]
+        [future.result() for future in futures]
+    with call_context(section="摘要"):
+        call("摘要")
+
+    entries = ledger.entries()
+    assert (entries[0]["book"], entries[0]["section"]) == (None, None)
+    assert sorted((e["book"], e["section"]) for e in entries[1:]) == [
+        ("甲書", "摘要"), ("甲書", "概覽"), ("甲書", "評價"), ("甲書", "論點")]
+
+def test_error_status_comes_from_the_exception(ledger):
+    class RateLimited(Exception):
+        status = 429
+
+    usage_ledger.record_call(PAYLOAD, latency=1.0, error=RateLimited("too many requests"))
+    [entry] = ledger.entries()
+    assert entry["status"] == 429 and "too many" in entry["error"]
+
+# ==========================
+# 彙總與報告
+# ==========================
+def test_aggregate_by_section(ledger):
+    with call_context(book="甲書", section="概覽"):
+        usage_ledger.record_call(PAYLOAD, usage(1000, 100, hit=800), latency=2.0, status=200)
+        usage_ledger.record_call(PAYLOAD, latency=0.5, status=429)
+        usage_ledger.record_call(PAYLOAD, usage(1000, 100), cached=True)
+    with call_context(book="甲書", section="評價"):
+        usage_ledger.record_call(PAYLOAD, usage(5000, 500), latency=4.0, status=200)
+
+    rows = dict(aggregate(ledger.entries(), "section"))
+    assert list(rows) == ["評價", "概覽"]  # 依費用由高到低
+    overview = rows["概覽"]
+    assert (overview["calls"], overview["cached"], overview["errors"]) == (3, 1, 1)
+    assert (overview["prompt_tokens"], overview["cache_hit_tokens"], overview["completion_tokens"]) == (1000, 800, 100)
+    assert overview["latency_avg"] == 2.0
+    assert overview["cost"] == pytest.approx((200 * 1.0 + 800 * 0.1 + 100 * 2.0) / 1_000_000)
+
+def test_report_command_filters_by_run(ledger, monkeypatch, capsys):
+    lines = [
+        {"ts": 1, "run": "old", "book": "舊書", "section": "概覽", "prompt_tokens": 10, "latency": 1, "status": 200},
+        {"ts": 2, "run": "new", "book": "新書", "section": "評價", "prompt_tokens": 20, "latency": 1, "status": 200},
+    ]
+    with open(ledger.path, "w", encoding="utf-8") as f:
+        f.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines) + "損毀的一行\n")
+
+    monkeypatch.setattr(sys, "argv", ["usage_ledger.py", "--path", ledger.path, "report", "--run", "last", "--by", "book"])
+    assert usage_ledger.main() == 0
+    output = capsys.readouterr().out
+    assert "共 1 筆紀錄" in output and "新書" in output and "舊書" not in output
+
+    monkeypatch.setattr(sys, "argv", ["usage_ledger.py", "--path", ledger.path, "report", "--book", "不存在"])
+    assert usage_ledger.main() == 1
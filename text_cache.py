@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF 提取文本快取
+
+以 PDF 檔案內容的 SHA-256 加上提取器版本作為鍵，將每頁文本壓縮後存到磁碟，
+再次分析同一本書時直接讀回，不必重新解析 PDF。快取總大小超過上限時，
+依最近使用時間（LRU）淘汰最舊的項目。
+
+依 token 預算提前停止的讀取只會提取開頭的頁面，這些頁面同樣寫入快取並標記為不完整
+（complete 為 false）；之後的讀取先交出已快取的頁面，需要更多頁面時才從下一頁接續提取。
+
+檔案格式：第一行為 JSON 標頭（含每頁在解壓文本中的起始位置與是否涵蓋全書），其後為 zlib 壓縮的文本。
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+TEXT_CACHE_DIR = os.getenv("TEXT_CACHE_DIR", str(Path.home() / ".cache" / "deepseek-book-analyzer" / "text"))
+TEXT_CACHE_MAX_BYTES = int(os.getenv("TEXT_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+CACHE_SUFFIX = ".pages.z"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def file_digest(path):
+    """以 1MB 區塊串流計算檔案內容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class PageWriter:
+    """逐頁壓縮文本並記錄頁面起始位置，完成後交由 TextCache.put 寫入"""
+
+    def __init__(self):
+        self._compressor = zlib.compressobj(6)
+        self._chunks = []
+        self._length = 0
+        self.offsets = []
+
+    def add(self, page_text):
+        self.offsets.append(self._length)
+        self._length += len(page_text)
+        self._chunks.append(self._compressor.compress(page_text.encode('utf-8')))
+
+    def finish(self):
+        self._chunks.append(self._compressor.flush())
+        return b''.join(self._chunks)
+
+class TextCache:
+    """以內容雜湊為鍵、大小受限的 LRU 磁碟快取"""
+
+    def __init__(self, cache_dir=TEXT_CACHE_DIR, max_bytes=TEXT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def make_key(self, pdf_path, version):
+        """快取鍵 = PDF 內容雜湊 + 提取器版本"""
+        return hashlib.sha256(f"{file_digest(pdf_path)}:{version}".encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + CACHE_SUFFIX)
+
+    def get(self, key):
+        """讀取快取，命中時回傳 (每頁文本列表, 是否涵蓋全書)，否則回傳 None"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as file:
+                header = json.loads(file.readline())
+                text = zlib.decompress(file.read()).decode('utf-8')
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"文本快取損毀，將重新提取: {e}")
+            self._remove(path)
+            return None
+
+        # 更新存取時間作為 LRU 依據
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+        offsets = header["offsets"] + [len(text)]
+        pages = [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        return pages, header.get("complete", True)
+
+    def put(self, key, writer, source="", complete=True):
+        """寫入 PageWriter 累積的壓縮文本（先寫暫存檔再原子性取代）；complete 為 False 表示只含開頭的頁面"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            body = writer.finish()
+            header = json.dumps({"source": source, "num_pages": len(writer.offsets), "offsets": writer.offsets,
+                                 "complete": complete}, ensure_ascii=False)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as file:
+                file.write(header.encode('utf-8') + b'\n')
+                file.write(body)
+            os.replace(tmp_path, self._entry_path(key))
+            logger.info(f"已寫入文本快取：{'' if complete else '前 '}{len(writer.offsets)} 頁，壓縮後 {len(body) / 1024:.1f} KB")
+        except OSError as e:
+            logger.warning(f"寫入文本快取失敗: {e}")
+            return
+        self.evict()
+
+    def evict(self):
+        """總大小超過上限時，刪除最久未使用的項目"""
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(CACHE_SUFFIX):
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                    entries.append((stat.st_mtime, stat.st_size, name))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.cache_dir, name))
+            total -= size
+            logger.info(f"淘汰文本快取項目: {name}")
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
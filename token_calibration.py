@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+token 估算自我校正
+
+每次呼叫 DeepSeek API 後，以回應 usage.prompt_tokens 的實際值對照啟發式估算值，
+依語言（中文、英文、中英混合）累積指數加權的比例，作為之後估算的校正係數。
+prompt_tokens 包含對話範本的角色標記，比對前先扣除每則訊息的固定開銷，並略過開銷佔比過高的短 prompt。
+校正資料以 JSON 保存在磁碟（每累積 CALIBRATION_SAVE_EVERY 個樣本與程式結束時寫入），
+跨次執行持續收斂到實際分詞器的結果。
+
+截斷與分塊的切點取決於校正後的估算，係數一變動，同一本書送出的 prompt 就不同，
+回應快取與伺服器端前綴快取都會失效。因此係數在啟動時載入後整次執行固定不變，
+新樣本只寫入磁碟供下一次執行使用；係數並以 CALIBRATION_FACTOR_STEP 為單位取整，
+跨次執行的微小變動也不會改變切點。
+"""
+
+import os
+import re
+import json
+import atexit
+import logging
+import tempfile
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+TOKEN_CALIBRATION_PATH = os.getenv("TOKEN_CALIBRATION_PATH", str(Path.home() / ".cache" / "deepseek-book-analyzer" / "token_calibration.json"))
+
+# 舊樣本的權重衰減，越小越快跟上新資料
+CALIBRATION_DECAY = 0.9
+# 樣本數達到此值才套用校正，避免單次呼叫的偏差
+CALIBRATION_MIN_SAMPLES = 3
+# 校正係數的合理範圍
+CALIBRATION_MIN_FACTOR = 0.25
+CALIBRATION_MAX_FACTOR = 4.0
+# 每則訊息在對話範本中的固定 token 開銷（角色標記等），不屬於估算的文字
+MESSAGE_OVERHEAD_TOKENS = 4
+# 估算值低於此 token 數的 prompt 不納入校正，避免固定開銷扭曲比例
+CALIBRATION_MIN_PROMPT_TOKENS = 256
+# 每累積幾個新樣本寫入磁碟一次（其餘在程式結束時寫入）
+CALIBRATION_SAVE_EVERY = 8
+# 校正係數取整的單位
+CALIBRATION_FACTOR_STEP = 0.1
+
+# 判斷語言時最多抽樣的字元數
+LANGUAGE_SAMPLE_CHARS = 20000
+
+CHINESE_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+
+def detect_language(text):
+    """依中文字比例將文本歸類為 zh、en 或 mixed（長文本等距抽樣）"""
+    if len(text) > LANGUAGE_SAMPLE_CHARS:
+        text = text[::len(text) // LANGUAGE_SAMPLE_CHARS + 1]
+    visible = len(text) - sum(1 for c in text if c.isspace())
+    if visible == 0:
+        return "mixed"
+    ratio = len(CHINESE_PATTERN.findall(text)) / visible
+    if ratio >= 0.5:
+        return "zh"
+    if ratio <= 0.05:
+        return "en"
+    return "mixed"
+
+class TokenCalibration:
+    """各語言的估算校正係數，執行緒安全並持久化於 JSON 檔"""
+
+    def __init__(self, path=TOKEN_CALIBRATION_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # _active 為本次執行套用的校正資料（啟動時載入後不再變動），_stats 累積新樣本供下次執行使用
+        self._stats = self._load()
+        self._active = json.loads(json.dumps(self._stats))
+        self._unsaved = 0  # 尚未寫入磁碟的樣本數
+        self.frozen = False
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"無法讀取 token 校正資料，將重新累積: {e}")
+            return {}
+
+    def _save(self, stats):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(stats, file, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"寫入 token 校正資料失敗: {e}")
+
+    def flush(self):
+        """將尚未保存的樣本寫入磁碟（在鎖外寫檔，不阻塞其他執行緒記錄樣本）"""
+        with self._save_lock:
+            with self._lock:
+                if not self._unsaved or self.frozen:
+                    return
+                stats = json.loads(json.dumps(self._stats))
+                self._unsaved = 0
+            self._save(stats)
+
+    def snapshot(self):
+        """本次執行套用的校正資料（複本）"""
+        with self._lock:
+            return json.loads(json.dumps(self._active))
+
+    def freeze(self, stats=None):
+        """改用指定的校正資料（未指定時沿用目前套用的），之後的 record 不再累積樣本，也不寫入磁碟"""
+        with self._lock:
+            if stats is not None:
+                self._active = json.loads(json.dumps(stats))
+                self._stats = json.loads(json.dumps(stats))
+            self.frozen = True
+
+    def factor(self, language):
+        """回傳該語言本次執行的校正係數（樣本不足時為 1.0）"""
+        stats = self._active.get(language)
+        if not stats or stats["samples"] < CALIBRATION_MIN_SAMPLES or stats["estimated"] <= 0:
+            return 1.0
+        ratio = round(stats["actual"] / stats["estimated"] / CALIBRATION_FACTOR_STEP) * CALIBRATION_FACTOR_STEP
+        return round(min(CALIBRATION_MAX_FACTOR, max(CALIBRATION_MIN_FACTOR, ratio)), 6)
+
+    def record(self, text, estimated_tokens, actual_tokens):
+        """記錄一次估算值與 API 回報的實際 token 數（已扣除對話範本開銷），下次執行才套用"""
+        if self.frozen or estimated_tokens < CALIBRATION_MIN_PROMPT_TOKENS or not actual_tokens or actual_tokens <= 0:
+            return
+        language = detect_language(text)
+        with self._lock:
+            stats = self._stats.setdefault(language, {"estimated": 0.0, "actual": 0.0, "samples": 0})
+            stats["estimated"] = stats["estimated"] * CALIBRATION_DECAY + estimated_tokens
+            stats["actual"] = stats["actual"] * CALIBRATION_DECAY + actual_tokens
+            stats["samples"] += 1
+            self._unsaved += 1
+            save = self._unsaved >= CALIBRATION_SAVE_EVERY
+            ratio = stats["actual"] / stats["estimated"]
+        if save:
+            self.flush()
+        logger.info(f"token 校正（{language}）：估算 {estimated_tokens}，實際 {actual_tokens}，"
+                    f"累積比例 {ratio:.3f}（本次執行沿用係數 {self.factor(language):.1f}）")
+
+token_calibration = TokenCalibration()
+atexit.register(token_calibration.flush)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+token 估算與計數
+
+估算規則與各腳本原本的 estimate_tokens 相同：一個中文字約 1.5 個 token，
+一個英文單詞約 1 個 token，其餘字元各約 0.5 個 token。
+文本先以 UTF-32 編碼後用 np.frombuffer 轉為碼位陣列，再以陣列運算計數，
+並提供批次介面，一次呼叫即可估算數千個文本塊。
+
+若本機有 DeepSeek 的 tokenizer.json（見 DEEPSEEK_TOKENIZER_PATH）且已安裝 tokenizers，
+count_tokens 會改用精確分詞計數，並以 LRU 快取各段落的計數結果；否則以
+API 回報的實際 token 數校正估算值（見 token_calibration.py）。
+"""
+
+import os
+import re
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from token_calibration import token_calibration, detect_language, MESSAGE_OVERHEAD_TOKENS
+
+try:
+    import numpy as np
+except ImportError:  # 未安裝 numpy 時退回純 Python 版本
+    np = None
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # 未安裝 tokenizers 時只能使用估算
+    Tokenizer = None
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# DeepSeek 分詞器詞彙檔（Hugging Face 格式的 tokenizer.json）
+DEEPSEEK_TOKENIZER_PATH = os.getenv("DEEPSEEK_TOKENIZER_PATH", str(Path.home() / ".cache" / "deepseek-book-analyzer" / "tokenizer.json"))
+# 段落 token 數 LRU 快取的項目上限
+TOKEN_COUNT_CACHE_SIZE = int(os.getenv("TOKEN_COUNT_CACHE_SIZE", "8192"))
+
+# ==========================
+# 啟發式估算
+# ==========================
+# 短文本用純 Python 計算反而較快（省去陣列配置成本）
+VECTORIZE_MIN_CHARS = 2048
+
+ENGLISH_WORD_PATTERN = re.compile(r'\b[a-zA-Z]+\b')
+
+if np is not None:
+    # ASCII 範圍內的單詞字元與英文字母查表
+    _ASCII_WORD = np.array([chr(c).isalnum() or chr(c) == '_' for c in range(128)], dtype=bool)
+    _ASCII_LETTER = np.array([chr(c).isalpha() for c in range(128)], dtype=bool)
+
+def _combine(chinese_char_count, english_word_count, total_char_count):
+    """依計數組合估算值"""
+    return chinese_char_count * 1.5 + english_word_count + (total_char_count - chinese_char_count - english_word_count) * 0.5
+
+def estimate_tokens_python(text):
+    """純 Python 版本（原實作）"""
+    chinese_char_count = sum(1 for c in text if '\u4e00' <= c <= '\u9fff')
+    english_word_count = len(ENGLISH_WORD_PATTERN.findall(text))
+    return int(_combine(chinese_char_count, english_word_count, len(text)))
+
+def _codepoints(text):
+    """將文本轉為 uint32 碼位陣列"""
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype='<u4')
+
+def _word_mask(codepoints, chinese):
+    """標記單詞字元（字母、數字、底線）的位置；其他非 ASCII 字元只對不重複的碼位查詢一次"""
+    is_ascii = codepoints < 128
+    mask = _ASCII_WORD[np.where(is_ascii, codepoints, 0)] & is_ascii
+    mask |= chinese  # 中日韓統一表意文字皆屬單詞字元
+    others = ~(is_ascii | chinese)
+    if others.any():
+        other_codepoints = codepoints[others]
+        unique, inverse = np.unique(other_codepoints, return_inverse=True)
+        unique_mask = np.fromiter((chr(c).isalnum() for c in unique.tolist()), dtype=bool, count=len(unique))
+        mask[others] = unique_mask[inverse]
+    return mask
+
+def _count_arrays(codepoints, starts):
+    """
+    回傳每個文本的 (中文字數, 英文單詞數)
+
+    starts 為各文本在碼位陣列中的起始位置；英文單詞即完全由 ASCII 字母組成、
+    前後皆非單詞字元的連續區段，與 ENGLISH_WORD_PATTERN 的比對結果一致。
+    """
+    n = len(codepoints)
+    ends = np.append(starts[1:], n)
+
+    chinese = (codepoints >= 0x4E00) & (codepoints <= 0x9FFF)
+    chinese_cumsum = np.concatenate(([0], np.cumsum(chinese)))
+    chinese_counts = chinese_cumsum[ends] - chinese_cumsum[starts]
+
+    is_word = _word_mask(codepoints, chinese)
+    is_letter = _ASCII_LETTER[np.where(codepoints < 128, codepoints, 0)] & (codepoints < 128)
+
+    # 單詞區段的起點與終點（文本交界處視為區段邊界）
+    boundary = np.zeros(n + 1, dtype=bool)
+    boundary[starts[starts < n]] = True
+    boundary[n] = True
+    previous_word = np.zeros(n, dtype=bool)
+    previous_word[1:] = is_word[:-1]
+    next_word = np.zeros(n, dtype=bool)
+    next_word[:-1] = is_word[1:]
+    run_starts = np.flatnonzero(is_word & ~(previous_word & ~boundary[:n]))
+    run_ends = np.flatnonzero(is_word & ~(next_word & ~boundary[1:])) + 1
+
+    # 區段內沒有任何非字母的單詞字元（數字、底線、中文等）才算英文單詞
+    non_letter_cumsum = np.concatenate(([0], np.cumsum(is_word & ~is_letter)))
+    word_starts = run_starts[non_letter_cumsum[run_ends] == non_letter_cumsum[run_starts]]
+    word_counts = np.searchsorted(word_starts, ends) - np.searchsorted(word_starts, starts)
+    return chinese_counts, word_counts
+
+def estimate_tokens(text):
+    """估算文字的 token 數量（長文本以 NumPy 向量化計算）"""
+    if np is None or len(text) < VECTORIZE_MIN_CHARS:
+        return estimate_tokens_python(text)
+    chinese_counts, word_counts = _count_arrays(_codepoints(text), np.array([0]))
+    return int(_combine(int(chinese_counts[0]), int(word_counts[0]), len(text)))
+
+def estimate_tokens_segments(text, starts):
+    """估算 text 依起始位置 starts 切開後各片段的 token 數，不必先切出子字串"""
+    if np is None or not len(starts):
+        bounds = list(starts) + [len(text)]
+        return [estimate_tokens_python(text[bounds[i]:bounds[i + 1]]) for i in range(len(starts))]
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.diff(np.append(starts, len(text)))
+    chinese_counts, word_counts = _count_arrays(_codepoints(text), starts)
+    return [int(_combine(c, w, l)) for c, w, l in zip(chinese_counts.tolist(), word_counts.tolist(), lengths.tolist())]
+
+def estimate_tokens_batch(texts):
+    """一次估算多個文本的 token 數量，回傳與輸入順序相同的整數列表"""
+    texts = list(texts)
+    starts = []
+    position = 0
+    for text in texts:
+        starts.append(position)
+        position += len(text)
+    return estimate_tokens_segments("".join(texts), starts)
+
+# ==========================
+# 精確分詞計數（選用）
+# ==========================
+# 段落邊界（與 TokenIndex 相同），分隔符歸屬於前一段
+PARAGRAPH_SPLIT_PATTERN = re.compile(r'(?<=\n\n)')
+
+class ExactTokenizer:
+    """以本機 tokenizer.json 精確計算 token 數，段落計數結果以 LRU 快取"""
+
+    def __init__(self, path, cache_size=TOKEN_COUNT_CACHE_SIZE):
+        self.path = path
+        self.cache_size = cache_size
+        self._tokenizer = Tokenizer.from_file(path)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _count_paragraphs(self, paragraphs):
+        """計算各段落 token 數；未命中快取的段落合併為一次 encode_batch"""
+        counts = [None] * len(paragraphs)
+        missing = {}
+        with self._lock:
+            for i, paragraph in enumerate(paragraphs):
+                count = self._cache.get(paragraph)
+                if count is None:
+                    missing.setdefault(paragraph, []).append(i)
+                else:
+                    self._cache.move_to_end(paragraph)
+                    counts[i] = count
+            self.hits += len(paragraphs) - sum(len(indexes) for indexes in missing.values())
+            self.misses += len(missing)
+
+        if missing:
+            texts = list(missing)
+            encodings = self._tokenizer.encode_batch(texts, add_special_tokens=False)
+            with self._lock:
+                for paragraph, encoding in zip(texts, encodings):
+                    count = len(encoding.ids)
+                    for i in missing[paragraph]:
+                        counts[i] = count
+                    self._cache[paragraph] = count
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return counts
+
+    def count(self, text):
+        """文本的 token 數（各段落分別計數後加總）"""
+        return sum(self._count_paragraphs([p for p in PARAGRAPH_SPLIT_PATTERN.split(text) if p]))
+
+    def count_segments(self, text, starts):
+        """text 依起始位置 starts 切開後各片段的 token 數"""
+        bounds = list(starts) + [len(text)]
+        segments = [text[bounds[i]:bounds[i + 1]] for i in range(len(starts))]
+        paragraphs = []
+        owners = []
+        for i, segment in enumerate(segments):
+            for paragraph in PARAGRAPH_SPLIT_PATTERN.split(segment):
+                if paragraph:
+                    paragraphs.append(paragraph)
+                    owners.append(i)
+        counts = [0] * len(segments)
+        for owner, count in zip(owners, self._count_paragraphs(paragraphs)):
+            counts[owner] += count
+        return counts
+
+_exact_tokenizer = None
+_exact_tokenizer_checked = False
+_exact_tokenizer_lock = threading.Lock()
+
+def get_exact_tokenizer():
+    """載入精確分詞器；詞彙檔不存在或未安裝 tokenizers 時回傳 None"""
+    global _exact_tokenizer, _exact_tokenizer_checked
+    if _exact_tokenizer_checked:
+        return _exact_tokenizer
+    with _exact_tokenizer_lock:
+        if not _exact_tokenizer_checked:
+            if os.path.isfile(DEEPSEEK_TOKENIZER_PATH):
+                if Tokenizer is None:
+                    logger.warning("找到分詞器詞彙檔但未安裝 tokenizers，改用估算 token 數")
+                else:
+                    try:
+                        _exact_tokenizer = ExactTokenizer(DEEPSEEK_TOKENIZER_PATH)
+                        logger.info(f"已載入精確分詞器: {DEEPSEEK_TOKENIZER_PATH}")
+                    except Exception as e:
+                        logger.warning(f"載入分詞器失敗，改用估算 token 數: {e}")
+            _exact_tokenizer_checked = True
+    return _exact_tokenizer
+
+def count_tokens(text):
+    """有精確分詞器時回傳實際 token 數，否則回傳依語言校正後的估算值"""
+    tokenizer = get_exact_tokenizer()
+    if tokenizer is not None:
+        return tokenizer.count(text)
+    return int(estimate_tokens(text) * token_calibration.factor(detect_language(text)))
+
+def count_tokens_segments(text, starts):
+    """count_tokens 的分段版本，供 TokenIndex 一次計算所有段落"""
+    tokenizer = get_exact_tokenizer()
+    if tokenizer is not None:
+        return tokenizer.count_segments(text, starts)
+    factor = token_calibration.factor(detect_language(text))
+    counts = estimate_tokens_segments(text, starts)
+    if factor == 1.0:
+        return counts
+    return [int(count * factor) for count in counts]
+
+def record_prompt_usage(prompt, usage, messages=1):
+    """以 API 回應的 usage.prompt_tokens 校正估算係數；先扣除 messages 則訊息的對話範本開銷"""
+    if not usage or not usage.get("prompt_tokens"):
+        return
+    actual = usage["prompt_tokens"] - MESSAGE_OVERHEAD_TOKENS * messages
+    token_calibration.record(prompt, estimate_tokens(prompt), actual)
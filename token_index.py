@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+文本 token 前綴和索引
+
+依邊界索引（boundary_index.py）在每個段落（\n\n）與句子（。！？. ）結尾記錄累計 token 數，
+之後的截斷與分塊都改以二分搜尋定位切點，不必對數 MB 的字串重複估算 token。
+"""
+
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from token_estimator import count_tokens_segments
+from boundary_index import get_boundary_index
+
+class TokenIndex:
+    """以段落與句子邊界為節點的累計 token 索引"""
+
+    def __init__(self, text, estimate_tokens=None, cache_boundaries=True):
+        self.text = text
+        # offsets[i] 為第 i 個邊界的字元位置，cumulative[i] 為文本開頭至該位置的 token 數
+        self.offsets = array('I', [0])
+        self.cumulative = array('d', [0.0])
+        self.paragraph_offsets = array('I', [0])
+        self.paragraph_cumulative = array('d', [0.0])
+
+        # 每個段落只估算一次（估算函式會取整，逐句估算會累積誤差），
+        # 段落內的句子邊界再依字元比例內插累計值
+        # 段落與句子位置取自邊界索引，保存在 self.boundaries 供分塊規劃沿用；
+        # 一次性的短文本（逐頁截斷）以 cache_boundaries=False 略過共用快取
+        boundaries = self.boundaries = get_boundary_index(text, cache_boundaries)
+        sentences = boundaries.sentences
+        position = 0
+        total = 0.0
+        paragraph_ends = boundaries.paragraphs.tolist()
+        if not paragraph_ends or paragraph_ends[-1] < len(text):
+            paragraph_ends.append(len(text))
+
+        paragraph_starts = [0] + paragraph_ends[:-1]
+        if estimate_tokens is None:
+            # 未指定估算函式時一次計算所有段落（有詞彙檔時為精確分詞，否則向量化估算）
+            paragraph_token_counts = count_tokens_segments(text, paragraph_starts)
+        else:
+            paragraph_token_counts = [estimate_tokens(text[start:end]) for start, end in zip(paragraph_starts, paragraph_ends)]
+
+        for end, paragraph_tokens in zip(paragraph_ends, paragraph_token_counts):
+            if end <= position:
+                continue
+            length = end - position
+            for i in range(bisect_right(sentences, position), bisect_left(sentences, end)):
+                sentence_end = sentences[i]
+                self.offsets.append(sentence_end)
+                self.cumulative.append(total + paragraph_tokens * (sentence_end - position) / length)
+            total += paragraph_tokens
+            position = end
+            self.offsets.append(end)
+            self.cumulative.append(total)
+            if end < len(text):
+                self.paragraph_offsets.append(end)
+                self.paragraph_cumulative.append(total)
+
+    @property
+    def total_tokens(self):
+        """整份文件的估算 token 數"""
+        return int(self.cumulative[-1])
+
+    def _tokens_at(self, offset):
+        """文本開頭至 offset 的累計 token 數（依最近的邊界內插，不取整）"""
+        index = bisect_right(self.offsets, offset) - 1
+        if index >= len(self.offsets) - 1:
+            return self.cumulative[-1]
+        start, end = self.offsets[index], self.offsets[index + 1]
+        ratio = (offset - start) / (end - start)
+        return self.cumulative[index] + ratio * (self.cumulative[index + 1] - self.cumulative[index])
+
+    def tokens_before(self, offset):
+        """文本開頭至 offset 的估算 token 數"""
+        return int(self._tokens_at(offset))
+
+    def tokens_between(self, start, end):
+        """[start, end) 區段的估算 token 數"""
+        return int(self._tokens_at(end) - self._tokens_at(start))
+
+    def _interpolate(self, tokens):
+        """找出約含 tokens 個 token 的字元位置（在所屬片段內按比例內插）"""
+        index = bisect_right(self.cumulative, tokens) - 1
+        if index >= len(self.offsets) - 1:
+            return len(self.text), self.cumulative[-1]
+        start, end = self.offsets[index], self.offsets[index + 1]
+        span_tokens = self.cumulative[index + 1] - self.cumulative[index]
+        ratio = (tokens - self.cumulative[index]) / span_tokens if span_tokens else 0
+        return start + int((end - start) * ratio), tokens
+
+    def cut_offset(self, max_tokens):
+        """不超過 max_tokens 的最後一個句子或段落邊界；第一句就超過時按比例截斷"""
+        if max_tokens >= self.cumulative[-1]:
+            return len(self.text)
+        index = bisect_right(self.cumulative, max_tokens) - 1
+        if index > 0:
+            return self.offsets[index]
+        return self._interpolate(max_tokens)[0]
+
+    def truncate(self, max_tokens):
+        """將文本截斷至約 max_tokens 個 token，盡量停在句子或段落結尾"""
+        return self.text[:self.cut_offset(max_tokens)]
+
+    def split_spans(self, max_tokens, start=0, end=None):
+        """
+        將 [start, end) 切成 token 數大致相等的 (start, end) 區段（預設為整份文本）
+
+        與原本按字元數切分的邏輯相同：優先在區段後半的段落結尾切割，
+        其次是句子結尾，都找不到時才按比例硬切。切點往前退到邊界後剩餘的 token 可能
+        超過原定塊數能容納的量，因此每切一刀都依剩餘 token 重算塊數，每塊都不超過 max_tokens。
+        """
+        if end is None:
+            end = len(self.text)
+        start_tokens = self._tokens_at(start)
+        end_tokens = self._tokens_at(end)
+        if end_tokens - start_tokens <= max_tokens:
+            return [(start, end)]
+
+        spans = []
+        while end_tokens - start_tokens > max_tokens:
+            # 每次依剩餘 token 重新計算塊數並平均，避免切點偏前的誤差全部累積到最後一塊
+            remaining_chunks = math.ceil((end_tokens - start_tokens) / max_tokens)
+            target = (end_tokens - start_tokens) / remaining_chunks
+            goal = start_tokens + target
+            half = start_tokens + target / 2
+
+            index = bisect_right(self.paragraph_cumulative, goal) - 1
+            if start < self.paragraph_offsets[index] < end and self.paragraph_cumulative[index] > half:
+                cut, cut_tokens = self.paragraph_offsets[index], self.paragraph_cumulative[index]
+            else:
+                index = bisect_right(self.cumulative, goal) - 1
+                if start < self.offsets[index] < end and self.cumulative[index] > half:
+                    cut, cut_tokens = self.offsets[index], self.cumulative[index]
+                else:
+                    cut, cut_tokens = self._interpolate(goal)
+
+            spans.append((start, cut))
+            start, start_tokens = cut, cut_tokens
+
+        spans.append((start, end))
+        return spans
+
+    def split(self, max_tokens):
+        """依 split_spans 的切點回傳文本片段列表"""
+        return [self.text[start:end] for start, end in self.split_spans(max_tokens)]
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DeepSeek 用量帳本
+
+每次呼叫 DeepSeek API（包括重試中的每一次嘗試與回應快取命中）都會在 JSONL 帳本中追加一筆紀錄：
+書籍、分析階段／報告部分、prompt／completion／前綴快取命中 token 數、耗時、HTTP 狀態與嘗試次數。
+書籍與階段以 contextvars 標示，由各腳本在處理書籍與送出各部分請求時設定。
+
+彙總報告：
+    python usage_ledger.py report                  # 依書籍、部分類型與執行批次彙總
+    python usage_ledger.py report --by section --run last
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from pathlib import Path
+from retry_policy import current_attempt
+
+logger = logging.getLogger(__name__)
+
+# ==========================
+# 配置與常數設定
+# ==========================
+# 設為 0 可停用用量帳本
+USAGE_LEDGER_ENABLED = os.getenv("USAGE_LEDGER", "1") == "1"
+USAGE_LEDGER_PATH = os.getenv("USAGE_LEDGER_PATH", str(Path.home() / ".cache" / "deepseek-book-analyzer" / "usage.jsonl"))
+
+# 每百萬 token 的價格（美元），依 DeepSeek 官方價目表調整
+PRICE_INPUT = float(os.getenv("DEEPSEEK_PRICE_INPUT", "0.28"))  # 未命中快取的輸入
+PRICE_CACHED_INPUT = float(os.getenv("DEEPSEEK_PRICE_CACHED_INPUT", "0.028"))  # 命中快取的輸入
+PRICE_OUTPUT = float(os.getenv("DEEPSEEK_PRICE_OUTPUT", "0.42"))
+
+# 本次執行的識別碼，同一次執行的所有紀錄共用
+RUN_ID = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+
+# 目前呼叫所屬的書籍與階段（book、section）
+_call_fields = contextvars.ContextVar("usage_call_fields", default={})
+
+def set_call_context(**fields):
+    """設定目前執行緒之後所有呼叫的標示（開始處理一本書時呼叫，取代先前的標示）"""
+    _call_fields.set(dict(fields))
+
+@contextmanager
+def call_context(**fields):
+    """在 with 區塊內為呼叫加上標示"""
+    token = _call_fields.set({**_call_fields.get(), **fields})
+    try:
+        yield
+    finally:
+        _call_fields.reset(token)
+
+def labeled(func, **fields):
+    """
+    包裝 func，執行時帶有「目前的標示加上 fields」
+
+    執行緒池的工作執行緒不會繼承提交者的 contextvars，提交前先以 labeled 包裝即可保留書籍名稱。
+    """
+    captured = {**_call_fields.get(), **fields}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _call_fields.set(captured)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _call_fields.reset(token)
+    return wrapper
+
+class UsageLedger:
+    """以 JSONL 追加寫入呼叫紀錄；每筆一行、單次寫入，多執行緒與多行程可同時追加"""
+
+    def __init__(self, path=USAGE_LEDGER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, payload, usage=None, latency=0.0, status=None, error=None, cached=False):
+        """追加一筆呼叫紀錄"""
+        fields = _call_fields.get()
+        usage = usage or {}
+        entry = {
+            "ts": round(time.time(), 3),
+            "run": RUN_ID,
+            "book": fields.get("book"),
+            "section": fields.get("section"),
+            "model": payload.get("model"),
+            "attempt": current_attempt.get(),
+            "status": status,
+            "error": str(error)[:200] if error is not None else None,
+            "cached": cached,
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "cache_hit_tokens": usage.get("prompt_cache_hit_tokens", 0),
+            "latency": round(latency, 3),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        try:
+            with self._lock:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            logger.warning(f"寫入用量帳本失敗: {e}")
+
+    def entries(self):
+        """讀取所有紀錄，略過損毀的行"""
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+        return entries
+
+# 所有 DeepSeek 呼叫共用的帳本（停用時為 None）
+usage_ledger = UsageLedger() if USAGE_LEDGER_ENABLED else None
+
+def record_call(payload, usage=None, latency=0.0, status=None, error=None, cached=False):
+    """帳本啟用時追加一筆紀錄（HTTP 狀態未提供時沿用例外的 status 屬性）"""
+    if usage_ledger is None:
+        return
+    if status is None and error is not None:
+        status = getattr(error, "status", None)
+    usage_ledger.record(payload, usage, latency, status, error, cached)
+
+# ==========================
+# 彙總報告
+# ==========================
+def entry_cost(entry):
+    """單筆紀錄的費用（美元）；快取命中的回應不計費"""
+    if entry.get("cached"):
+        return 0.0
+    hit = entry.get("cache_hit_tokens") or 0
+    miss = max(0, (entry.get("prompt_tokens") or 0) - hit)
+    return (miss * PRICE_INPUT + hit * PRICE_CACHED_INPUT
+            + (entry.get("completion_tokens") or 0) * PRICE_OUTPUT) / 1_000_000
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def aggregate(entries, field):
+    """依欄位分組彙總，回傳依費用由高到低排序的 [(值, 統計)]"""
+    groups = {}
+    for entry in entries:
+        groups.setdefault(entry.get(field) or "(未標示)", []).append(entry)
+
+    rows = []
+    for name, group in groups.items():
+        api_calls = [e for e in group if not e.get("cached")]
+        latencies = [e["latency"] for e in api_calls if e.get("status") == 200]
+        rows.append((name, {
+            "calls": len(group),
+            "cached": len(group) - len(api_calls),
+            "retries": sum(1 for e in api_calls if (e.get("attempt") or 1) > 1),
+            "errors": sum(1 for e in api_calls if e.get("status") != 200),
+            "prompt_tokens": sum(e.get("prompt_tokens") or 0 for e in group if not e.get("cached")),
+            "completion_tokens": sum(e.get("completion_tokens") or 0 for e in group if not e.get("cached")),
+            "cache_hit_tokens": sum(e.get("cache_hit_tokens") or 0 for e in group if not e.get("cached")),
+            "cost": sum(entry_cost(e) for e in group),
+            "latency_avg": sum(latencies) / len(latencies) if latencies else 0.0,
+            "latency_p95": percentile(latencies, 0.95),
+        }))
+    rows.sort(key=lambda row: row[1]["cost"], reverse=True)
+    return rows
+
+def print_report(entries, field, title):
+    rows = aggregate(entries, field)
+    print(f"\n== 依{title}彙總 ==")
+    print(f"{'呼叫':>6} {'快取':>5} {'重試':>5} {'錯誤':>5} {'輸入tokens':>11} {'命中tokens':>11} "
+          f"{'輸出tokens':>11} {'費用(USD)':>10} {'平均秒':>7} {'P95秒':>7}  {title}")
+    for name, s in rows:
+        print(f"{s['calls']:>6} {s['cached']:>5} {s['retries']:>5} {s['errors']:>5} {s['prompt_tokens']:>11} "
+              f"{s['cache_hit_tokens']:>11} {s['completion_tokens']:>11} {s['cost']:>10.4f} "
+              f"{s['latency_avg']:>7.1f} {s['latency_p95']:>7.1f}  {name}")
+
+REPORT_GROUPS = {"book": "書籍", "section": "部分類型", "run": "執行批次"}
+
+def main():
+    parser = argparse.ArgumentParser(description='DeepSeek 用量帳本')
+    parser.add_argument('--path', default=USAGE_LEDGER_PATH, help='帳本檔案路徑')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report_parser = subparsers.add_parser('report', help='依書籍、部分類型與執行批次彙總費用與耗時')
+    report_parser.add_argument('--by', choices=sorted(REPORT_GROUPS), action='append',
+                               help='彙總方式，可重複指定（預設全部）')
+    report_parser.add_argument('--run', help='只統計指定的執行批次（last 代表最近一次）')
+    report_parser.add_argument('--book', help='只統計書名包含此字串的紀錄')
+    args = parser.parse_args()
+
+    entries = UsageLedger(args.path).entries()
+    if args.run:
+        run = args.run
+        if run == "last" and entries:
+            run = max(entries, key=lambda e: e.get("ts", 0)).get("run")
+        entries = [e for e in entries if e.get("run") == run]
+    if args.book:
+        entries = [e for e in entries if args.book in (e.get("book") or "")]
+    if not entries:
+        print(f"帳本中沒有符合條件的紀錄: {args.path}")
+        return 1
+
+    print(f"共 {len(entries)} 筆紀錄，總費用約 {sum(entry_cost(e) for e in entries):.4f} USD"
+          f"（輸入 {PRICE_INPUT}／命中 {PRICE_CACHED_INPUT}／輸出 {PRICE_OUTPUT} USD 每百萬 tokens）")
+    for field in args.by or ["book", "section", "run"]:
+        print_report(entries, field, REPORT_GROUPS[field])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())